@@ -2,6 +2,7 @@
 source venv/bin/activate
 
 mypy src/
+python -m pytest -q tests
 pylint src/ --disable=missing-docstring,too-few-public-methods,too-many-locals,too-many-instance-attributes
 
 
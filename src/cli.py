@@ -1,7 +1,67 @@
 import argparse
+import os
+import subprocess
+import sys
+from typing import Union
+
+# Only the option lists are imported up front, every command imports what it
+# needs itself so the ones that never run the network start without TensorFlow
+from engine.metrics import METRICS_FORMATS, last_logged, metrics_dir
+from engine.options import PRECISIONS, QUANTIZATIONS
+
+
+def positive_float(value: str) -> float:
+    number = float(value)
+    if number <= 0:
+        raise argparse.ArgumentTypeError(f"{value} is not a positive number")
+    return number
+
+
+def add_search_arguments(subparser):
+    subparser.add_argument(
+        "--search_nodes", type=int, default=0, help="Positions evaluated by the search per move, 0 plays straight from the policy"
+    )
+    subparser.add_argument(
+        "--search_time", type=positive_float, default=1.0, help="Time limit in seconds for the search per move, the clock scales it in Lichess games"
+    )
+    subparser.add_argument(
+        "--search_top_k", type=int, default=8, help="Number of policy moves explored in every searched position"
+    )
+
+
+def add_precision_arguments(subparser):
+    subparser.add_argument(
+        "--precision", type=str, default="float32", choices=PRECISIONS, help="Keras dtype policy, the output logits always stay float32"
+    )
+    subparser.add_argument(
+        "--xla", action="store_true", help="Compile the forward pass (and training step) with XLA"
+    )
+
+
+def add_backend_argument(subparser):
+    subparser.add_argument(
+        "--backend",
+        type=str,
+        default="keras",
+        choices=["keras", "tflite"],
+        help="Run forward passes through the Keras model or its TFLite export in models/<model>.tflite",
+    )
+
+
+def load_model(args):
+    if args.backend == "tflite":
+        from engine import TFLiteModel
+        return TFLiteModel.load(args.model)
+
+    from engine import Model
+    return Model.load(args.model, precision=args.precision, jit_compile=args.xla)
+
+
+def search_options(args):
+    if args.search_nodes <= 0:
+        return None
+    return {"nodes": args.search_nodes, "time_limit": args.search_time, "top_k": args.search_top_k}
 
-from engine import Engine, Model, InfiniteDataset, Evaluator
-from lichess_bot import LichessBot
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Interact with the Blundernet project!")
@@ -26,6 +86,153 @@ if __name__ == "__main__":
         default=128,
         help="Batch size for the training process",
     )
+    train_parser.add_argument(
+        "--workers",
+        type=int,
+        default=0,
+        help="Number of processes parsing PGN files in the background, 0 parses on the training thread",
+    )
+    train_parser.add_argument(
+        "--queue_size",
+        type=int,
+        default=4,
+        help="Maximum number of prepared chunks waiting for the training loop",
+    )
+    train_parser.add_argument(
+        "--shards",
+        type=str,
+        default=None,
+        help="Train from preprocessed binary shards in this directory instead of parsing PGN files",
+    )
+    train_parser.add_argument(
+        "--distill",
+        action="store_true",
+        help="Train on Stockfish's move distribution for the sampled positions instead of the move played",
+    )
+    train_parser.add_argument(
+        "--distill_processes",
+        type=int,
+        default=None,
+        help="Number of Stockfish processes labelling positions for --distill, defaults to one per core",
+    )
+    train_parser.add_argument(
+        "--distill_depth",
+        type=int,
+        default=5,
+        help="Stockfish search depth for the --distill targets",
+    )
+    train_parser.add_argument(
+        "--distill_temperature",
+        type=float,
+        default=100.0,
+        help="Softmax temperature in centipawns for the --distill targets, higher spreads probability over more moves",
+    )
+    train_parser.add_argument(
+        "--tf_data",
+        action="store_true",
+        help="Feed the model through a prefetching tf.data pipeline in a single long fit, fed by the --workers processes when set",
+    )
+    train_parser.add_argument(
+        "--steps_per_epoch",
+        type=int,
+        default=None,
+        help="Batches per epoch when using --tf_data, defaults to one chunk of positions",
+    )
+    train_parser.add_argument(
+        "--checkpoint_steps",
+        type=int,
+        default=None,
+        help="Write a checkpoint after this many training steps",
+    )
+    train_parser.add_argument(
+        "--checkpoint_minutes",
+        type=float,
+        default=10,
+        help="Write a checkpoint after this many minutes of training, 0 disables",
+    )
+    train_parser.add_argument(
+        "--checkpoint_best",
+        action="store_true",
+        help="Write a checkpoint whenever the validation loss (or training loss without --validation) improves",
+    )
+    train_parser.add_argument(
+        "--keep_checkpoints",
+        type=int,
+        default=3,
+        help="Number of rotating checkpoints kept in models/checkpoints/<name>, 0 keeps all",
+    )
+    train_parser.add_argument(
+        "--value_head",
+        action="store_true",
+        help="Give a newly created model a value head trained on game results next to the policy",
+    )
+    train_parser.add_argument(
+        "--value_weight",
+        type=float,
+        default=0.5,
+        help="Weight of the value loss relative to the policy loss for a new --value_head model",
+    )
+    train_parser.add_argument(
+        "--metrics",
+        type=str,
+        nargs="*",
+        default=["jsonl"],
+        choices=METRICS_FORMATS,
+        help="Where the metrics of every chunk are written, live_plot draws on the training thread",
+    )
+    train_parser.add_argument(
+        "--metrics_dir",
+        type=str,
+        default=None,
+        help="Directory for metrics.jsonl, metrics.csv and the TensorBoard events, defaults to logs/<name>",
+    )
+    train_parser.add_argument(
+        "--plot",
+        action="store_true",
+        help="Show live accuracy and loss plots in a separate viewer process that follows metrics.jsonl",
+    )
+    train_parser.add_argument(
+        "--validation",
+        type=str,
+        default=None,
+        help="Evaluation set in tests/evaluation used as validation data, e.g. random.npz",
+    )
+
+    add_precision_arguments(train_parser)
+
+    plot_parser = subparsers.add_parser("plot", help="Plot the metrics of a training run while it is written")
+    plot_parser.add_argument(
+        "--log",
+        type=str,
+        required=True,
+        help="metrics.jsonl written by train, e.g. logs/<name>/metrics.jsonl",
+    )
+    plot_parser.add_argument(
+        "--interval",
+        type=float,
+        default=2.0,
+        help="Seconds between checks for new lines",
+    )
+
+    preprocess_parser = subparsers.add_parser("preprocess", help="Convert PGN files into binary training shards")
+    preprocess_parser.add_argument(
+        "--dir",
+        type=str,
+        default="training_data",
+        help="Directory containing the PGN files to convert",
+    )
+    preprocess_parser.add_argument(
+        "--out",
+        type=str,
+        default="training_shards",
+        help="Directory the shards are written to",
+    )
+    preprocess_parser.add_argument(
+        "--shard_size",
+        type=int,
+        default=1000000,
+        help="Number of positions stored in each shard",
+    )
 
     lichess_parser = subparsers.add_parser("lichess", help="Host Lichess Bot")
     lichess_parser.add_argument(
@@ -34,39 +241,261 @@ if __name__ == "__main__":
     lichess_parser.add_argument(
     "--stats", action="store_true", help="Show account statistics"
     )
+    lichess_parser.add_argument(
+        "--max_games", type=int, default=5, help="Maximum number of games played at the same time"
+    )
+    lichess_parser.add_argument(
+        "--inference_workers", type=int, default=8, help="Threads running forward passes for the games, every other part of the bot runs on one event loop"
+    )
+    lichess_parser.add_argument(
+        "--max_batch_size", type=int, default=16, help="Maximum number of positions evaluated in one forward pass"
+    )
+    lichess_parser.add_argument(
+        "--batch_window_ms", type=float, default=5, help="How long the first position of a batch waits for others"
+    )
+    lichess_parser.add_argument(
+        "--cache_mb", type=float, default=64, help="Memory cap for cached policy outputs, 0 disables the cache"
+    )
+    lichess_parser.add_argument(
+        "--ponder_top_k", type=int, default=0, help="Precompute our answers to this many of the opponent's likely replies during their turn, 0 disables pondering"
+    )
+    lichess_parser.add_argument(
+        "--ponder_workers", type=int, default=2, help="Threads pondering runs on, separate from --inference_workers so real moves never wait behind it"
+    )
+    add_search_arguments(lichess_parser)
+    add_precision_arguments(lichess_parser)
+    add_backend_argument(lichess_parser)
 
     game_parser = subparsers.add_parser("game", help="Play against the models via Pygame GUI")
+    add_search_arguments(game_parser)
     eval_parser = subparsers.add_parser("eval", help="Evaluate a model")
     eval_parser.add_argument(
         "--model", type=str, default="blundernet", help="Model to evaluate"
     )
+    eval_parser.add_argument(
+        "--batch_size", type=int, default=256, help="Positions read and evaluated at a time"
+    )
+    eval_parser.add_argument(
+        "--top_k", type=int, default=3, help="Count a prediction as top-k correct when the move is among the k highest logits"
+    )
+    add_precision_arguments(eval_parser)
+    add_backend_argument(eval_parser)
+    eval_parser.add_argument(
+        "--report", type=str, default=None, help="Path of the JSON report, defaults to tests/evaluation/reports/<model>.json"
+    )
     
+    testset_parser = subparsers.add_parser("testset", help="Generate the evaluation sets with Stockfish")
+    testset_parser.add_argument(
+        "--pgn", type=str, nargs="+", default=["tests/evaluation/testset.pgn"], help="PGN files the game positions are drawn from"
+    )
+    testset_parser.add_argument(
+        "--num_games", type=int, default=None, help="Number of games sampled from the PGN files, defaults to one more than --num_tests"
+    )
+    testset_parser.add_argument(
+        "--num_tests", type=int, default=5000, help="Number of positions in each set"
+    )
+    testset_parser.add_argument(
+        "--seed", type=int, default=0, help="Seed for picking positions, the same seed gives the same sets"
+    )
+    testset_parser.add_argument(
+        "--processes", type=int, default=None, help="Number of Stockfish processes labelling in parallel, defaults to one per core"
+    )
+    testset_parser.add_argument(
+        "--threads", type=int, default=1, help="Search threads for each Stockfish process, more than one makes the sets differ between runs"
+    )
+    testset_parser.add_argument(
+        "--hash_mb", type=int, default=16, help="Hash table size in MB for each Stockfish process"
+    )
+    testset_parser.add_argument(
+        "--label_cache",
+        type=str,
+        default=os.path.join("tests", "evaluation", "stockfish_labels.sqlite"),
+        help="SQLite file Stockfish results are stored in and reused from, empty string disables it",
+    )
+
+    export_parser = subparsers.add_parser("export", help="Export a trained model to quantized TFLite")
+    export_parser.add_argument(
+        "--model", type=str, default="blundernet", help="Model to export"
+    )
+    export_parser.add_argument(
+        "--quantization", type=str, default="int8", choices=QUANTIZATIONS, help="int8 also quantizes activations, dynamic only the weights"
+    )
+    export_parser.add_argument(
+        "--calibration_positions", type=int, default=1000, help="Positions from tests/evaluation used to calibrate int8 activations"
+    )
+    export_parser.add_argument(
+        "--out", type=str, default=None, help="Path of the exported model, defaults to models/<model>.tflite"
+    )
+
+    bench_parser = subparsers.add_parser("bench", help="Measure per-move inference latency")
+    bench_parser.add_argument(
+        "--model", type=str, default="blundernet", help="Model to benchmark"
+    )
+    bench_parser.add_argument(
+        "--positions", type=int, default=200, help="Number of positions to time"
+    )
+    bench_parser.add_argument(
+        "--tflite", action="store_true", help="Also time the TFLite export in models/<model>.tflite"
+    )
+    bench_parser.add_argument(
+        "--startup", action="store_true", help="Only time how long every subcommand takes to import what it needs, no model is loaded"
+    )
+    bench_parser.add_argument(
+        "--lichess_games", type=int, default=0, help="Play this many games at once against a local fake Lichess server instead"
+    )
+    bench_parser.add_argument(
+        "--lichess_plies", type=int, default=40, help="Length of every game played with --lichess_games"
+    )
+    bench_parser.add_argument(
+        "--lichess_clock", type=float, default=None, help="Seconds on the bot's clock in every game played with --lichess_games, no clock by default"
+    )
+    bench_parser.add_argument(
+        "--lichess_ponder_top_k", type=int, default=0, help="Ponder this many replies in the games played with --lichess_games"
+    )
+    bench_parser.add_argument(
+        "--lichess_opponent", choices=["random", "policy"], default="random", help="Opponent in the games played with --lichess_games, policy plays the model's top move"
+    )
+    bench_parser.add_argument(
+        "--postprocess", action="store_true", help="Only time the legal move post-processing, no model is loaded"
+    )
+
     args = parser.parse_args()
 
     if args.command == "train":
-        model = Model.load(args.name if args.name != "null" else None)
-        dataset = InfiniteDataset(model, args.dir)
-        model.train(dataset, args.batch_size)
+        import numpy as np
+
+        from engine import Checkpointer, DistillationDataset, InfiniteDataset, Model, ShardDataset, create_sinks
+        from utils import UCI_DICT, Logger
+
+        model = Model.load(
+            args.name if args.name != "null" else None, args.value_head, args.value_weight, args.precision, args.xla
+        )
+        # Recompiled before the checkpointer copies the compile config
+        model.compile_policy_loss(args.distill)
+        source: Union[DistillationDataset, ShardDataset, InfiniteDataset]
+        if args.distill:
+            source = DistillationDataset(
+                model, args.dir, args.distill_processes, args.distill_depth, args.distill_temperature
+            )
+        elif args.shards:
+            source = ShardDataset(args.shards)
+        else:
+            source = InfiniteDataset(model, args.dir, args.workers, args.queue_size)
+
+        dataset = source.as_tf_dataset(args.batch_size, with_values=model.has_value_head) if args.tf_data else source
+
+        validation_data = None
+        if args.validation:
+            validation_set = np.load(os.path.join("tests", "evaluation", args.validation), allow_pickle=True)
+            labels = validation_set["y"]
+            if model.soft_targets:
+                labels = np.eye(len(UCI_DICT), dtype=np.float32)[labels]
+
+            if model.has_value_head and "v" not in validation_set.files:
+                # Move indices tell Model.train to validate the policy on its own
+                Logger.warning(f"{args.validation} has no game results, only the policy head is validated")
+                validation_data = (validation_set["X"], validation_set["y"])
+            elif model.has_value_head:
+                validation_data = (validation_set["X"], model.targets(labels, validation_set["v"]))
+            else:
+                validation_data = (validation_set["X"], labels)
+
+        checkpointer = Checkpointer(
+            model.model,
+            model.name,
+            every_steps=args.checkpoint_steps,
+            every_seconds=args.checkpoint_minutes * 60 or None,
+            monitor=("val_loss" if validation_data else "loss") if args.checkpoint_best else None,
+            keep=args.keep_checkpoints,
+        )
+        directory = args.metrics_dir or metrics_dir(model.name)
+        start_step, start_positions = last_logged(directory)
+        if start_step:
+            Logger.info(f"Continuing the metrics in {directory} from chunk {start_step}")
+        formats = list(dict.fromkeys(args.metrics + (["jsonl"] if args.plot else [])))
+        sinks = create_sinks(formats, model.name, directory)
+        if args.plot:
+            # Drawing happens in its own process, a slow or missing display never stalls training
+            subprocess.Popen([sys.executable, os.path.abspath(__file__), "plot", "--log", os.path.join(directory, "metrics.jsonl")])  # pylint: disable=consider-using-with
+
+        model.train(
+            dataset, args.batch_size, args.steps_per_epoch, checkpointer, validation_data, sinks, start_step, start_positions
+        )
+
+    elif args.command == "plot":
+        from engine.live_plot import LivePlot
+        LivePlot.follow(args.log, args.interval)
+
+    elif args.command == "preprocess":
+        from engine import write_shards
+        write_shards(args.dir, args.out, args.shard_size)
 
     elif args.command == "lichess":
-        model = args.model
+        from lichess_bot import LichessBot
 
-        engine = Engine(Model.load(args.model))
         token = None # pylint: disable=invalid-name
 
         with open(".token", "r", encoding="utf-8") as data:
             token = data.read().strip()
 
-        
-        bot = LichessBot(engine, token)
         if args.stats:
-            bot.stats()
+            LichessBot.stats(token)
         else:
-            bot.run()
+            from engine import MCTS, Engine, InferenceServer, PolicyCache
+
+            model = load_model(args)
+            inference_server = InferenceServer(model, args.max_batch_size, args.batch_window_ms / 1000)
+            cache = PolicyCache(int(args.cache_mb * 1024 * 1024)) if args.cache_mb > 0 else None
+            options = search_options(args)
+            searcher = MCTS(model, **options) if options else None
+            engine = Engine(model, inference_server, cache, searcher)
+
+            LichessBot(engine, token, args.max_games, args.inference_workers, ponder_top_k=args.ponder_top_k, ponder_workers=args.ponder_workers).run()
 
     elif args.command == "game":
         from game import Game
-        Game().run()
+        Game(search_options(args)).run()
         
     elif args.command == "eval":
-        Evaluator().evaluate(Model.load(args.model))
+        from engine import Evaluator, Model
+
+        baseline = None
+        if args.precision != "float32" or args.xla or args.backend != "keras":
+            baseline = Model.load(args.model)
+        model = load_model(args)
+        Evaluator().evaluate(model, args.batch_size, args.top_k, args.report, baseline)
+
+    elif args.command == "testset":
+        from engine import Evaluator
+        Evaluator.generate_testset(args.pgn, args.num_tests, args.seed, args.processes, args.threads, args.hash_mb, args.num_games, args.label_cache)
+
+    elif args.command == "export":
+        from engine import Model, export_tflite, tflite_path
+        export_tflite(Model.load(args.model), args.out or tflite_path(args.model), args.quantization, args.calibration_positions)
+
+    elif args.command == "bench":
+        from engine.benchmark import benchmark_latency, benchmark_move_selection, benchmark_startup
+        if args.startup:
+            if not all(result["ok"] for result in benchmark_startup().values()):
+                sys.exit(1)
+        elif args.lichess_games:
+            from engine import Engine, InferenceServer, Model
+
+            # The fake server is a test double, it lives with the tests and only exists in a checkout of the repo
+            sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tests"))
+            from fake_lichess_server import run_load_test  # pylint: disable=import-error
+
+            model = Model.load(args.model)
+            run_load_test(
+                Engine(model, InferenceServer(model)),
+                args.lichess_games,
+                args.lichess_plies,
+                clock=args.lichess_clock,
+                ponder_top_k=args.lichess_ponder_top_k,
+                opponent_engine=Engine(model) if args.lichess_opponent == "policy" else None,
+            )
+        elif args.postprocess:
+            benchmark_move_selection(args.positions)
+        else:
+            from engine import Model, TFLiteModel
+            benchmark_latency(Model.load(args.model), args.positions, TFLiteModel.load(args.model) if args.tflite else None)
@@ -1,7 +1,60 @@
-from .engine import Engine
-from .infinite_dataset import InfiniteDataset
-from .model import Model
-from .stockfish import Stockfish
-from .evaluator import Evaluator
+import importlib
+from typing import TYPE_CHECKING
 
-__all__ = ["Engine", "Model", "InfiniteDataset", "Evaluator"]
+# Submodules are only imported when one of their names is first used, so
+# commands that never touch the network don't pay for loading TensorFlow
+_EXPORTS = {
+    "Engine": "engine",
+    "InfiniteDataset": "infinite_dataset",
+    "DistillationDataset": "distillation_dataset",
+    "ShardDataset": "shard_dataset",
+    "write_shards": "shard_dataset",
+    "Model": "model",
+    "PRECISIONS": "options",
+    "QUANTIZATIONS": "options",
+    "InferenceServer": "inference_server",
+    "PolicyCache": "policy_cache",
+    "MCTS": "search",
+    "Checkpointer": "checkpointer",
+    "MetricsSink": "metrics",
+    "JsonlSink": "metrics",
+    "CsvSink": "metrics",
+    "TensorBoardSink": "metrics",
+    "create_sinks": "metrics",
+    "LabelCache": "label_cache",
+    "Stockfish": "stockfish",
+    "StockfishPool": "stockfish_pool",
+    "Evaluator": "evaluator",
+    "TFLiteModel": "tflite_model",
+    "export_tflite": "tflite_model",
+    "tflite_path": "tflite_model",
+}
+
+if TYPE_CHECKING:
+    from .engine import Engine
+    from .infinite_dataset import InfiniteDataset
+    from .distillation_dataset import DistillationDataset
+    from .shard_dataset import ShardDataset, write_shards
+    from .model import Model
+    from .options import PRECISIONS, QUANTIZATIONS
+    from .inference_server import InferenceServer
+    from .policy_cache import PolicyCache
+    from .search import MCTS
+    from .checkpointer import Checkpointer
+    from .metrics import CsvSink, JsonlSink, MetricsSink, TensorBoardSink, create_sinks
+    from .label_cache import LabelCache
+    from .stockfish import Stockfish
+    from .stockfish_pool import StockfishPool
+    from .evaluator import Evaluator
+    from .tflite_model import TFLiteModel, export_tflite, tflite_path
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{_EXPORTS[name]}", __name__), name)
+    globals()[name] = value
+    return value
+
+
+__all__ = ["Engine", "Model", "PRECISIONS", "Checkpointer", "MetricsSink", "JsonlSink", "CsvSink", "TensorBoardSink", "create_sinks", "InferenceServer", "PolicyCache", "MCTS", "InfiniteDataset", "DistillationDataset", "ShardDataset", "write_shards", "StockfishPool", "LabelCache", "Evaluator", "TFLiteModel", "export_tflite", "tflite_path", "QUANTIZATIONS"]
@@ -0,0 +1,176 @@
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from typing import TYPE_CHECKING, Callable, Dict, List
+
+import chess
+import numpy as np
+
+from utils import UCI_DICT, Logger
+from .engine import Engine, softmax
+
+if TYPE_CHECKING:
+    from .model import Model
+
+# aiohttp.web only serves the fake Lichess server of the load test
+HEAVY_MODULES = ["tensorflow", "matplotlib", "tqdm", "aiohttp.web"]
+
+# Modules each subcommand imports before it starts working, and the heavy ones it
+# is allowed to pull in. Some TensorFlow builds import matplotlib themselves.
+_WITH_TENSORFLOW = ["tensorflow", "matplotlib"]
+STARTUP_PROBES = {
+    "cli": ([], []),
+    "lichess --stats": (["lichess_bot", "lichess_bot.api_client"], []),
+    "lichess --backend tflite": (["engine.tflite_model", "engine.engine", "engine.inference_server", "engine.policy_cache", "engine.search", "lichess_bot"], []),
+    "lichess": (["engine.model", "engine.engine", "engine.inference_server", "engine.policy_cache", "engine.search", "lichess_bot"], _WITH_TENSORFLOW),
+    "preprocess": (["engine.shard_dataset"], ["tqdm"]),
+    "testset": (["engine.evaluator"], ["tqdm"]),
+    "eval": (["engine.evaluator", "engine.model", "engine.tflite_model"], _WITH_TENSORFLOW + ["tqdm"]),
+    "export": (["engine.model", "engine.tflite_model"], _WITH_TENSORFLOW),
+    "train": (["engine.model", "engine.checkpointer", "engine.metrics", "engine.infinite_dataset", "engine.distillation_dataset", "engine.shard_dataset"], _WITH_TENSORFLOW + ["tqdm"]),
+    "plot": (["engine.live_plot"], ["matplotlib"]),
+    "bench --startup": (["engine.benchmark"], []),
+}
+
+_STARTUP_PROBE = """
+import importlib, json, resource, sys
+sys.path.insert(0, {src!r})
+import cli
+for module in {modules!r}:
+    importlib.import_module(module)
+print(json.dumps({{
+    "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    "heavy": [name for name in {heavy!r} if name in sys.modules],
+}}))
+"""
+
+
+def sample_boards(num_positions: int, seed: int = 0) -> List[chess.Board]:
+    """Positions from random games, restarting whenever a game ends."""
+    rng = random.Random(seed)
+    boards: List[chess.Board] = []
+    board = chess.Board()
+
+    while len(boards) < num_positions:
+        if board.is_game_over() or board.ply() > 120:
+            board = chess.Board()
+
+        board.push(rng.choice(list(board.legal_moves)))
+        if not board.is_game_over():
+            boards.append(board.copy())
+
+    return boards
+
+
+def measure(function: Callable, inputs: List, warmup: int = 5) -> np.ndarray:
+    """Latency of each call in milliseconds."""
+    for item in inputs[:warmup]:
+        function(item)
+
+    timings = []
+    for item in inputs:
+        started = time.perf_counter()
+        function(item)
+        timings.append((time.perf_counter() - started) * 1000)
+
+    return np.array(timings)
+
+
+def summarize(name: str, timings: np.ndarray) -> Dict[str, float]:
+    p50, p99 = np.percentile(timings, [50, 99])
+    Logger.info(f"{name.ljust(28)} p50 {p50:8.3f} ms   p99 {p99:8.3f} ms   mean {timings.mean():8.3f} ms")
+    return {"p50": float(p50), "p99": float(p99), "mean": float(timings.mean())}
+
+
+def benchmark_latency(model: "Model", num_positions: int = 200, tflite_model=None) -> Dict[str, Dict[str, float]]:
+    boards = sample_boards(num_positions)
+    matrices = [np.expand_dims(model.board_to_matrix(board), axis=0) for board in boards]
+    engine = Engine(model)
+
+    Logger.info(f"Measuring per-move latency over {num_positions} positions")
+    results = {
+        "keras_predict": summarize("Keras model.predict", measure(lambda x: model.model.predict(x, verbose=0), matrices)),
+        "compiled_forward": summarize("Compiled forward pass", measure(model.predict_matrices, matrices)),
+        "make_move": summarize("Engine.make_move", measure(engine.make_move, boards)),
+    }
+
+    if tflite_model is not None:
+        tflite_engine = Engine(tflite_model)
+        results["tflite_forward"] = summarize("TFLite forward pass", measure(tflite_model.predict_matrices, matrices))
+        results["tflite_make_move"] = summarize("Engine.make_move (TFLite)", measure(tflite_engine.make_move, boards))
+
+    return results
+
+
+def _uci_lookup_probabilities(board: chess.Board, logits: np.ndarray):
+    """The per-move string lookup Engine.make_move used before the index table, kept as a baseline."""
+    move_logits = []
+    for move in board.legal_moves:
+        move_index = UCI_DICT.get(move.uci())
+        if move_index is not None:
+            move_logits.append((move, logits[move_index]))
+
+    moves, move_scores = zip(*move_logits)
+    move_probabilities = list(zip(moves, softmax(np.array(move_scores))))
+    move_probabilities.sort(key=lambda x: x[1], reverse=True)
+    return move_probabilities
+
+
+def benchmark_move_selection(num_positions: int = 2000) -> Dict[str, Dict[str, float]]:
+    """Cost of turning policy logits into sorted legal move probabilities, no model needed."""
+    rng = np.random.default_rng(0)
+    cases = [
+        (board, rng.standard_normal(len(UCI_DICT)).astype(np.float32))
+        for board in sample_boards(num_positions)
+    ]
+
+    Logger.info(f"Measuring legal move post-processing over {num_positions} positions")
+    return {
+        "legal_move_generation": summarize("Legal move generation only", measure(lambda case: list(case[0].legal_moves), cases)),
+        "uci_lookup": summarize("UCI string lookups", measure(lambda case: _uci_lookup_probabilities(*case), cases)),
+        "index_table": summarize("Index table + masked softmax", measure(lambda case: Engine.legal_move_probabilities(*case), cases)),
+    }
+
+
+def benchmark_startup(repeats: int = 3) -> Dict[str, Dict]:
+    """Wall time and memory of a fresh interpreter importing what each subcommand needs.
+
+    A probe fails when it loads a heavy module its subcommand has no use for.
+    """
+    src = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    results: Dict[str, Dict] = {}
+
+    Logger.info(f"Measuring startup of every subcommand over {repeats} runs")
+    for name, (modules, allowed) in STARTUP_PROBES.items():
+        script = _STARTUP_PROBE.format(src=src, modules=modules, heavy=HEAVY_MODULES)
+        timings = []
+        for _ in range(repeats):
+            started = time.perf_counter()
+            process = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=False)
+            timings.append((time.perf_counter() - started) * 1000)
+
+        if process.returncode != 0:
+            error = (process.stderr.strip().splitlines() or ["no output"])[-1]
+            Logger.error(f"{name.ljust(28)} failed to import: {error}")
+            results[name] = {"median_ms": None, "max_rss_mb": None, "heavy": [], "ok": False}
+            continue
+
+        probe = json.loads(process.stdout.strip().splitlines()[-1])
+        unexpected = [module for module in probe["heavy"] if module not in allowed]
+        results[name] = {
+            "median_ms": float(np.median(timings)),
+            "max_rss_mb": probe["max_rss_mb"],
+            "heavy": probe["heavy"],
+            "ok": not unexpected,
+        }
+
+        line = f"{name.ljust(28)} {results[name]['median_ms']:8.0f} ms   {probe['max_rss_mb']:6.0f} MB   {', '.join(probe['heavy']) or '-'}"
+        if unexpected:
+            Logger.error(f"{line}   unexpected: {', '.join(unexpected)}")
+        else:
+            Logger.info(line)
+
+    return results
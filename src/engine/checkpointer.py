@@ -0,0 +1,148 @@
+import math
+import os
+import shutil
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import numpy as np
+import tensorflow as tf
+
+from utils import Logger
+
+
+class Checkpointer:
+    """Writes checkpoints from a background thread so training only pauses to copy the weights.
+
+    A checkpoint is written when any of the configured triggers fire: a number
+    of training steps, an amount of wall time, or an improvement of the
+    monitored metric. Every file is written under a temporary name and renamed
+    into place, so an interrupted write never replaces a good model.
+    """
+
+    def __init__(
+        self,
+        model: tf.keras.Model,
+        name: str,
+        directory: str = "models",
+        every_steps: Optional[int] = None,
+        every_seconds: Optional[float] = None,
+        monitor: Optional[str] = None,
+        keep: int = 3,
+    ):
+        self.model = model
+        self.model_path = os.path.join(directory, f"{name}.keras")
+        self.checkpoint_dir = os.path.join(directory, "checkpoints", name)
+        self.every_steps = every_steps
+        self.every_seconds = every_seconds
+        self.monitor = monitor
+        self.keep = keep
+
+        self.last_step = self.current_step()
+        self.last_time = time.monotonic()
+        self.best = math.inf
+
+        self.shadow: Optional[tf.keras.Model] = None
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.pending: Optional[Future] = None
+
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+
+    def current_step(self) -> int:
+        # The optimizer iteration count is restored with the model, so numbering continues across runs
+        return int(self.model.optimizer.iterations.numpy())
+
+    def update(self, logs: Dict) -> bool:
+        step = self.current_step()
+        reasons = []
+
+        if self.every_steps and step - self.last_step >= self.every_steps:
+            reasons.append(f"{step - self.last_step} steps")
+
+        if self.every_seconds and time.monotonic() - self.last_time >= self.every_seconds:
+            reasons.append(f"{time.monotonic() - self.last_time:.0f}s since last checkpoint")
+
+        is_best = False
+        if self.monitor and self.monitor in logs and logs[self.monitor] < self.best:
+            reasons.append(f"{self.monitor} improved from {self.best:.4f} to {logs[self.monitor]:.4f}")
+            self.best = logs[self.monitor]
+            is_best = True
+
+        if not reasons:
+            return False
+
+        Logger.info(f"Checkpointing at step {step}: {', '.join(reasons)}")
+        self.save(step, is_best=is_best)
+        return True
+
+    def update_batch(self) -> bool:
+        """Checks the step and time triggers after a batch, the monitored metric is only known after a chunk."""
+        if not self.every_steps and not self.every_seconds:
+            return False
+        return self.update({})
+
+    def save(self, step: Optional[int] = None, is_best: bool = False, wait: bool = False) -> None:
+        # Only one write in flight, a slow disk throttles checkpoints rather than piling up snapshots
+        if self.pending is not None:
+            self.pending.result()
+
+        step = self.current_step() if step is None else step
+        weights = [variable.numpy().copy() for variable in self.model.weights]
+        optimizer_state = [variable.numpy().copy() for variable in self.model.optimizer.variables]
+
+        self.pending = self.executor.submit(self._write, weights, optimizer_state, step, is_best)
+        self.last_step = step
+        self.last_time = time.monotonic()
+
+        if wait:
+            self.pending.result()
+
+    def close(self) -> None:
+        if self.pending is not None:
+            self.pending.result()
+        self.executor.shutdown()
+
+    def _build_shadow(self) -> tf.keras.Model:
+        shadow = tf.keras.models.clone_model(self.model)
+        shadow.compile_from_config(self.model.get_compile_config())
+        shadow.optimizer.build(shadow.trainable_variables)
+        return shadow
+
+    def _write(self, weights: List[np.ndarray], optimizer_state: List[np.ndarray], step: int, is_best: bool) -> None:
+        try:
+            if self.shadow is None:
+                self.shadow = self._build_shadow()
+
+            self.shadow.set_weights(weights)
+            for variable, value in zip(self.shadow.optimizer.variables, optimizer_state):
+                variable.assign(value)
+
+            path = os.path.join(self.checkpoint_dir, f"step_{step:09d}.keras")
+            self._atomic_save(self.shadow, path)
+            self._atomic_copy(path, self.model_path)
+            if is_best:
+                self._atomic_copy(path, os.path.join(self.checkpoint_dir, "best.keras"))
+
+            self._rotate()
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            Logger.error(f"Failed to write checkpoint at step {step}: {e}")
+
+    @staticmethod
+    def _atomic_save(model: tf.keras.Model, path: str) -> None:
+        # Keras insists on the .keras suffix, so the temporary file is hidden instead of renamed
+        tmp_path = os.path.join(os.path.dirname(path), f".{os.path.basename(path)}")
+        model.save(tmp_path)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _atomic_copy(source: str, destination: str) -> None:
+        tmp_path = os.path.join(os.path.dirname(destination), f".{os.path.basename(destination)}")
+        shutil.copyfile(source, tmp_path)
+        os.replace(tmp_path, destination)
+
+    def _rotate(self) -> None:
+        checkpoints = sorted(
+            fl for fl in os.listdir(self.checkpoint_dir) if fl.startswith("step_") and fl.endswith(".keras")
+        )
+        for filename in checkpoints[:-self.keep]:
+            os.remove(os.path.join(self.checkpoint_dir, filename))
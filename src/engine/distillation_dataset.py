@@ -0,0 +1,162 @@
+import os
+import queue
+import random
+import threading
+import time
+from typing import List, Optional
+
+import chess
+import numpy as np
+import tensorflow as tf
+
+from utils import UCI_DICT, Logger, boards_to_matrix, value_target
+from .infinite_dataset import InfiniteDataset, sample_boards
+from .label_cache import LabelCache
+from .model import Model
+from .stockfish import Stockfish
+from .stockfish_pool import StockfishPool
+
+
+class DistillationDataset(InfiniteDataset):
+    """Positions sampled like InfiniteDataset, labelled with Stockfish's move distribution instead of the move played.
+
+    A background thread keeps a pool of Stockfish processes labelling the next
+    chunks while the model trains on the current one. Targets are dense
+    probability vectors over UCI_DICT, so the model has to be compiled for soft
+    targets with Model.compile_policy_loss(True).
+    """
+
+    def __init__(
+        self,
+        model: Model,
+        data_dir: str,
+        processes: Optional[int] = None,
+        depth: int = 5,
+        temperature: float = 100.0,
+        chunk_size: int = 10000,
+        queue_size: int = 2,
+        threads: int = 1,
+        hash_mb: int = 16,
+        label_cache: Optional[str] = os.path.join("tests", "evaluation", "stockfish_labels.sqlite"),
+    ):
+        super().__init__(model, data_dir, queue_size=queue_size)
+        self.processes = processes
+        self.depth = depth
+        # Centipawns, scores this far below the best move get e times less probability
+        self.temperature = temperature
+        self.chunk_size = chunk_size
+        self.threads = threads
+        self.hash_mb = hash_mb
+        self.label_cache = label_cache
+
+    def _label(self, stockfish: Stockfish, board: chess.Board):
+        return stockfish.predict_move_distribution(board, depth=self.depth, temperature=self.temperature)
+
+    def _label_chunk(self, pool: StockfishPool, boards: List[chess.Board], values: List[float]):
+        started = time.perf_counter()
+        distributions = pool.map(self._label, boards, desc=None)
+        keep = [i for i, distribution in enumerate(distributions) if distribution]
+
+        targets = np.zeros((len(keep), len(UCI_DICT)), dtype=np.float32)
+        for row, i in enumerate(keep):
+            for move, probability in distributions[i].items():
+                targets[row, UCI_DICT[move]] = probability
+
+        Logger.info(f"Distilled {len(keep)} positions at {len(boards) / (time.perf_counter() - started):.0f} positions/sec")
+        return (
+            boards_to_matrix([boards[i] for i in keep]),
+            targets,
+            np.array([values[i] for i in keep], dtype=np.float32),
+        )
+
+    @staticmethod
+    def _put(chunks: queue.Queue, item, stop: threading.Event) -> None:
+        # Blocks while the training loop is busy, checking now and then if it went away
+        while not stop.is_set():
+            try:
+                chunks.put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def _produce(self, paths: List[str], chunks: queue.Queue, stop: threading.Event) -> None:
+        """Puts labelled chunks on the queue, or the exception that stopped it so __iter__ can raise it."""
+        try:
+            cache = LabelCache(self.label_cache) if self.label_cache else None
+            pool = StockfishPool(self.processes, threads=self.threads, hash_mb=self.hash_mb, cache=cache)
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            self._put(chunks, e, stop)
+            return
+
+        boards: List[chess.Board] = []
+        values: List[float] = []
+
+        try:
+            while not stop.is_set():
+                random.shuffle(paths)
+                for path in paths:
+                    for board, _, result in sample_boards(path):
+                        boards.append(board.copy(stack=False))
+                        values.append(value_target(result, board))
+
+                        if len(boards) < self.chunk_size:
+                            continue
+
+                        chunk = self._label_chunk(pool, boards, values)
+                        boards, values = [], []
+
+                        self._put(chunks, chunk, stop)
+                        if stop.is_set():
+                            return
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            self._put(chunks, e, stop)
+        finally:
+            pool.close()
+            if cache is not None:
+                Logger.info(f"Stockfish label cache: {cache.stats()}")
+
+    def __iter__(self):
+        # Listed here so a missing data directory exits right away instead of inside the thread
+        paths = self._list_files()
+        chunks: queue.Queue = queue.Queue(maxsize=self.queue_size)
+        stop = threading.Event()
+        producer = threading.Thread(target=self._produce, args=(paths, chunks, stop), daemon=True)
+        producer.start()
+
+        try:
+            while True:
+                chunk = chunks.get()
+                if isinstance(chunk, Exception):
+                    raise RuntimeError(f"Labelling positions with Stockfish failed: {chunk}") from chunk
+                yield chunk
+        finally:
+            stop.set()
+
+    def as_tf_dataset(
+        self, batch_size: int, shuffle_buffer: Optional[int] = None, cycle_length: int = 4, with_values: bool = False
+    ):
+        """Endless tf.data pipeline over the distilled chunks, shuffling across one chunk by default.
+
+        cycle_length is unused, the chunks come from a single generator.
+        """
+        chunks = tf.data.Dataset.from_generator(
+            self.__iter__,
+            output_signature=(
+                tf.TensorSpec(shape=(None, 8, 8, 18), dtype=tf.float32),
+                tf.TensorSpec(shape=(None, len(UCI_DICT)), dtype=tf.float32),
+                tf.TensorSpec(shape=(None,), dtype=tf.float32),
+            ),
+        )
+
+        def example(x, targets, values):
+            if with_values:
+                return x, {"policy": targets, "value": values}
+            return x, targets
+
+        return (
+            chunks.unbatch()
+            .shuffle(shuffle_buffer or self.chunk_size)
+            .batch(batch_size, drop_remainder=True)
+            .map(example, num_parallel_calls=tf.data.AUTOTUNE)
+            .prefetch(tf.data.AUTOTUNE)
+        )
@@ -1,57 +1,124 @@
 import random
+import threading
+from typing import TYPE_CHECKING, List, Optional, Tuple
 
-import chess
 import numpy as np
 from chess import Board
 
-from engine.model import Model
-from utils import UCI_DICT, Logger
+from engine.tflite_model import TFLiteModel
+from engine.inference_server import InferenceServer
+from engine.policy_cache import Evaluation, PolicyCache
+from utils import Logger, boards_to_matrix, legal_move_indices
+
+if TYPE_CHECKING:
+    from engine.search import MCTS
 
 
 class Engine:
-    def __init__(self, model):
-        assert isinstance(model, Model)
+    def __init__(
+        self,
+        model,
+        inference_server: Optional[InferenceServer] = None,
+        cache: Optional[PolicyCache] = None,
+        searcher: Optional["MCTS"] = None,
+    ):
+        if not isinstance(model, TFLiteModel):
+            # A Keras model means TensorFlow is loaded already
+            from engine.model import Model
+
+            assert isinstance(model, Model)
 
         self.model = model
         self.name = model.name
+        # Concurrent games share one server so their positions are evaluated together
+        self.predictor = inference_server or model
+        self.cache = cache
+        self.searcher = searcher
+        if searcher is not None:
+            # Search leaves go through the same cache and inference server as every other position
+            searcher.predict_values = self.evaluate
+
+    def policy(self, board: Board) -> np.ndarray:
+        return self.evaluate([board])[0][0]
+
+    def evaluate(self, boards: List[Board]) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        """Policy logits and values for a batch of positions, values are None without a value head.
+
+        Cached positions are answered from the cache, the rest are predicted
+        together. The inference server may batch them with other games' positions.
+        """
+        evaluations: List[Optional[Evaluation]] = [
+            None if self.cache is None else self.cache.get(board) for board in boards
+        ]
+        missing = [i for i, evaluation in enumerate(evaluations) if evaluation is None]
+
+        if missing:
+            # Predicted outside the cache's lock so concurrent games don't serialize on the network
+            missing_boards = [boards[i] for i in missing]
+            if isinstance(self.predictor, InferenceServer):
+                logits, values = self.predictor.evaluate(missing_boards)
+            else:
+                logits, values = self.model.predict_values(boards_to_matrix(missing_boards))
+
+            for row, i in enumerate(missing):
+                evaluation = (logits[row], None if values is None else float(values[row]))
+                evaluations[i] = evaluation
+                if self.cache is not None:
+                    self.cache.put(boards[i], *evaluation)
+
+        answered = [evaluation for evaluation in evaluations if evaluation is not None]
+        assert len(answered) == len(boards), "every position is cached or predicted"
+        logits = np.stack([evaluation[0] for evaluation in answered])
+        if answered[0][1] is None:
+            return logits, None
+        return logits, np.array([evaluation[1] for evaluation in answered], dtype=np.float32)
+
+    @staticmethod
+    def legal_move_probabilities(board: Board, logits: np.ndarray):
+        """Legal moves sorted by probability, renormalized over the legal moves only."""
+        moves, indices = legal_move_indices(board)
+        # Moves missing from UCI_DICT are masked to zero, never the case for standard chess
+        known = indices >= 0
+
+        if not known.any():
+            return moves, None
+
+        probs = masked_softmax(logits, indices, known)
+        order = np.argsort(-probs, kind="stable")[: int(known.sum())]
+
+        return [moves[i] for i in order.tolist()], probs[order]
+
+    def make_move(
+        self, board: Board, verbose=False, time_limit: Optional[float] = None, stop: Optional[threading.Event] = None
+    ):
+        """time_limit overrides the search's time per move, 0 plays straight from the policy.
+
+        Setting stop ends a search early, a policy move is a single forward pass and always completes.
+        """
+        if self.searcher is not None and time_limit != 0:
+            return self.search_move(board, verbose, time_limit, stop)
+
+        predicted_logits = self.policy(board)
+        moves, probs = self.legal_move_probabilities(board, predicted_logits)
+
+        if probs is None:
+            return random.choice(moves)
+
+        top_prob = probs[0]
 
-    def make_move(self, board: Board, verbose=False):
-        available_moves = list(board.legal_moves)
-        predicted_logits = self.model.predict(board)[0]
-
-        move_logits = []
-        for move in available_moves:
-            move_uci = move.uci()
-            move_index = UCI_DICT.get(move_uci)
-            if move_index is not None:
-                move_logits.append((move, predicted_logits[move_index]))
-
-        if not move_logits:
-            return random.choice(available_moves)
-
-        moves, logits = zip(*move_logits)
-        probs = softmax(np.array(logits))
-        move_probabilities = list(zip(moves, probs))
-        move_probabilities.sort(key=lambda x: x[1], reverse=True)
-
-        _, top_prob = move_probabilities[0]
-        
         # This is so we add more variation into the game the first 20 moves
         move_count = board.fullmove_number
         span = (11 - move_count) / 100 if move_count < 10 else 0.01
-        
 
-        threshold_moves = [
-            (move, prob) for move, prob in move_probabilities if top_prob - prob <= span
-        ]
+        threshold_moves = [move for move, prob in zip(moves, probs) if top_prob - prob <= span]
 
         selected_moves = threshold_moves[:5]
 
-        chosen_move = random.choice([move for move, _ in selected_moves])
+        chosen_move = random.choice(selected_moves)
 
         if verbose:
             Logger.info("Probabilities for top moves according to engine:")
-            for move, prob in move_probabilities[:5]:
+            for move, prob in zip(moves[:5], probs[:5]):
                 if move == chosen_move:
                     color = "\033[92m"
                 else:
@@ -61,7 +128,41 @@ class Engine:
 
         return chosen_move
 
+    def search_move(
+        self, board: Board, verbose=False, time_limit: Optional[float] = None, stop: Optional[threading.Event] = None
+    ):
+        if self.searcher is None:
+            raise ValueError("search_move needs an Engine created with a searcher")
+
+        nodes = None
+        if time_limit is not None:
+            # Keep the node rate the search was configured with, more time means a deeper search
+            nodes = max(1, round(self.searcher.nodes * time_limit / self.searcher.time_limit))
+        move, root = self.searcher.search(board, nodes, time_limit, stop)
+
+        if move is None:
+            return random.choice(list(board.legal_moves))
+
+        if verbose and root.children:
+            Logger.info("Visits for top moves according to search:")
+            ranked = sorted(root.children.items(), key=lambda item: item[1].visits, reverse=True)
+            for candidate, node in ranked[:5]:
+                color = "\033[92m" if candidate == move else "\033[93m"
+                reset = "\033[0m"
+                print(f"\t{color}{candidate}: {node.visits} visits, prior {node.prior:.3f}, value {node.q():.3f}{reset}")
+
+        return move
+
 
 def softmax(x):
     e_x = np.exp(x - np.max(x))
     return e_x / e_x.sum()
+
+
+def masked_softmax(logits: np.ndarray, indices: np.ndarray, known: np.ndarray) -> np.ndarray:
+    """Softmax over logits[indices] in one pass, entries where known is False get probability 0."""
+    gathered = np.where(known, logits.take(indices), -np.inf)
+    gathered -= gathered.max()
+    np.exp(gathered, out=gathered)
+    gathered /= gathered.sum()
+    return gathered
@@ -3,14 +3,46 @@ from chess import pgn
 import chess
 import numpy as np
 import os
-from tqdm import tqdm
-from typing import List
+import json
+import time
+import zipfile
+from contextlib import ExitStack
+from datetime import datetime
+from itertools import islice
+from typing import TYPE_CHECKING, Any, Callable, Dict, Generator, Iterable, List, Optional, Tuple, Union
 import csv
 
 from .stockfish import Stockfish
-from .model import Model
-from utils import UCI_DICT
+from .stockfish_pool import StockfishPool
+from .label_cache import LabelCache
+from utils import GAME_RESULTS, UCI_DICT, Logger, board_to_matrix, legal_move_indices, matrix_to_board, value_target
 
+if TYPE_CHECKING:
+    from .model import Model
+
+
+UCI_MOVES = {index: uci for uci, index in UCI_DICT.items()}
+
+TEST_SETS = [
+    ("Openings", "openings.npz"),
+    ("Middlegames", "middlegames.npz"),
+    ("Endgames", "endgames.npz"),
+    ("Random", "random.npz"),
+    ("Checkmates", "checkmates.npz"),
+    ("Tactics", "tactics.npz")
+]
+
+
+def _cell(value, digits=4, sign=False):
+    if value is None:
+        return "-"
+    return f"{value:+.{digits}f}" if sign else f"{value:.{digits}f}"
+
+
+def _delta(metrics: Dict, reference: Dict, key: str):
+    if metrics.get(key) is None or reference.get(key) is None:
+        return None
+    return metrics[key] - reference[key]
 
 
 class Evaluator:
@@ -18,178 +50,437 @@ class Evaluator:
         pass
     
     @staticmethod
-    def evaluate(model: Model):
-        results = []
-
-        test_sets = [
-            ("Openings", "openings.npz"),
-            ("Middlegames", "middlegames.npz"),
-            ("Endgames", "endgames.npz"),
-            ("Random", "random.npz"),
-            ("Checkmates", "checkmates.npz"),
-            ("Tactics", "tactics.npz")
+    def evaluate(
+        model: "Model",
+        batch_size: int = 256,
+        top_k: int = 3,
+        report_path: Optional[str] = None,
+        baseline: Optional["Model"] = None,
+    ):
+        """Evaluates every test set, with a baseline the accuracy changes and speedup against it are reported too."""
+        results = {}
+
+        # Traces (and with XLA compiles) the forward pass for the batch size so it isn't part of the timings
+        for evaluated in (model, baseline):
+            if evaluated is not None:
+                evaluated.predict_values(np.zeros((batch_size, 8, 8, 18), dtype=np.float32))
+
+        for name, file in TEST_SETS:
+            results[name] = Evaluator.run_test(model, file, batch_size, top_k)
+
+        header = ("Dataset", "Loss", "Accuracy", f"Top-{top_k}", "Legal acc.", "Value MAE", "Positions/s")
+        rows = [
+            (
+                name,
+                _cell(metrics["loss"]),
+                _cell(metrics["accuracy"]),
+                _cell(metrics["top_k_accuracy"]),
+                _cell(metrics["legal_accuracy"]),
+                _cell(metrics["value_mae"]),
+                _cell(metrics["positions_per_second"], 0),
+            )
+            for name, metrics in results.items()
         ]
+        Evaluator.print_table(header, rows)
+
+        baseline_results = None
+        if baseline is not None:
+            baseline_results = {name: Evaluator.run_test(baseline, file, batch_size, top_k) for name, file in TEST_SETS}
+            Evaluator.print_comparison(results, baseline_results)
 
-        for name, file in test_sets:
-            loss, accuracy = Evaluator.run_test(model, file)
-            results.append((name, f"{loss:.4f}", f"{accuracy:.4f}"))
+        report_path = report_path or os.path.join("tests", "evaluation", "reports", f"{model.name}.json")
+        Evaluator.write_report(model, results, batch_size, top_k, report_path, baseline, baseline_results)
+        return results
 
-        col_widths = [max(len(str(row[i])) for row in results + [("Dataset", "Loss", "Accuracy")]) for i in range(3)]
+    @staticmethod
+    def print_table(header, rows):
+        col_widths = [max(len(str(row[i])) for row in rows + [header]) for i in range(len(header))]
         print()
-        print(f"{'Dataset'.ljust(col_widths[0])}  {'Loss'.ljust(col_widths[1])}  {'Accuracy'.ljust(col_widths[2])}")
-        print("-" * (sum(col_widths) + 4))
+        print("  ".join(title.ljust(width) for title, width in zip(header, col_widths)))
+        print("-" * (sum(col_widths) + 2 * (len(header) - 1)))
+
+        for row in rows:
+            print("  ".join(value.ljust(width) for value, width in zip(row, col_widths)))
+
+    @staticmethod
+    def compare(results: Dict[str, Dict], baseline_results: Dict[str, Dict]) -> Dict[str, Dict]:
+        """Accuracy changes and speedup of every set relative to the baseline, None where the baseline lacks the set."""
+        comparison = {}
+        for name, metrics in results.items():
+            # A set missing from the baseline compares as unknown
+            reference = baseline_results.get(name, {})
+
+            speedup = None
+            if metrics.get("positions_per_second") and reference.get("positions_per_second"):
+                speedup = metrics["positions_per_second"] / reference["positions_per_second"]
+
+            comparison[name] = {
+                "accuracy_delta": _delta(metrics, reference, "accuracy"),
+                "legal_accuracy_delta": _delta(metrics, reference, "legal_accuracy"),
+                "value_mae_delta": _delta(metrics, reference, "value_mae"),
+                "speedup": speedup,
+            }
+        return comparison
+
+    @staticmethod
+    def print_comparison(results: Dict[str, Dict], baseline_results: Dict[str, Dict]):
+        header = ("Dataset", "Baseline acc.", "Accuracy", "Δ Accuracy", "Δ Legal acc.", "Δ Value MAE", "Speedup")
+        rows = [
+            (
+                name,
+                _cell(baseline_results.get(name, {}).get("accuracy")),
+                _cell(results[name]["accuracy"]),
+                _cell(changes["accuracy_delta"], sign=True),
+                _cell(changes["legal_accuracy_delta"], sign=True),
+                _cell(changes["value_mae_delta"], sign=True),
+                "-" if changes["speedup"] is None else f"{changes['speedup']:.2f}x",
+            )
+            for name, changes in Evaluator.compare(results, baseline_results).items()
+        ]
+        Evaluator.print_table(header, rows)
+
+    @staticmethod
+    def write_report(
+        model: "Model",
+        results: Dict[str, Dict],
+        batch_size: int,
+        top_k: int,
+        report_path: str,
+        baseline: Optional["Model"] = None,
+        baseline_results: Optional[Dict[str, Dict]] = None,
+    ):
+        report = {
+            "model": model.name,
+            "precision": model.precision,
+            "jit_compile": model.jit_compile,
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "batch_size": batch_size,
+            "top_k": top_k,
+            "sets": results,
+        }
+
+        if baseline is not None and baseline_results is not None:
+            report["baseline"] = {
+                "precision": baseline.precision,
+                "jit_compile": baseline.jit_compile,
+                "sets": baseline_results,
+                "comparison": Evaluator.compare(results, baseline_results),
+            }
+
+        directory = os.path.dirname(report_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        with open(report_path, "w", encoding="utf-8") as report_file:
+            json.dump(report, report_file, indent=2)
+        print(f"\nReport written to {report_path}")
 
-        for row in results:
-            print(f"{row[0].ljust(col_widths[0])}  {row[1].ljust(col_widths[1])}  {row[2].ljust(col_widths[2])}")
-    
     @staticmethod
-    def run_test(model: Model, dataset: str):
+    def stream_npz(path: str, batch_size: int) -> Generator[Dict[str, np.ndarray], None, None]:
+        """Batches of the arrays in an .npz file, read straight from the archive without loading whole arrays."""
+        with ExitStack() as stack:
+            archive = stack.enter_context(zipfile.ZipFile(path))
+            arrays = {}
+
+            for member in archive.namelist():
+                handle = stack.enter_context(archive.open(member))
+                version = np.lib.format.read_magic(handle)
+                if version == (1, 0):
+                    shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(handle)
+                else:
+                    shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(handle)
+
+                if fortran_order or dtype.hasobject:
+                    raise ValueError(f"{path}: {member} can't be streamed, it is Fortran ordered or holds objects")
+                arrays[member[: -len(".npy")]] = (handle, shape, dtype)
+
+            length = min(shape[0] for _, shape, _ in arrays.values())
+
+            for start in range(0, length, batch_size):
+                count = min(batch_size, length - start)
+                batch = {}
+                for name, (handle, shape, dtype) in arrays.items():
+                    row_bytes = int(np.prod(shape[1:], dtype=np.int64)) * dtype.itemsize
+                    batch[name] = np.frombuffer(handle.read(count * row_bytes), dtype=dtype).reshape((count, *shape[1:]))
+                yield batch
+
+    @staticmethod
+    def run_test(model: "Model", dataset: str, batch_size: int = 256, top_k: int = 3) -> Dict[str, Optional[float]]:
         path = os.path.join("tests", "evaluation", dataset)
-        data = np.load(path, allow_pickle=True)
 
-                
-        loss, accuracy = model.evaluate(data["X"], data["y"], batch_size=64)
-        return loss, accuracy
-        
+        positions = 0
+        loss_sum = 0.0
+        correct = 0
+        top_k_correct = 0
+        legal_correct = 0
+        value_error = 0.0
+        value_positions = 0
+        unscored_values = False
+        inference_seconds = 0.0
+
+        for batch in Evaluator.stream_npz(path, batch_size):
+            x, labels = batch["X"], batch["y"].astype(np.int64)
+
+            started = time.perf_counter()
+            logits, values = model.predict_values(x)
+            inference_seconds += time.perf_counter() - started
+
+            shifted = logits - logits.max(axis=1, keepdims=True)
+            log_probs = shifted - np.log(np.exp(shifted).sum(axis=1, keepdims=True))
+            rows = np.arange(len(labels))
+            loss_sum += float(-log_probs[rows, labels].sum())
+
+            correct += int((logits.argmax(axis=1) == labels).sum())
+            top_k_moves = np.argpartition(-logits, top_k - 1, axis=1)[:, :top_k]
+            top_k_correct += int((top_k_moves == labels[:, None]).any(axis=1).sum())
+
+            # Illegal moves can't be played, so only the best legal move counts here
+            for position_logits, matrix, label in zip(logits, x, labels):
+                # The label tells matrix_to_board about en passant captures the encoding can't hold
+                board = matrix_to_board(matrix, chess.Move.from_uci(UCI_MOVES[int(label)]))
+                _, indices = legal_move_indices(board)
+                indices = indices[indices >= 0]
+                if len(indices) and indices[position_logits[indices].argmax()] == label:
+                    legal_correct += 1
+
+            # Only sets cut from real games have results to score the value head against
+            if values is not None and "v" in batch:
+                value_error += float(np.abs(values - batch["v"]).sum())
+                value_positions += len(values)
+            elif values is not None:
+                unscored_values = True
+
+            positions += len(labels)
+
+        if unscored_values:
+            Logger.warning(f"{dataset} has no game results, regenerate it with testset to score the value head on it")
+
+        return {
+            "positions": positions,
+            "loss": loss_sum / positions if positions else None,
+            "accuracy": correct / positions if positions else None,
+            "top_k_accuracy": top_k_correct / positions if positions else None,
+            "legal_accuracy": legal_correct / positions if positions else None,
+            "value_mae": value_error / value_positions if value_positions else None,
+            "positions_per_second": positions / inference_seconds if inference_seconds else None,
+        }
 
     @staticmethod
-    def generate_testset(pgn_file: str, num_tests: int):
+    def sample_games(pgn_files: Union[str, List[str]], num_games: int, rng: random.Random) -> List[pgn.Game]:
+        """Uniform sample of num_games games from all the PGN files, only the sampled games are parsed.
+
+        The first pass only reads headers while reservoir sampling the file
+        offsets, the second pass seeks to the chosen offsets.
+        """
+        if isinstance(pgn_files, str):
+            pgn_files = [pgn_files]
+
+        reservoir: List[Tuple[str, int]] = []
+        seen = 0
+
+        for path in pgn_files:
+            with open(path, "r", encoding="utf-8") as game_data:
+                while True:
+                    offset = game_data.tell()
+                    # Parses the headers and skips over the move text
+                    if pgn.read_headers(game_data) is None:
+                        break
+
+                    seen += 1
+                    if len(reservoir) < num_games:
+                        reservoir.append((path, offset))
+                    else:
+                        index = rng.randrange(seen)
+                        if index < num_games:
+                            reservoir[index] = (path, offset)
+
         games = []
-        
-        stockfish = Stockfish()
-        
-        with open(pgn_file, "r", encoding="utf-8") as game_data:
-            while True:
-                game = pgn.read_game(game_data)
-                if game is None:
-                    break
-                
-                games.append(game)
-                
-                if len(games) > num_tests:
-                    break
-                
-        print("Done collecting games")
+        # Reading in file order keeps the seeks moving forward
+        for path in pgn_files:
+            offsets = sorted(offset for game_path, offset in reservoir if game_path == path)
+            with open(path, "r", encoding="utf-8") as game_data:
+                for offset in offsets:
+                    game_data.seek(offset)
+                    game = pgn.read_game(game_data)
+                    # Only None at the end of the file, an offset always points at a game header
+                    if game is not None:
+                        games.append(game)
+
+        print(f"Sampled {len(games)} of {seen} games")
+        return games
+
+    @staticmethod
+    def generate_testset(pgn_file: Union[str, List[str]], num_tests: int, seed: int = 0, processes: Optional[int] = None, threads: int = 1, hash_mb: int = 16, num_games: Optional[int] = None, label_cache: Optional[str] = None):
+        if threads > 1:
+            # Threads race on the shared hash table, so a search can end on another move every run
+            Logger.warning(
+                f"Stockfish searches with {threads} threads are not deterministic, the sets will differ between runs with seed {seed}"
+            )
+
+        rng = random.Random(seed)
+        games = Evaluator.sample_games(pgn_file, num_games or num_tests + 1, rng)
                 
-        random.shuffle(games)
+        rng.shuffle(games)
 
-        openings_x, openings_y = Evaluator.create_set(
-            games, num_tests, stockfish, max_turn=10, min_turn=0, max_pieces=32, min_pieces=26
-        )
-        np.savez_compressed(os.path.join("tests", "evaluation", "openings.npz"), X=openings_x, y=openings_y)
-        
-        openings_x.clear()
-        openings_y.clear()
-        
-        
-        middlegames_x, middlegames_y = Evaluator.create_set(
-            games, num_tests, stockfish, max_turn=40, min_turn=15, max_pieces=25, min_pieces=15
-        )
-        
-        np.savez_compressed(os.path.join("tests", "evaluation", "middlegames.npz"), X=middlegames_x, y=middlegames_y)
-        
-        middlegames_x.clear()
-        middlegames_y.clear()
-        
-        
-        endgames_x, endgames_y = Evaluator.create_set(
-            games, num_tests, stockfish, max_turn=100, min_turn=30, max_pieces=14, min_pieces=2
-        )
+        # Positions analysed by an earlier run are answered from disk instead of searched again
+        cache = LabelCache(label_cache) if label_cache else None
+        pool = StockfishPool(processes, threads=threads, hash_mb=hash_mb, cache=cache)
 
-        np.savez_compressed(os.path.join("tests", "evaluation", "endgames.npz"), X=endgames_x, y=endgames_y)
-        endgames_x.clear()
-        endgames_y.clear()
-        
-        checkmates_x, checkmates_y = Evaluator.create_checkmate_set(games, num_tests, stockfish)
-        np.savez_compressed(os.path.join("tests", "evaluation", "checkmates.npz"), X=checkmates_x, y=checkmates_y)
-        checkmates_x.clear()
-        checkmates_y.clear()
-        
-        random_x, random_y = Evaluator.create_random_set(num_tests, stockfish)
-        np.savez_compressed(os.path.join("tests", "evaluation", "random.npz"), X=random_x, y=random_y)
-        
-        tactics_x, tactics_y = Evaluator.create_puzzle_set("tests/evaluation/puzzles.csv", ["fork", "pin", "discoveredAttack"], 1000, stockfish)
-        np.savez_compressed(os.path.join("tests", "evaluation", "tactics.npz"), X=tactics_x, y=tactics_y)
-        
-        stockfish.close()       
+        try:
+            openings_x, openings_y, openings_v = Evaluator.create_set(
+                games, num_tests, pool, rng, "Openings", max_turn=10, min_turn=0, max_pieces=32, min_pieces=26
+            )
+            np.savez_compressed(os.path.join("tests", "evaluation", "openings.npz"), X=openings_x, y=openings_y, v=openings_v)
+            
+            openings_x.clear()
+            openings_y.clear()
+            openings_v.clear()
+            
+            
+            middlegames_x, middlegames_y, middlegames_v = Evaluator.create_set(
+                games, num_tests, pool, rng, "Middlegames", max_turn=40, min_turn=15, max_pieces=25, min_pieces=15
+            )
+            
+            np.savez_compressed(os.path.join("tests", "evaluation", "middlegames.npz"), X=middlegames_x, y=middlegames_y, v=middlegames_v)
+            
+            middlegames_x.clear()
+            middlegames_y.clear()
+            middlegames_v.clear()
+            
+            
+            endgames_x, endgames_y, endgames_v = Evaluator.create_set(
+                games, num_tests, pool, rng, "Endgames", max_turn=100, min_turn=30, max_pieces=14, min_pieces=2
+            )
+
+            np.savez_compressed(os.path.join("tests", "evaluation", "endgames.npz"), X=endgames_x, y=endgames_y, v=endgames_v)
+            endgames_x.clear()
+            endgames_y.clear()
+            endgames_v.clear()
+            
+            checkmates_x, checkmates_y, checkmates_v = Evaluator.create_checkmate_set(games, num_tests, pool)
+            np.savez_compressed(os.path.join("tests", "evaluation", "checkmates.npz"), X=checkmates_x, y=checkmates_y, v=checkmates_v)
+            checkmates_x.clear()
+            checkmates_y.clear()
+            checkmates_v.clear()
+            
+            random_x, random_y = Evaluator.create_random_set(num_tests, pool, rng)
+            np.savez_compressed(os.path.join("tests", "evaluation", "random.npz"), X=random_x, y=random_y)
+            
+            tactics_x, tactics_y = Evaluator.create_puzzle_set("tests/evaluation/puzzles.csv", ["fork", "pin", "discoveredAttack"], 1000, pool)
+            np.savez_compressed(os.path.join("tests", "evaluation", "tactics.npz"), X=tactics_x, y=tactics_y)
+        finally:
+            pool.close()
+            if cache is not None:
+                print(f"Stockfish label cache: {cache.stats()}")
+
+    @staticmethod
+    def label_positions(pool: StockfishPool, candidates: Iterable, num_tests: int, label: Callable, desc: str):
+        """Labels candidates in order until num_tests of them got a label, label returns None to skip one.
+
+        Candidates are pulled lazily in rounds of the labels still missing, so a
+        seeded candidate stream gives the same set no matter how many processes run.
+        """
+        candidates = iter(candidates)
+        labelled: List[Tuple[Any, Any]] = []
+
+        while len(labelled) < num_tests:
+            batch = list(islice(candidates, num_tests - len(labelled)))
+            if not batch:
+                break
+
+            labels = pool.map(label, batch, desc=desc)
+            labelled.extend((candidate, result) for candidate, result in zip(batch, labels) if result is not None)
+
+        return labelled
         
     @staticmethod
-    def create_set(games, num_tests: int, stockfish: Stockfish, max_turn: int, min_turn: int, max_pieces: int, min_pieces: int):
+    def create_set(games, num_tests: int, pool: StockfishPool, rng: random.Random, name: str, max_turn: int, min_turn: int, max_pieces: int, min_pieces: int):
         x = []
         y = []
-        
-        for game in tqdm(games, desc="Generating Dataset", unit="game", colour='green'):
-            board_state = Evaluator.get_filtered_move(game, max_turn=max_turn, min_turn=min_turn, max_pieces=max_pieces, min_pieces=min_pieces)
-            
-            if not board_state:
-                continue
-            
-            best_move = stockfish.predict_best_move(board_state, depth=10)
-                    
-            if not best_move:
-                continue
-                    
-            x.append(Model.board_to_matrix(board_state))
-                    
+        v = []
+
+        def candidates():
+            for game in games:
+                board_state = Evaluator.get_filtered_move(game, max_turn=max_turn, min_turn=min_turn, max_pieces=max_pieces, min_pieces=min_pieces, rng=rng)
+                
+                if not board_state:
+                    continue
+
+                result = GAME_RESULTS.get(game.headers.get("Result", "*"), 0)
+                yield board_state, value_target(result, board_state)
+
+        labelled = Evaluator.label_positions(
+            pool, candidates(), num_tests, lambda stockfish, candidate: stockfish.predict_best_move(candidate[0], depth=10), name
+        )
+
+        for (board_state, value), best_move in labelled:
+            x.append(board_to_matrix(board_state))
             y.append(UCI_DICT[best_move.uci()])
+            v.append(value)
             
-            if len(x) >= num_tests:
-                break
-            
-        return x, y
+        return x, y, v
     
     @staticmethod
-    def create_checkmate_set(games, num_tests: int, stockfish: Stockfish):
+    def create_checkmate_set(games, num_tests: int, pool: StockfishPool):
         x = []
         y = []
-        
-        for game in tqdm(games, desc="Generating Dataset", unit="game", colour='green'):
-            board = game.board()
-            
-            for move in game.mainline_moves():
-                board_copy = board.copy()
-                
-                board.push(move)
+        v = []
+
+        def candidates():
+            for game in games:
+                board = game.board()
                 
-                if board.is_checkmate():
-                    move_probs = stockfish.predict_move_distribution(board_copy, depth=10)
-                    
-                    if len([prob for move, prob in move_probs.items() if prob > 0.8]) != 1:
-                        continue
+                for move in game.mainline_moves():
+                    board_copy = board.copy()
                     
-                    best_move = stockfish.predict_best_move(board_copy, depth=10)
-                    x.append(Model.board_to_matrix(board_copy))
-                    y.append(UCI_DICT[best_move.uci()])
+                    board.push(move)
                     
-            if len(x) >= num_tests:
-                break
+                    if board.is_checkmate():
+                        yield board_copy
+
+        def label(stockfish: Stockfish, board: chess.Board):
+            move_probs = stockfish.predict_move_distribution(board, depth=10)
             
-        return x, y
+            if not move_probs or len([prob for move, prob in move_probs.items() if prob > 0.8]) != 1:
+                return None
+            
+            return stockfish.predict_best_move(board, depth=10)
+
+        for board, best_move in Evaluator.label_positions(pool, candidates(), num_tests, label, "Checkmates"):
+            x.append(board_to_matrix(board))
+            y.append(UCI_DICT[best_move.uci()])
+            # The side to move delivers mate
+            v.append(1.0)
+            
+        return x, y, v
                         
                         
                         
     @staticmethod
-    def create_random_set(num_tests: int, stockfish: Stockfish):
+    def create_random_set(num_tests: int, pool: StockfishPool, rng: random.Random):
         x: List[np.ndarray] = []
         y: List[int] = []
-        
-        while len(x) < num_tests:
-            board = chess.Board()
-            
-            depth = random.randint(1, 100)
-            for _ in range(depth):
-                move = random.choice(list(board.legal_moves))
-                board.push(move)
-                
-                if board.is_checkmate():
-                    break
-            
+
+        def candidates():
+            while True:
+                board = chess.Board()
                 
-            best_move = stockfish.predict_best_move(board, depth=10)
-            if not best_move:
-                continue
-            
-            x.append(Model.board_to_matrix(board))
+                depth = rng.randint(1, 100)
+                for _ in range(depth):
+                    move = rng.choice(list(board.legal_moves))
+                    board.push(move)
+                    
+                    if board.is_checkmate():
+                        break
+
+                yield board
+
+        labelled = Evaluator.label_positions(
+            pool, candidates(), num_tests, lambda stockfish, board: stockfish.predict_best_move(board, depth=10), "Random"
+        )
+
+        for board, best_move in labelled:
+            x.append(board_to_matrix(board))
             y.append(UCI_DICT[best_move.uci()])
             
         return x, y
@@ -197,7 +488,8 @@ class Evaluator:
 
 
     @staticmethod
-    def get_filtered_move(game: pgn.Game, max_turn: int, min_turn: int, max_pieces: int, min_pieces: int):
+    def get_filtered_move(game: pgn.Game, max_turn: int, min_turn: int, max_pieces: int, min_pieces: int, rng: Optional[random.Random] = None):
+        rng = rng or random.Random()
         board = game.board()
         matching_positions = []
 
@@ -210,30 +502,26 @@ class Evaluator:
                 matching_positions.append(board.copy())
 
         if matching_positions:
-            return random.choice(matching_positions)
+            return rng.choice(matching_positions)
         else:
             return None
 
     @staticmethod
-    def create_puzzle_set(puzzle_csv: str, theme_filter: List[str], num_tests: int, stockfish: Stockfish):
+    def create_puzzle_set(puzzle_csv: str, theme_filter: List[str], num_tests: int, pool: StockfishPool):
         x, y = [], []
 
         with open(puzzle_csv, "r", encoding="utf-8") as f:
             reader = csv.DictReader(f)
-            for row in reader:
-                if not any(theme in row["Themes"] for theme in theme_filter):
-                    continue
+            candidates = (
+                chess.Board(row["FEN"]) for row in reader if any(theme in row["Themes"] for theme in theme_filter)
+            )
 
-                board = chess.Board(row["FEN"])
-                best_move = stockfish.predict_best_move(board, depth=10)
+            labelled = Evaluator.label_positions(
+                pool, candidates, num_tests, lambda stockfish, board: stockfish.predict_best_move(board, depth=10), "Tactics"
+            )
 
-                if not best_move:
-                    continue
-
-                x.append(Model.board_to_matrix(board))
-                y.append(UCI_DICT[best_move.uci()])
-
-                if len(x) >= num_tests:
-                    break
+        for board, best_move in labelled:
+            x.append(board_to_matrix(board))
+            y.append(UCI_DICT[best_move.uci()])
 
         return x, y
@@ -0,0 +1,90 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import TYPE_CHECKING, List, Optional, Sequence, Tuple
+
+import chess
+import numpy as np
+
+from utils import Logger, board_to_matrix
+
+if TYPE_CHECKING:
+    from .model import Model
+
+
+class InferenceServer:
+    """Collects positions from many threads and evaluates them in a single forward pass.
+
+    The first request of a batch opens a short collection window, the batch is
+    evaluated once the window closes or max_batch_size requests have arrived.
+    """
+
+    def __init__(self, model: "Model", max_batch_size: int = 16, max_wait: float = 0.005):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.requests: queue.Queue = queue.Queue()
+
+        self.batches = 0
+        self.positions = 0
+
+        self.thread = threading.Thread(target=self._serve, daemon=True)
+        self.thread.start()
+
+    def submit(self, board: chess.Board) -> Future:
+        """Resolves to the position's logits and its value, None without a value head."""
+        future: Future = Future()
+        # Encoding happens on the calling thread so the server only stacks matrices
+        self.requests.put((board_to_matrix(board), future))
+        return future
+
+    def predict(self, board: chess.Board) -> np.ndarray:
+        """Same contract as Model.predict, logits with a batch dimension of one."""
+        return self.submit(board).result()[0][None, :]
+
+    def evaluate(self, boards: Sequence[chess.Board]) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        """Same contract as Model.predict_values for a list of boards, they join the batches of every other caller."""
+        results = [future.result() for future in [self.submit(board) for board in boards]]
+        logits = np.stack([row for row, _ in results])
+        if results[0][1] is None:
+            return logits, None
+        return logits, np.array([value for _, value in results], dtype=np.float32)
+
+    def _collect(self) -> List[Tuple[np.ndarray, Future]]:
+        batch = [self.requests.get()]
+        deadline = time.monotonic() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.requests.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _serve(self) -> None:
+        while True:
+            batch = self._collect()
+            matrices = np.stack([matrix for matrix, _ in batch])
+
+            try:
+                logits, values = self.model.predict_values(matrices)
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                Logger.error(f"Inference batch of {len(batch)} positions failed: {e}")
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            for i, (_, future) in enumerate(batch):
+                future.set_result((logits[i], None if values is None else float(values[i])))
+
+            self.batches += 1
+            self.positions += len(batch)
+
+    def stats(self) -> str:
+        average = self.positions / self.batches if self.batches else 0
+        return f"{self.positions} positions in {self.batches} batches, {average:.2f} positions per batch"
@@ -1,64 +1,214 @@
 import os
 import sys
 import random
+import time
+import multiprocessing as mp
+from queue import Empty
+from typing import Generator, List, Tuple
 
+import chess
 import numpy as np
+import tensorflow as tf
 from chess import pgn
 
-from utils import UCI_DICT
+from utils import GAME_RESULTS, UCI_DICT, expand_bitboards, pack_board, value_target
 
 from utils import Logger
-from .model import Model
+from .model import CHUNK_SIZE, Model
+from .tf_pipeline import PACKED_BATCH_SIGNATURE, PACKED_POSITION_SIGNATURE, batch_positions
+
+PackedPosition = Tuple[list, list, int, float]
+PackedChunk = Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]
+
+
+def sample_boards(path: str) -> Generator[Tuple[chess.Board, chess.Move, int], None, None]:
+    """Samples positions from a single pass over one PGN file, yielding (board, move played, game result).
+
+    The board is advanced after every yield, copy it to keep it around.
+    """
+    if isinstance(path, bytes):
+        path = path.decode()
+
+    with open(path, "r") as data:
+        while True:
+            game = pgn.read_game(data)
+
+            if game is None:
+                break
+
+            if random.randint(1, 10) < 8:
+                continue
+
+            result = GAME_RESULTS.get(game.headers.get("Result", "*"), 0)
+            board = game.board()
+
+            for i, move in enumerate(game.mainline_moves()):
+                if i < 7 or random.randint(0, 20) > i or random.randint(1, 10) < 8:
+                    board.push(move)
+                    continue
+
+                yield board, move, result
+
+                board.push(move)
+
+
+def sample_positions(path: str) -> Generator[PackedPosition, None, None]:
+    """Samples positions from a single pass over one PGN file, yielding (masks, flags, label, value)."""
+    for board, move, result in sample_boards(path):
+        masks, flags = pack_board(board)
+        yield masks, flags, UCI_DICT[move.uci()], value_target(result, board)
+
+
+# Passes over the files in a row without a single position before they are considered unusable
+MAX_EMPTY_PASSES = 100
+
+
+def sample_packed_chunks(paths: List[str], chunk_size: int) -> Generator[PackedChunk, None, None]:
+    """Endlessly samples positions from the PGN files, yielding (masks, flags, labels, values) chunks."""
+    masks = np.empty((chunk_size, 12), dtype="<u8")
+    flags = np.empty((chunk_size, 6), dtype=np.float32)
+    labels = np.empty(chunk_size, dtype=np.int64)
+    values = np.empty(chunk_size, dtype=np.float32)
+    n = 0
+    empty_passes = 0
+
+    while True:
+        random.shuffle(paths)
+        sampled = 0
+        for path in paths:
+            for position_masks, position_flags, label, value in sample_positions(path):
+                masks[n], flags[n], labels[n], values[n] = position_masks, position_flags, label, value
+                n += 1
+                sampled += 1
+
+                if n >= chunk_size:
+                    yield masks.copy(), flags.copy(), labels.copy(), values.copy()
+                    n = 0
+
+        empty_passes = 0 if sampled else empty_passes + 1
+        if empty_passes >= MAX_EMPTY_PASSES:
+            raise ValueError(f"No positions found in {paths}, are they PGN files?")
+
+
+def _worker(worker_id: int, paths: List[str], chunk_size: int, queue) -> None:
+    # Forked workers inherit the parent's random state, reseed so shards don't sample in lockstep
+    random.seed()
+    started = time.perf_counter()
+
+    for masks, flags, labels, values in sample_packed_chunks(paths, chunk_size):
+        elapsed = time.perf_counter() - started
+        queue.put((worker_id, masks, flags, labels, values, elapsed))
+        started = time.perf_counter()
 
 
 class InfiniteDataset:
-    def __init__(self, model: Model, data_dir: str):
+    # Seconds between checks that the data workers are still alive while waiting for a chunk
+    WORKER_CHECK_INTERVAL = 5.0
+
+    def __init__(self, model: Model, data_dir: str, workers: int = 0, queue_size: int = 4):
         self.model = model
         self.data_dir = data_dir
+        self.workers = workers
+        self.queue_size = queue_size
+
+    def _list_files(self) -> List[str]:
+        files = os.listdir(self.data_dir)
+        pgn_files = [fl for fl in files if fl.endswith(".pgn")]
+
+        if len(files) == 0:
+            Logger.error(f"No training data found in directory {self.data_dir}. Quickfix: make dataset")
+            sys.exit(1)
+
+        elif len(pgn_files) == 0:
+            Logger.warning(f"Only found files that doesnt seem to be in PGN-format in directory {self.data_dir}, might crash...")
+
+        return [os.path.join(self.data_dir, filename) for filename in files]
 
     def __iter__(self):
-        while True:
-            files = os.listdir(self.data_dir)
-            pgn_files = [fl for fl in files if fl.endswith(".pgn")]
-            
-            if len(files) == 0:
-                Logger.error(f"No training data found in directory {self.data_dir}. Quickfix: make dataset")
-                sys.exit(1)
-                
-            elif len(pgn_files) == 0:
-                Logger.warning(f"Only found files that doesnt seem to be in PGN-format in directory {self.data_dir}, might crash...")
-            
-            random.shuffle(files)
-            for filename in files:
-                path = os.path.join(self.dir, filename)
-                with open(path, "r") as data:
-                    x = []
-                    y = []
-                    while True:
-                        game = pgn.read_game(data)
-
-                        if game is None:
-                            break
-
-                        if random.randint(1, 10) < 8:
-                            continue
-
-                        board = game.board()
-
-                        for i, move in enumerate(game.mainline_moves()):
-                            if i < 7 or random.randint(0, 20) > i or random.randint(1, 10) < 8:
-                                board.push(move)
-                                continue
-
-                            x.append(self.model.board_to_matrix(board))
-                            y.append(UCI_DICT[move.uci()])
-
-                            board.push(move)
-
-                            if len(x) >= 100000:
-                                x_r = np.array(x)
-                                y_r = np.array(y)
-                                x.clear()
-                                y.clear()
-
-                                yield x_r, y_r
+        paths = self._list_files()
+
+        if self.workers > 0:
+            for masks, flags, labels, values in self._parallel_chunks(paths):
+                yield expand_bitboards(masks, flags), labels, values
+            return
+
+        for masks, flags, labels, values in sample_packed_chunks(paths, CHUNK_SIZE):
+            yield expand_bitboards(masks, flags), labels, values
+
+    def as_tf_dataset(self, batch_size: int, shuffle_buffer: int = 20000, cycle_length: int = 4, with_values: bool = False):
+        """Endless tf.data pipeline interleaving positions from several PGN files at once.
+
+        With workers the chunks come from the worker processes. Without them
+        PGN parsing runs in tf.data's generator threads, which share the GIL.
+        """
+        paths = self._list_files()
+
+        if self.workers > 0:
+            chunks = tf.data.Dataset.from_generator(
+                lambda: self._parallel_chunks(paths), output_signature=PACKED_BATCH_SIGNATURE
+            )
+            return batch_positions(chunks.unbatch(), batch_size, shuffle_buffer, with_values)
+
+        def positions(path):
+            return tf.data.Dataset.from_generator(
+                sample_positions, args=(path,), output_signature=PACKED_POSITION_SIGNATURE
+            )
+
+        files = tf.data.Dataset.from_tensor_slices(paths).shuffle(len(paths)).repeat()
+        interleaved = files.interleave(
+            positions,
+            cycle_length=min(cycle_length, len(paths)),
+            num_parallel_calls=tf.data.AUTOTUNE,
+            deterministic=False,
+        )
+        return batch_positions(interleaved, batch_size, shuffle_buffer, with_values)
+
+    def _parallel_chunks(self, paths: List[str]) -> Generator[PackedChunk, None, None]:
+        random.shuffle(paths)
+        shards = [paths[i::self.workers] for i in range(self.workers)]
+        shards = [shard for shard in shards if shard]
+
+        if len(shards) < self.workers:
+            Logger.warning(f"Only {len(paths)} files in {self.data_dir}, starting {len(shards)} workers instead of {self.workers}")
+
+        queue: mp.Queue = mp.Queue(maxsize=self.queue_size)
+        processes = [
+            mp.Process(target=_worker, args=(worker_id, shard, CHUNK_SIZE, queue), daemon=True)
+            for worker_id, shard in enumerate(shards)
+        ]
+
+        for process in processes:
+            process.start()
+
+        Logger.info(f"Started {len(processes)} data workers with a queue depth of {self.queue_size}")
+
+        dead = 0
+        try:
+            while True:
+                try:
+                    worker_id, masks, flags, labels, values, elapsed = queue.get(timeout=self.WORKER_CHECK_INTERVAL)
+                except Empty:
+                    dead = self._check_workers(processes, dead)
+                    continue
+                Logger.info(f"Data worker {worker_id}: {len(labels) / max(elapsed, 1e-9):.0f} positions/sec")
+                yield masks, flags, labels, values
+        finally:
+            for process in processes:
+                process.terminate()
+            for process in processes:
+                process.join()
+
+    @staticmethod
+    def _check_workers(processes: List[mp.Process], dead: int) -> int:
+        """Raises once every data worker has exited, training would otherwise wait for a chunk forever.
+
+        Returns how many workers exited, a warning is logged when it grew since the last check.
+        """
+        exit_codes = [process.exitcode for process in processes]
+        if all(code is not None for code in exit_codes):
+            raise RuntimeError(f"Every data worker exited (exit codes {exit_codes}), see the worker tracebacks above")
+
+        now_dead = sum(code is not None for code in exit_codes)
+        if now_dead > dead:
+            Logger.warning(f"{now_dead} of {len(processes)} data workers exited, exit codes {exit_codes}")
+        return now_dead
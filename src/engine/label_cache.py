@@ -0,0 +1,80 @@
+import os
+import sqlite3
+import threading
+from typing import Optional
+
+import chess
+
+
+class LabelCache:
+    """Stockfish results stored on disk in SQLite, keyed by (position, depth, multipv).
+
+    Positions are normalized to their EPD, so move counters and the move history
+    leading up to a position don't split the cache. Every thread gets its own
+    connection and the database runs in WAL mode, so pool workers and separate
+    processes can read and write the same file at once.
+    """
+
+    def __init__(self, path: str = os.path.join("tests", "evaluation", "stockfish_labels.sqlite")):
+        self.path = path
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        connection = self._connection()
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS labels ("
+            "fen TEXT NOT NULL, depth INTEGER NOT NULL, multipv INTEGER NOT NULL, result TEXT NOT NULL, "
+            "PRIMARY KEY (fen, depth, multipv))"
+        )
+        connection.commit()
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            # Writers wait for each other instead of failing with "database is locked"
+            connection = sqlite3.connect(self.path, timeout=60)
+            self.local.connection = connection
+        return connection
+
+    @staticmethod
+    def key(board: chess.Board) -> str:
+        return board.epd()
+
+    def get(self, board: chess.Board, depth: int, multipv: int) -> Optional[str]:
+        row = self._connection().execute(
+            "SELECT result FROM labels WHERE fen = ? AND depth = ? AND multipv = ?",
+            (self.key(board), depth, multipv),
+        ).fetchone()
+
+        with self.lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return row[0]
+
+    def put(self, board: chess.Board, depth: int, multipv: int, result: str) -> None:
+        connection = self._connection()
+        connection.execute(
+            "INSERT OR REPLACE INTO labels (fen, depth, multipv, result) VALUES (?, ?, ?, ?)",
+            (self.key(board), depth, multipv, result),
+        )
+        connection.commit()
+
+    def __len__(self) -> int:
+        return self._connection().execute("SELECT COUNT(*) FROM labels").fetchone()[0]
+
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self) -> str:
+        return f"{len(self)} labels stored, {self.hits} hits, {self.misses} misses, hit rate {self.hit_rate():.1%}"
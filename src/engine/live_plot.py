@@ -1,12 +1,44 @@
 # pylint: disable=too-many-instance-attributes
+import json
+import os
+import time
+from typing import Dict, Optional, Tuple
+
 import matplotlib.pyplot as plt
 import numpy as np
 
+from .metrics import MetricsSink
+
+
+class Trend:
+    """Least squares line through (1, y1), (2, y2), ... kept up to date from running sums."""
+
+    def __init__(self):
+        self.n = 0
+        self.sum_x = 0.0
+        self.sum_xx = 0.0
+        self.sum_y = 0.0
+        self.sum_xy = 0.0
+
+    def add(self, y: float):
+        self.n += 1
+        self.sum_x += self.n
+        self.sum_xx += self.n * self.n
+        self.sum_y += y
+        self.sum_xy += self.n * y
+
+    def line(self):
+        slope = (self.n * self.sum_xy - self.sum_x * self.sum_y) / (self.n * self.sum_xx - self.sum_x * self.sum_x)
+        intercept = (self.sum_y - slope * self.sum_x) / self.n
+        return [1, self.n], [slope + intercept, slope * self.n + intercept]
+
 
-class LivePlot:
+class LivePlot(MetricsSink):
     def __init__(self):
         self.accuracies = []
         self.losses = []
+        self.accuracy_trend = Trend()
+        self.loss_trend = Trend()
 
         plt.ion()
         self.fig, (self.ax_acc, self.ax_loss) = plt.subplots(
@@ -35,28 +67,57 @@ class LivePlot:
 
         self.fig.tight_layout()
 
-    def update(self, acc, loss):
+    @staticmethod
+    def _point(metrics: Dict[str, float]) -> Optional[Tuple[float, float]]:
+        accuracy = metrics.get("policy_accuracy", metrics.get("accuracy"))
+        if accuracy is None or "loss" not in metrics:
+            return None
+        return accuracy, metrics["loss"]
+
+    def write(self, step: int, metrics: Dict[str, float]) -> None:
+        point = self._point(metrics)
+        if point is not None:
+            self.update(*point)
+
+    def update(self, acc, loss, draw=True):
         self.accuracies.append(acc)
         self.losses.append(loss)
+        self.accuracy_trend.add(acc)
+        self.loss_trend.add(loss)
         x = np.arange(1, len(self.accuracies) + 1)
 
         self.line_acc.set_data(x, self.accuracies)
         self.ax_acc.set_xlim(1, len(self.accuracies) + 1)
         self.ax_acc.set_ylim(min(self.accuracies) - 0.01, max(self.accuracies) + 0.01)
 
-        if len(x) >= 2:
-            coeffs = np.polyfit(x, self.accuracies, 1)
-            trend = np.poly1d(coeffs)
-            self.trend_acc.set_data(x, trend(x))
-
         self.line_loss.set_data(x, self.losses)
         self.ax_loss.set_xlim(1, len(self.losses) + 1)
         self.ax_loss.set_ylim(min(self.losses) - 0.1, max(self.losses) + 0.1)
 
         if len(x) >= 2:
-            coeffs = np.polyfit(x, self.losses, 1)
-            trend = np.poly1d(coeffs)
-            self.trend_loss.set_data(x, trend(x))
+            self.trend_acc.set_data(*self.accuracy_trend.line())
+            self.trend_loss.set_data(*self.loss_trend.line())
+
+        if draw:
+            self.fig.canvas.draw_idle()
+            self.fig.canvas.flush_events()
+
+    @staticmethod
+    def follow(path: str, interval: float = 2.0):
+        """Plots a metrics.jsonl file written by a training run and keeps reading new lines until the window is closed."""
+        while not os.path.exists(path):
+            time.sleep(interval)
+
+        live_plot = LivePlot()
+        with open(path, "r", encoding="utf-8") as log:
+            pending = ""
+            while plt.fignum_exists(live_plot.fig.number):
+                pending += log.read()
+                *lines, pending = pending.split("\n")
+                for line in lines:
+                    point = live_plot._point(json.loads(line)) if line.strip() else None
+                    if point is not None:
+                        live_plot.update(*point, draw=False)
 
-        self.fig.canvas.draw()
-        self.fig.canvas.flush_events()
+                live_plot.fig.canvas.draw_idle()
+                plt.pause(interval)
@@ -0,0 +1,148 @@
+import csv
+import json
+import os
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Tuple
+
+METRICS_FORMATS = ["jsonl", "csv", "tensorboard", "live_plot"]
+
+
+def metrics_dir(run_name: str) -> str:
+    return os.path.join("logs", run_name)
+
+
+def last_logged(directory: str) -> Tuple[int, int]:
+    """Step and position count of the last chunk an earlier run logged to directory, (0, 0) for a new run.
+
+    Read from metrics.jsonl or metrics.csv, a continued run carries on from
+    there so the appended logs never repeat a step.
+    """
+    jsonl_path = os.path.join(directory, "metrics.jsonl")
+    csv_path = os.path.join(directory, "metrics.csv")
+    last: Optional[Dict] = None
+
+    if os.path.exists(jsonl_path):
+        with open(jsonl_path, encoding="utf-8") as log:
+            for line in log:
+                if line.strip():
+                    last = json.loads(line)
+    elif os.path.exists(csv_path):
+        with open(csv_path, newline="", encoding="utf-8") as log:
+            for row in csv.DictReader(log):
+                last = row
+
+    if not last:
+        return 0, 0
+    return int(float(last["step"])), int(float(last.get("positions") or 0))
+
+
+def _open_append(path: str, **kwargs):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    return open(path, "a", encoding="utf-8", **kwargs)  # pylint: disable=consider-using-with
+
+
+class MetricsSink(ABC):
+    """Receives the training metrics once per chunk, on the training thread, so writes have to stay cheap."""
+
+    @abstractmethod
+    def write(self, step: int, metrics: Dict[str, float]) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class JsonlSink(MetricsSink):
+    """One JSON object per line, flushed right away so a viewer process can tail the file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.file = _open_append(path)
+
+    def write(self, step: int, metrics: Dict[str, float]) -> None:
+        self.file.write(json.dumps({"step": step, "time": time.time(), **metrics}) + "\n")
+        self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class CsvSink(MetricsSink):
+    """Columns come from the first row, or from the existing header when a run continues, later keys are dropped."""
+
+    def __init__(self, path: str):
+        self.path = path
+        fieldnames = None
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            with open(path, newline="", encoding="utf-8") as existing:
+                fieldnames = next(csv.reader(existing), None)
+
+        self.file = _open_append(path, newline="")
+        self.writer = csv.DictWriter(self.file, fieldnames, extrasaction="ignore", restval="") if fieldnames else None
+
+    def write(self, step: int, metrics: Dict[str, float]) -> None:
+        row = {"step": step, "time": time.time(), **metrics}
+        if self.writer is None:
+            self.writer = csv.DictWriter(self.file, list(row), extrasaction="ignore", restval="")
+            self.writer.writeheader()
+        self.writer.writerow(row)
+        self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class TensorBoardSink(MetricsSink):
+    """Scalar summaries in TensorBoard's event format, view them with: tensorboard --logdir logs
+
+    Written with tf.summary.write and the scalar plugin's metadata, since
+    tf.summary.scalar needs the tensorboard package installed in the training
+    environment. Scalars are float32, so integer counters like positions are
+    left out instead of being rounded once they pass 2**24.
+    """
+
+    def __init__(self, log_dir: str):
+        import tensorflow as tf
+        from tensorflow.core.framework import summary_pb2
+
+        self.tf = tf
+        self.writer = tf.summary.create_file_writer(log_dir)
+        metadata = summary_pb2.SummaryMetadata(data_class=summary_pb2.DATA_CLASS_SCALAR)
+        metadata.plugin_data.plugin_name = "scalars"
+        self.metadata = metadata.SerializeToString()
+
+    def write(self, step: int, metrics: Dict[str, float]) -> None:
+        with self.writer.as_default(step=step):
+            for name, value in metrics.items():
+                if isinstance(value, int):
+                    continue
+                self.tf.summary.write(name, self.tf.constant(value, dtype=self.tf.float32), metadata=self.metadata)
+        self.writer.flush()
+
+    def close(self) -> None:
+        self.writer.close()
+
+
+def create_sinks(formats: List[str], run_name: str, directory: Optional[str] = None) -> List[MetricsSink]:
+    directory = directory or metrics_dir(run_name)
+    sinks: List[MetricsSink] = []
+
+    for metrics_format in formats:
+        if metrics_format == "jsonl":
+            sinks.append(JsonlSink(os.path.join(directory, "metrics.jsonl")))
+        elif metrics_format == "csv":
+            sinks.append(CsvSink(os.path.join(directory, "metrics.csv")))
+        elif metrics_format == "tensorboard":
+            sinks.append(TensorBoardSink(os.path.join(directory, "tensorboard")))
+        elif metrics_format == "live_plot":
+            # Draws on the training thread, a viewer process tailing metrics.jsonl doesn't
+            from .live_plot import LivePlot
+
+            sinks.append(LivePlot())
+        else:
+            raise ValueError(f"Unknown metrics format {metrics_format}, expected one of {METRICS_FORMATS}")
+
+    return sinks
@@ -1,22 +1,45 @@
 import os
 from datetime import datetime
+from typing import List, Optional
 import numpy as np
 import chess
 
 import tensorflow as tf
 from tensorflow.keras import layers, models, regularizers
 
-from utils import UCI_DICT, Logger
-from engine.live_plot import LivePlot
+from utils import UCI_DICT, Logger, board_to_matrix, boards_to_matrix
+from engine.checkpointer import Checkpointer
+from engine.metrics import MetricsSink
+
+CHUNK_SIZE = 100000
+MAX_EPOCHS = 1000000
 
 
 class Model:
-    def __init__(self, model, name):
+    def __init__(self, model, name, jit_compile=False):
         self.model = model
         self.name = name
+        self.jit_compile = jit_compile
+        self.has_value_head = "value" in model.output_names
+        self.soft_targets = self._policy_loss_name() == "CategoricalCrossentropy"
+        # Calling the traced graph directly skips the data adapter and callbacks model.predict sets up every call
+        self._forward = tf.function(
+            lambda board_matrices: self.model(board_matrices, training=False),
+            input_signature=[tf.TensorSpec(shape=(None, 8, 8, 18), dtype=tf.float32)],
+            jit_compile=jit_compile,
+        )
+        if jit_compile:
+            self.model.jit_compile = True
+
+    @property
+    def precision(self):
+        return self.model.dtype_policy.name
+
+    def warmup(self):
+        self._forward(tf.zeros((1, 8, 8, 18), dtype=tf.float32))
 
     @staticmethod
-    def _build_model(output_size):
+    def _build_model(output_size, value_head=False, value_weight=0.5):
         inputs = layers.Input(shape=(8, 8, 18))
 
         x = layers.Conv2D(128, kernel_size=3, padding="same", activation="relu")(inputs)
@@ -41,108 +64,268 @@ class Model:
         p = layers.BatchNormalization()(p)
         p = layers.Flatten()(p)
         p = layers.Dense(1024, activation="gelu")(p)
-        p = layers.Dense(output_size)(p)
+        # Output layers stay float32 under mixed precision so the logits and their softmax are stable
+        p = layers.Dense(output_size, name="policy", dtype="float32")(p)
+
+        if not value_head:
+            model = models.Model(inputs=inputs, outputs=p)
+            model.compile(
+                optimizer=tf.keras.optimizers.Adam(learning_rate=0.0003),
+                loss=tf.keras.losses.SparseCategoricalCrossentropy(from_logits=True),
+                metrics=["accuracy"],
+            )
+            return model
 
-        model = models.Model(inputs=inputs, outputs=p)
+        # Expected game result from the side to move's point of view, in [-1, 1]
+        v = layers.Conv2D(1, kernel_size=1, activation="relu")(x)
+        v = layers.BatchNormalization()(v)
+        v = layers.Flatten()(v)
+        v = layers.Dense(128, activation="relu")(v)
+        v = layers.Dense(1, activation="tanh", name="value", dtype="float32")(v)
 
+        model = models.Model(inputs=inputs, outputs={"policy": p, "value": v})
         model.compile(
             optimizer=tf.keras.optimizers.Adam(learning_rate=0.0003),
-            loss=tf.keras.losses.SparseCategoricalCrossentropy(from_logits=True),
-            metrics=["accuracy"],
+            loss={
+                "policy": tf.keras.losses.SparseCategoricalCrossentropy(from_logits=True),
+                "value": tf.keras.losses.MeanSquaredError(),
+            },
+            loss_weights={"policy": 1.0, "value": value_weight},
+            metrics={"policy": ["accuracy"], "value": ["mae"]},
         )
 
         return model
 
+    def _policy_loss_name(self):
+        loss = self.model.get_compile_config()["loss"]
+        if self.has_value_head:
+            loss = loss["policy"]
+        return loss["class_name"] if isinstance(loss, dict) else loss
+
+    def compile_policy_loss(self, soft_targets: bool):
+        """Recompiles the policy loss for move indices or dense move distributions, keeping the optimizer state."""
+        if soft_targets == self.soft_targets:
+            return
+
+        if soft_targets:
+            policy_loss = tf.keras.losses.CategoricalCrossentropy(from_logits=True)
+            accuracy = tf.keras.metrics.CategoricalAccuracy(name="accuracy")
+        else:
+            policy_loss = tf.keras.losses.SparseCategoricalCrossentropy(from_logits=True)
+            accuracy = "accuracy"
+
+        if self.has_value_head:
+            self.model.compile(
+                optimizer=self.model.optimizer,
+                loss={"policy": policy_loss, "value": tf.keras.losses.MeanSquaredError()},
+                loss_weights=self.model.get_compile_config()["loss_weights"],
+                metrics={"policy": [accuracy], "value": ["mae"]},
+                jit_compile=self.jit_compile,
+            )
+        else:
+            self.model.compile(
+                optimizer=self.model.optimizer, loss=policy_loss, metrics=[accuracy], jit_compile=self.jit_compile
+            )
+
+        self.soft_targets = soft_targets
+
+    def targets(self, labels, values):
+        """Training targets in the layout the compiled model expects."""
+        if self.has_value_head:
+            return {"policy": labels, "value": values}
+        return labels
+
 
     def evaluate(self, data, labels, batch_size=64):
-        results = self.model.evaluate(data, labels, batch_size=batch_size, verbose=1)
-        loss, accuracy = results[0], results[1]
+        if self.has_value_head or self.soft_targets:
+            # The compiled loss expects other targets than move indices, score the policy output on its own
+            logits = np.concatenate(
+                [self.predict_matrices(data[i : i + batch_size]) for i in range(0, len(data), batch_size)]
+            )
+            loss = float(tf.keras.losses.SparseCategoricalCrossentropy(from_logits=True)(labels, logits))
+            accuracy = float(np.mean(np.argmax(logits, axis=1) == np.asarray(labels)))
+        else:
+            results = self.model.evaluate(data, labels, batch_size=batch_size, verbose=1)
+            loss, accuracy = results[0], results[1]
+
         Logger.info(f"Evaluation - Loss: {loss:.4f}, Accuracy: {accuracy:.4f}")
         return loss, accuracy
-    
+
+    def evaluate_values(self, data, values, batch_size=64):
+        """Mean absolute error of the value head against game results, None without a value head."""
+        if not self.has_value_head:
+            return None
+
+        predicted = np.concatenate(
+            [self.predict_values(data[i : i + batch_size])[1] for i in range(0, len(data), batch_size)]
+        )
+        mae = float(np.mean(np.abs(predicted - np.asarray(values, dtype=np.float32))))
+        Logger.info(f"Evaluation - Value MAE: {mae:.4f}")
+        return mae
+
     def predict(self, board: chess.Board):
         board_matrix = self.board_to_matrix(board)
         board_matrix = np.expand_dims(board_matrix, axis=0)
-        prediction = self.model.predict(board_matrix, verbose=0)
-        return prediction
+        return self.predict_matrices(board_matrix)
+
+    def predict_matrices(self, board_matrices: np.ndarray) -> np.ndarray:
+        outputs = self._forward(board_matrices)
+        if self.has_value_head:
+            return outputs["policy"].numpy()
+        return outputs.numpy()
+
+    def predict_values(self, board_matrices: np.ndarray):
+        """Policy logits and values in a single forward pass, values are None without a value head."""
+        outputs = self._forward(board_matrices)
+        if not self.has_value_head:
+            return outputs.numpy(), None
+        return outputs["policy"].numpy(), outputs["value"].numpy()[:, 0]
+
+    def train(
+        self,
+        dataset,
+        batch_size: int,
+        steps_per_epoch: Optional[int] = None,
+        checkpointer: Optional[Checkpointer] = None,
+        validation_data=None,
+        sinks: Optional[List[MetricsSink]] = None,
+        start_step: int = 0,
+        start_positions: int = 0,
+    ):
+        # A continued run carries on counting where the metrics of the last run stopped
+        positions_processed = start_positions
+        game_chunk = start_step + 1
+        sinks = sinks or []
+        checkpointer = checkpointer or Checkpointer(self.model, self.name, every_seconds=600)
 
-    def train(self, dataset, batch_size: int):
-        positions_processed = 0
-        game_chunk = 1
-        live_plot = LivePlot()
-        model_path = os.path.join("models", f"{self.model.name}.keras")
+        # Move indices without values can't be fed to fit for a value head, the policy is scored on its own after every chunk
+        policy_validation = None
+        if validation_data is not None and self.has_value_head and not isinstance(validation_data[1], dict):
+            policy_validation, validation_data = validation_data, None
+
+        def chunk_completed(logs, positions):
+            nonlocal positions_processed, game_chunk
+
+            if policy_validation is not None:
+                loss, accuracy = self.evaluate(*policy_validation)
+                logs.update(val_loss=loss, val_policy_loss=loss, val_policy_accuracy=accuracy)
+
+            positions_processed += positions
+            checkpointer.update(logs)
+
+            metrics = {key: float(value) for key, value in logs.items()}
+            metrics["positions"] = positions_processed
+            for sink in sinks:
+                sink.write(game_chunk, metrics)
+
+            Logger.info(
+                f"\033[92m\nGame chunk {game_chunk} completed! Total position processed is {positions_processed}\033[0m"
+            )
+            Logger.info(
+                "\033[33mPress CTRL+C to stop the training process, the model will be saved\n\033[0m"
+            )
+            game_chunk += 1
+
+        # Step and time triggers are checked after every batch, a chunk can be far longer than every_steps
+        batch_callback = tf.keras.callbacks.LambdaCallback(on_train_batch_end=lambda batch, logs: checkpointer.update_batch())
 
         try:
-            for board_positions, gold_standard in dataset:
+            if isinstance(dataset, tf.data.Dataset):
+                # One long fit over the endless pipeline, every epoch stands in for a chunk
+                steps_per_epoch = steps_per_epoch or CHUNK_SIZE // batch_size
+                callback = tf.keras.callbacks.LambdaCallback(
+                    on_epoch_end=lambda epoch, logs: chunk_completed(logs, steps_per_epoch * batch_size)
+                )
+                self.model.fit(
+                    dataset,
+                    epochs=MAX_EPOCHS,
+                    steps_per_epoch=steps_per_epoch,
+                    callbacks=[callback, batch_callback],
+                    validation_data=validation_data,
+                )
+                return
+
+            for board_positions, gold_standard, values in dataset:
 
                 if len(board_positions) == len(gold_standard):
                     history = self.model.fit(
-                        board_positions, gold_standard, epochs=1, batch_size=batch_size
-                    )
-                    if "accuracy" in history.history and "loss" in history.history:
-                        acc = history.history["accuracy"][-1]
-                        loss = history.history["loss"][-1]
-                        live_plot.update(acc, loss)
-
-                    positions_processed += len(board_positions)
-                    self.model.save(model_path)
-
-                    Logger.info(
-                        f"\033[92m\nGame chunk {game_chunk} completed! Total position processed is {positions_processed}\033[0m"
-                    )
-                    Logger.info(
-                        "\033[33mPress CTRL+C to stop the training process, the model will be saved\n\033[0m"
+                        board_positions,
+                        self.targets(gold_standard, values),
+                        epochs=1,
+                        batch_size=batch_size,
+                        validation_data=validation_data,
+                        callbacks=[batch_callback],
                     )
-                    game_chunk += 1
+                    logs = {key: values[-1] for key, values in history.history.items()}
+                    chunk_completed(logs, len(board_positions))
 
         except KeyboardInterrupt:
+            checkpointer.save(wait=True)
             Logger.info("\033[92mModel saved!\033[0m")
-            
+        finally:
+            checkpointer.close()
+            for sink in sinks:
+                sink.close()
+
     @staticmethod
     def board_to_matrix(board: chess.Board):
-        matrix = np.zeros((8, 8, 18), dtype=np.float32)
-
-        piece_map = board.piece_map()
-        for square, piece in piece_map.items():
-            row = square // 8
-            col = square % 8
-            piece_type = piece.piece_type - 1
-            color_offset = 0 if piece.color == chess.WHITE else 6
-            matrix[row, col, piece_type + color_offset] = 1
-
-        if board.turn == chess.WHITE:
-            matrix[:, :, 12] = 1
-
-        if board.has_kingside_castling_rights(chess.WHITE):
-            matrix[:, :, 13] = 1
-        if board.has_queenside_castling_rights(chess.WHITE):
-            matrix[:, :, 14] = 1
-        if board.has_kingside_castling_rights(chess.BLACK):
-            matrix[:, :, 15] = 1
-        if board.has_queenside_castling_rights(chess.BLACK):
-            matrix[:, :, 16] = 1
-            
-        move_count = board.fullmove_number / 200
-        matrix[:, :, 17] = move_count
-
-        return matrix
+        return board_to_matrix(board)
+
+    @staticmethod
+    def boards_to_matrix(boards: List[chess.Board], out: Optional[np.ndarray] = None):
+        return boards_to_matrix(boards, out)
 
     @staticmethod
-    def load(model_name):
+    def _convert_precision(model, precision):
+        """Rebuilds a loaded model with another dtype policy, keeping the weights and if possible the optimizer state."""
+        outputs = set(model.output_names)
+        config = model.get_config()
+        for layer in config["layers"]:
+            if layer["class_name"] != "InputLayer" and layer["config"]["name"] not in outputs:
+                layer["config"]["dtype"] = precision
+
+        converted = models.Model.from_config(config)
+        converted.set_weights(model.get_weights())
+        converted.compile_from_config(model.get_compile_config())
+
+        if model.optimizer is not None and model.optimizer.built:
+            converted.optimizer.build(converted.trainable_variables)
+            if len(converted.optimizer.variables) == len(model.optimizer.variables):
+                for variable, value in zip(converted.optimizer.variables, model.optimizer.variables):
+                    variable.assign(value)
+            else:
+                Logger.warning(f"Optimizer state can't be carried over to {precision}, it starts fresh")
+
+        return converted
+
+    @staticmethod
+    def load(model_name, value_head=False, value_weight=0.5, precision="float32", jit_compile=False):
         model = None
         model_path = os.path.join("models", f"{model_name}.keras") if model_name else None
+
+        # New layers pick up the global policy, so it has to be set before anything is built
+        tf.keras.mixed_precision.set_global_policy(precision)
         
         if model_name and os.path.exists(model_path):
             model = models.load_model(model_path)
+            hidden_layers = [
+                layer for layer in model.layers
+                if not isinstance(layer, layers.InputLayer) and layer.name not in model.output_names
+            ]
+            if any(layer.dtype_policy.name != precision for layer in hidden_layers):
+                Logger.info(f"Converting {model_name} to {precision}")
+                model = Model._convert_precision(model, precision)
         elif not model_name:
             model_name = datetime.now().strftime("model_%Y%m%d_%H%M%S")
             Logger.warning(f"No model name given, creating new model with name {model_name}")
-            model = Model._build_model(len(UCI_DICT))
+            model = Model._build_model(len(UCI_DICT), value_head, value_weight)
         else:
             Logger.warning(f"No model found named {model_name}, creating a new model...")
-            model = Model._build_model(len(UCI_DICT))
-        
-        return Model(model, model_name)
+            model = Model._build_model(len(UCI_DICT), value_head, value_weight)
+
+        loaded = Model(model, model_name, jit_compile)
+        loaded.warmup()
+        return loaded
 
     def fit(self, data, targets, epochs=10, batch_size=64):
         self.model.fit(data, targets, epochs=epochs, batch_size=batch_size)
@@ -0,0 +1,4 @@
+# Kept apart from model.py and tflite_model.py so the CLI can list them without importing TensorFlow
+PRECISIONS = ["float32", "mixed_float16", "mixed_bfloat16"]
+
+QUANTIZATIONS = ["int8", "dynamic", "float16"]
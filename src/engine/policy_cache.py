@@ -0,0 +1,76 @@
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+import chess
+import chess.polyglot
+import numpy as np
+
+
+# Policy logits and the value head's output, None for models without one
+Evaluation = Tuple[np.ndarray, Optional[float]]
+
+
+class PolicyCache:
+    """Thread-safe LRU cache of network outputs, bounded by the memory the cached arrays use.
+
+    Positions are keyed by their Zobrist hash together with the fullmove number,
+    since the move counter is one of the network's input planes and a hit must
+    return exactly what the network would have.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.entries: "OrderedDict[Tuple[int, int], Evaluation]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(board: chess.Board) -> Tuple[int, int]:
+        return chess.polyglot.zobrist_hash(board), board.fullmove_number
+
+    def get(self, board: chess.Board) -> Optional[Evaluation]:
+        key = self.key(board)
+        with self.lock:
+            evaluation = self.entries.get(key)
+            if evaluation is None:
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return evaluation
+
+    def put(self, board: chess.Board, logits: np.ndarray, value: Optional[float] = None) -> None:
+        key = self.key(board)
+        # Cached arrays are shared between callers, freeze them so nobody edits them in place
+        logits = np.array(logits, copy=True)
+        logits.flags.writeable = False
+
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.bytes -= previous[0].nbytes
+
+            self.entries[key] = (logits, value)
+            self.bytes += logits.nbytes
+
+            while self.bytes > self.max_bytes and len(self.entries) > 1:
+                _, (evicted, _) = self.entries.popitem(last=False)
+                self.bytes -= evicted.nbytes
+                self.evictions += 1
+
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self) -> str:
+        return (
+            f"{len(self.entries)} positions ({self.bytes / 1024 / 1024:.1f} MB), "
+            f"{self.hits} hits, {self.misses} misses, {self.evictions} evictions, "
+            f"hit rate {self.hit_rate():.1%}"
+        )
@@ -0,0 +1,195 @@
+import math
+import threading
+import time
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Tuple
+
+import chess
+import numpy as np
+
+from utils import Logger, boards_to_matrix
+from .engine import Engine
+
+if TYPE_CHECKING:
+    from .model import Model
+
+PIECE_VALUES = {chess.PAWN: 1, chess.KNIGHT: 3, chess.BISHOP: 3, chess.ROOK: 5, chess.QUEEN: 9, chess.KING: 0}
+
+VIRTUAL_LOSS = 1.0
+
+
+def material_value(board: chess.Board) -> float:
+    """Material balance from the side to move's point of view, squashed into (-1, 1)."""
+    balance = 0
+    for piece_type, value in PIECE_VALUES.items():
+        balance += value * (
+            len(board.pieces(piece_type, board.turn)) - len(board.pieces(piece_type, not board.turn))
+        )
+    return math.tanh(balance / 10)
+
+
+def terminal_value(board: chess.Board) -> Optional[float]:
+    """Exact value for finished games from the side to move's point of view, None if the game goes on."""
+    # Draws that have to be claimed are skipped, checking them at every leaf is too slow
+    outcome = board.outcome()
+    if outcome is None:
+        return None
+    if outcome.winner is None:
+        return 0.0
+    return 1.0 if outcome.winner == board.turn else -1.0
+
+
+class Node:
+    __slots__ = ("prior", "visits", "value_sum", "children")
+
+    def __init__(self, prior: float):
+        self.prior = prior
+        self.visits = 0
+        # Value from the point of view of the player who made the move leading here
+        self.value_sum = 0.0
+        self.children: Optional[Dict[chess.Move, "Node"]] = None
+
+    def q(self) -> float:
+        return self.value_sum / self.visits if self.visits else 0.0
+
+
+class MCTS:
+    """PUCT search over the policy network's top-k moves.
+
+    Leaves are collected in batches using virtual loss and evaluated in a
+    single forward pass, the search stops at the node budget, the time limit
+    or when the caller sets its stop event, whichever comes first.
+    """
+
+    def __init__(
+        self,
+        model: "Model",
+        nodes: int = 400,
+        time_limit: float = 1.0,
+        top_k: int = 8,
+        batch_size: int = 16,
+        c_puct: float = 1.5,
+    ):
+        if time_limit <= 0:
+            # The engine scales the node budget by the time per move, see Engine.search_move
+            raise ValueError(f"The search needs a positive time limit per move, got {time_limit}")
+        self.model = model
+        self.nodes = nodes
+        self.time_limit = time_limit
+        self.top_k = top_k
+        self.batch_size = batch_size
+        self.c_puct = c_puct
+        # An Engine replaces this with its own evaluate, which adds its cache and inference server
+        self.predict_values: Callable[[List[chess.Board]], Tuple[np.ndarray, Optional[np.ndarray]]] = self.predict_model
+
+    def predict_model(self, boards: List[chess.Board]) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        return self.model.predict_values(boards_to_matrix(boards))
+
+    def evaluate(self, boards: List[chess.Board]) -> Tuple[np.ndarray, np.ndarray]:
+        """Policy logits and values from the side to move's point of view for a batch of positions."""
+        logits, values = self.predict_values(boards)
+        if values is None:
+            # Policy-only models fall back to counting material
+            values = np.array([material_value(board) for board in boards], dtype=np.float32)
+        return logits, values
+
+    def expand(self, node: Node, board: chess.Board, logits: np.ndarray) -> None:
+        moves, probs = Engine.legal_move_probabilities(board, logits)
+        node.children = {}
+
+        if probs is None:
+            return
+
+        moves, probs = moves[: self.top_k], probs[: self.top_k]
+        total = probs.sum()
+        for move, prob in zip(moves, probs):
+            node.children[move] = Node(prob / total)
+
+    def select_child(self, node: Node) -> Tuple[chess.Move, Node]:
+        assert node.children is not None, "select_child needs an expanded node"
+        scale = self.c_puct * math.sqrt(node.visits + 1)
+        return max(
+            node.children.items(),
+            key=lambda item: item[1].q() + scale * item[1].prior / (1 + item[1].visits),
+        )
+
+    @staticmethod
+    def backpropagate(path: List[Node], value: float, virtual_loss: bool) -> None:
+        # value is from the point of view of the side to move at the leaf, which is
+        # the opponent of the player who moved into it
+        for node in reversed(path):
+            value = -value
+            if virtual_loss:
+                node.value_sum += VIRTUAL_LOSS
+            else:
+                node.visits += 1
+            node.value_sum += value
+
+    def search(
+        self,
+        board: chess.Board,
+        nodes: Optional[int] = None,
+        time_limit: Optional[float] = None,
+        stop: Optional[threading.Event] = None,
+    ):
+        """Best move and the search tree, stop ends the search early with the best move found so far."""
+        nodes = self.nodes if nodes is None else nodes
+        time_limit = self.time_limit if time_limit is None else time_limit
+        deadline = time.monotonic() + time_limit
+
+        root = Node(1.0)
+        logits, _ = self.evaluate([board])
+        self.expand(root, board, logits[0])
+
+        if not root.children:
+            return None, root
+
+        if len(root.children) == 1:
+            return next(iter(root.children)), root
+
+        evaluated = 1
+        while evaluated < nodes and time.monotonic() < deadline and not (stop is not None and stop.is_set()):
+            pending: List[Tuple[List[Node], chess.Board]] = []
+            pending_nodes = set()
+
+            for _ in range(min(self.batch_size, nodes - evaluated)):
+                node = root
+                path = [root]
+                leaf_board = board.copy(stack=False)
+
+                while node.children:
+                    move, node = self.select_child(node)
+                    leaf_board.push(move)
+                    path.append(node)
+
+                value = terminal_value(leaf_board)
+                if value is not None:
+                    self.backpropagate(path, value, virtual_loss=False)
+                    evaluated += 1
+                    continue
+
+                if id(node) in pending_nodes:
+                    # Virtual loss wasn't enough to steer away, evaluate what we have
+                    break
+
+                # Virtual loss steers the rest of the batch away from this leaf until it is evaluated
+                for visited in path:
+                    visited.visits += 1
+                    visited.value_sum -= VIRTUAL_LOSS
+                pending_nodes.add(id(node))
+                pending.append((path, leaf_board))
+
+            if not pending:
+                continue
+
+            logits, values = self.evaluate([leaf_board for _, leaf_board in pending])
+            for (path, leaf_board), leaf_logits, value in zip(pending, logits, values):
+                self.expand(path[-1], leaf_board, leaf_logits)
+                self.backpropagate(path, float(value), virtual_loss=True)
+            evaluated += len(pending)
+
+        move, best = max(root.children.items(), key=lambda item: item[1].visits)
+        Logger.debug(
+            f"Search evaluated {evaluated} nodes in {time_limit - max(deadline - time.monotonic(), 0):.2f}s, "
+            f"chose {move} with {best.visits} visits and value {best.q():.3f}"
+        )
+        return move, root
@@ -0,0 +1,163 @@
+import os
+import sys
+from typing import List, Optional
+
+import numpy as np
+from chess import pgn
+from tqdm import tqdm
+
+from utils import GAME_RESULTS, UCI_DICT, Logger, expand_bitboards, pack_board
+
+SHARD_SUFFIX = ".bin"
+
+# One fixed-size record per position. Shards are headerless arrays of this
+# dtype so they can be memory-mapped directly, the record count follows from
+# the file size.
+RECORD_DTYPE = np.dtype([
+    ("masks", "<u8", (12,)),
+    ("flags", "<f4", (6,)),
+    ("move", "<u2"),
+    ("ply", "<u2"),
+    ("result", "i1"),
+])
+
+
+def write_shards(pgn_dir: str, out_dir: str, shard_size: int = 1000000, min_ply: int = 7) -> int:
+    """Converts every PGN file in pgn_dir into fixed-record shards in out_dir, returns the number of positions written."""
+    os.makedirs(out_dir, exist_ok=True)
+    files = sorted(fl for fl in os.listdir(pgn_dir) if fl.endswith(".pgn"))
+
+    if not files:
+        Logger.error(f"No PGN files found in directory {pgn_dir}. Quickfix: make dataset")
+        sys.exit(1)
+
+    # ShardDataset reads every shard in the directory, so shards of an earlier run must not survive
+    stale = [fl for fl in os.listdir(out_dir) if fl.startswith("shard_") and fl.endswith((SHARD_SUFFIX, SHARD_SUFFIX + ".tmp"))]
+    for filename in stale:
+        os.remove(os.path.join(out_dir, filename))
+    if stale:
+        Logger.info(f"Removed {len(stale)} shards of an earlier run from {out_dir}")
+
+    records = np.zeros(shard_size, dtype=RECORD_DTYPE)
+    n = 0
+    shard_index = 0
+    total = 0
+
+    def flush():
+        nonlocal n, shard_index, total
+        path = os.path.join(out_dir, f"shard_{shard_index:05d}{SHARD_SUFFIX}")
+        tmp_path = path + ".tmp"
+        records[:n].tofile(tmp_path)
+        os.replace(tmp_path, path)
+        total += n
+        shard_index += 1
+        n = 0
+
+    progress = tqdm(desc="Preprocessing", unit="game", colour="green")
+    for filename in files:
+        with open(os.path.join(pgn_dir, filename), "r", encoding="utf-8") as data:
+            while True:
+                game = pgn.read_game(data)
+                if game is None:
+                    break
+
+                progress.update(1)
+                result = GAME_RESULTS.get(game.headers.get("Result", "*"), 0)
+                board = game.board()
+
+                for ply, move in enumerate(game.mainline_moves()):
+                    if ply >= min_ply:
+                        record = records[n]
+                        record["masks"], record["flags"] = pack_board(board)
+                        record["move"] = UCI_DICT[move.uci()]
+                        record["ply"] = ply
+                        record["result"] = result
+                        n += 1
+
+                        if n == shard_size:
+                            flush()
+
+                    board.push(move)
+
+    progress.close()
+    if n:
+        flush()
+
+    Logger.info(f"Wrote {total} positions into {shard_index} shards in {out_dir}")
+    return total
+
+
+class ShardDataset:
+    """Samples positions uniformly from memory-mapped shards written by write_shards."""
+
+    def __init__(self, data_dir: str, chunk_size: int = 100000, seed: Optional[int] = None):
+        self.data_dir = data_dir
+        self.chunk_size = chunk_size
+        self.rng = np.random.default_rng(seed)
+
+        files = sorted(fl for fl in os.listdir(data_dir) if fl.endswith(SHARD_SUFFIX))
+        if not files:
+            Logger.error(f"No shards found in directory {data_dir}. Quickfix: python3 src/cli.py preprocess")
+            sys.exit(1)
+
+        # Empty files can't be memory-mapped, they hold no positions anyway
+        self.shards: List[np.memmap] = [
+            np.memmap(os.path.join(data_dir, fl), dtype=RECORD_DTYPE, mode="r")
+            for fl in files
+            if os.path.getsize(os.path.join(data_dir, fl)) > 0
+        ]
+        self.offsets = np.cumsum([0] + [len(shard) for shard in self.shards])
+        if len(self) == 0:
+            Logger.error(f"The shards in directory {data_dir} hold no positions. Quickfix: python3 src/cli.py preprocess")
+            sys.exit(1)
+        Logger.info(f"Found {len(self)} positions in {len(self.shards)} shards")
+
+    def __len__(self) -> int:
+        return int(self.offsets[-1])
+
+    def sample(self, n: int) -> np.ndarray:
+        """Returns n packed records drawn uniformly at random, only these pages are read from disk."""
+        # Sorted indices keep reads within each shard sequential
+        indices = np.sort(self.rng.integers(0, len(self), size=n))
+        shard_ids = np.searchsorted(self.offsets, indices, side="right") - 1
+
+        records = np.empty(n, dtype=RECORD_DTYPE)
+        for shard_id in np.unique(shard_ids):
+            selected = shard_ids == shard_id
+            records[selected] = self.shards[shard_id][indices[selected] - self.offsets[shard_id]]
+
+        self.rng.shuffle(records)
+        return records
+
+    @staticmethod
+    def values(records: np.ndarray) -> np.ndarray:
+        # Results are stored from white's point of view, flags[:, 0] is set when white is to move
+        return np.where(records["flags"][:, 0] > 0, records["result"], -records["result"]).astype(np.float32)
+
+    @staticmethod
+    def expand(records: np.ndarray):
+        return (
+            expand_bitboards(records["masks"], records["flags"]),
+            records["move"].astype(np.int64),
+            ShardDataset.values(records),
+        )
+
+    def packed_batches(self, batch_size: int):
+        while True:
+            records = self.sample(batch_size)
+            yield records["masks"], records["flags"], records["move"].astype(np.int64), self.values(records)
+
+    def as_tf_dataset(self, batch_size: int, with_values: bool = False):
+        """Endless tf.data pipeline, records are sampled on the Python side and expanded in parallel by TensorFlow."""
+        import tensorflow as tf
+        from .tf_pipeline import PACKED_BATCH_SIGNATURE, expand_batches
+
+        batches = tf.data.Dataset.from_generator(
+            lambda: self.packed_batches(batch_size), output_signature=PACKED_BATCH_SIGNATURE
+        )
+        return expand_batches(batches, with_values)
+
+    def __iter__(self):
+        while True:
+            yield self.expand(self.sample(self.chunk_size))
+
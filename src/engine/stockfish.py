@@ -1,20 +1,55 @@
+import json
+import math
+from typing import List, Optional, Tuple
+
 import chess
 import chess.engine
-import math
+
+from .label_cache import LabelCache
 
 
 class Stockfish:
-    def __init__(self, executable="stockfish/stockfish-ubuntu-x86-64-avx2"):
+    def __init__(
+        self,
+        executable="stockfish/stockfish-ubuntu-x86-64-avx2",
+        threads=1,
+        hash_mb=16,
+        deterministic=False,
+        cache: Optional[LabelCache] = None,
+    ):
         self.engine = chess.engine.SimpleEngine.popen_uci(executable)
+        self.engine.configure({"Threads": threads, "Hash": hash_mb})
+        # Clearing the hash table before every search makes the result independent of what was searched before
+        self.deterministic = deterministic
+        self.cache = cache
+
+    def _game(self):
+        return object() if self.deterministic else None
 
     def predict_best_move(self, board: chess.Board, depth=10):
-        return self.engine.play(board, chess.engine.Limit(depth=depth)).move
-    
-    def predict_move_distribution(self, board: chess.Board, depth=5):
+        if self.cache is not None:
+            cached = self.cache.get(board, depth, 1)
+            if cached is not None:
+                return chess.Move.from_uci(cached) if cached else None
+
+        move = self.engine.play(board, chess.engine.Limit(depth=depth), game=self._game()).move
+
+        if self.cache is not None:
+            self.cache.put(board, depth, 1, move.uci() if move else "")
+        return move
+
+    def move_scores(self, board: chess.Board, depth=5, multipv=10) -> List[Tuple[str, int]]:
+        """Centipawn scores of the top moves from the side to move's point of view."""
+        if self.cache is not None:
+            cached = self.cache.get(board, depth, multipv)
+            if cached is not None:
+                return [(move, score) for move, score in json.loads(cached)]
+
         info = self.engine.analyse(
             board,
             chess.engine.Limit(depth=depth),
-            multipv=10
+            multipv=multipv,
+            game=self._game(),
         )
 
         moves_and_scores = []
@@ -25,12 +60,20 @@ class Stockfish:
                 if score is not None:
                     moves_and_scores.append((move.uci(), score))
 
+        if self.cache is not None:
+            self.cache.put(board, depth, multipv, json.dumps(moves_and_scores))
+        return moves_and_scores
+
+    def predict_move_distribution(self, board: chess.Board, depth=5, temperature=1.0):
+        """Softmax over the top moves' centipawn scores, a higher temperature spreads the probability out."""
+        moves_and_scores = self.move_scores(board, depth)
+
         if not moves_and_scores:
             return None
 
         scores = [s for _, s in moves_and_scores]
         max_score = max(scores)
-        exps = [math.exp(s - max_score) for s in scores]
+        exps = [math.exp((s - max_score) / temperature) for s in scores]
         total = sum(exps)
         probs = [e / total for e in exps]
 
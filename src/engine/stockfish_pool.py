@@ -0,0 +1,66 @@
+import os
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, List, Optional, TypeVar
+
+import chess
+from tqdm import tqdm
+
+from .label_cache import LabelCache
+from .stockfish import Stockfish
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+class StockfishPool:
+    """A fixed set of Stockfish processes labelling positions concurrently.
+
+    Every process sits behind its own SimpleEngine, the worker threads only wait
+    on them, so the searches run in parallel while results keep the input order.
+    Searches clear the hash table first, so labels don't depend on which process
+    a position lands on or what it searched before.
+    """
+
+    def __init__(
+        self,
+        processes: Optional[int] = None,
+        threads: int = 1,
+        hash_mb: int = 16,
+        executable: str = "stockfish/stockfish-ubuntu-x86-64-avx2",
+        cache: Optional[LabelCache] = None,
+    ):
+        self.processes = processes or os.cpu_count() or 1
+        self.cache = cache
+        self.engines: "queue.Queue[Stockfish]" = queue.Queue()
+        self.all_engines: List[Stockfish] = []
+
+        for _ in range(self.processes):
+            stockfish = Stockfish(executable, threads=threads, hash_mb=hash_mb, deterministic=True, cache=cache)
+            self.all_engines.append(stockfish)
+            self.engines.put(stockfish)
+
+        self.executor = ThreadPoolExecutor(max_workers=self.processes)
+
+    def _run(self, function: Callable[[Stockfish, T], R], item: T) -> R:
+        stockfish = self.engines.get()
+        try:
+            return function(stockfish, item)
+        finally:
+            self.engines.put(stockfish)
+
+    def map(self, function: Callable[[Stockfish, T], R], items: Iterable[T], desc: Optional[str] = "Labelling") -> List[R]:
+        """function(stockfish, item) for every item, in input order, without a progress bar when desc is None."""
+        items = list(items)
+        results = self.executor.map(lambda item: self._run(function, item), items)
+        if desc is None:
+            return list(results)
+        return list(tqdm(results, total=len(items), desc=desc, unit="position", colour="green"))
+
+    def best_moves(self, boards: Iterable[chess.Board], depth: int = 10, desc: str = "Labelling") -> List[Optional[chess.Move]]:
+        return self.map(lambda stockfish, board: stockfish.predict_best_move(board, depth=depth), boards, desc)
+
+    def close(self):
+        self.executor.shutdown()
+        for stockfish in self.all_engines:
+            stockfish.close()
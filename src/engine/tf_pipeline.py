@@ -0,0 +1,54 @@
+import numpy as np
+import tensorflow as tf
+
+PACKED_POSITION_SIGNATURE = (
+    tf.TensorSpec(shape=(12,), dtype=tf.uint64),
+    tf.TensorSpec(shape=(6,), dtype=tf.float32),
+    tf.TensorSpec(shape=(), dtype=tf.int64),
+    tf.TensorSpec(shape=(), dtype=tf.float32),
+)
+
+PACKED_BATCH_SIGNATURE = (
+    tf.TensorSpec(shape=(None, 12), dtype=tf.uint64),
+    tf.TensorSpec(shape=(None, 6), dtype=tf.float32),
+    tf.TensorSpec(shape=(None,), dtype=tf.int64),
+    tf.TensorSpec(shape=(None,), dtype=tf.float32),
+)
+
+_SHIFTS = tf.constant(np.arange(64, dtype=np.uint64))
+
+
+def expand_packed(masks, flags):
+    """TensorFlow version of utils.expand_bitboards for a batch of packed positions."""
+    bits = tf.bitwise.bitwise_and(tf.bitwise.right_shift(masks[..., None], _SHIFTS), tf.constant(1, tf.uint64))
+    pieces = tf.transpose(tf.reshape(tf.cast(bits, tf.float32), (-1, 12, 8, 8)), (0, 2, 3, 1))
+
+    batch_size = tf.shape(flags)[0]
+    scalars = tf.broadcast_to(flags[:, None, None, :], (batch_size, 8, 8, 6))
+
+    return tf.concat([pieces, scalars], axis=-1)
+
+
+def training_example(with_values: bool):
+    """Maps a packed batch to (inputs, targets) in the layout Model.train expects."""
+
+    def convert(masks, flags, labels, values):
+        if with_values:
+            return expand_packed(masks, flags), {"policy": labels, "value": values}
+        return expand_packed(masks, flags), labels
+
+    return convert
+
+
+def batch_positions(positions: tf.data.Dataset, batch_size: int, shuffle_buffer: int, with_values: bool = False) -> tf.data.Dataset:
+    """Shuffles and batches a stream of packed positions and expands them to 8x8x18 in parallel."""
+    return (
+        positions.shuffle(shuffle_buffer)
+        .batch(batch_size, drop_remainder=True)
+        .map(training_example(with_values), num_parallel_calls=tf.data.AUTOTUNE)
+        .prefetch(tf.data.AUTOTUNE)
+    )
+
+
+def expand_batches(batches: tf.data.Dataset, with_values: bool = False) -> tf.data.Dataset:
+    return batches.map(training_example(with_values), num_parallel_calls=tf.data.AUTOTUNE).prefetch(tf.data.AUTOTUNE)
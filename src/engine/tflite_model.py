@@ -0,0 +1,121 @@
+import itertools
+import os
+import threading
+from typing import Optional
+
+import chess
+import numpy as np
+
+from utils import Logger, board_to_matrix
+from .options import QUANTIZATIONS
+
+
+def _interpreter_class():
+    # The standalone runtimes are a few MB, full TensorFlow is only the fallback
+    try:
+        from ai_edge_litert.interpreter import Interpreter
+    except ImportError:
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            import tensorflow as tf
+
+            Interpreter = tf.lite.Interpreter
+    return Interpreter
+
+
+def tflite_path(model_name: str) -> str:
+    return os.path.join("models", f"{model_name}.tflite")
+
+
+def export_tflite(model, out_path: str, quantization: str = "int8", calibration_positions: int = 1000) -> int:
+    """Converts a Keras model to TFLite, calibrating int8 activations on positions from the evaluation sets.
+
+    Inputs and outputs stay float32, so the export is a drop-in for the Keras model.
+    """
+    import tensorflow as tf
+
+    from .evaluator import TEST_SETS, Evaluator
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model.model)
+
+    if quantization == "float16":
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantization in ("int8", "dynamic"):
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    else:
+        raise ValueError(f"Unknown quantization {quantization}, expected one of {QUANTIZATIONS}")
+
+    if quantization == "int8":
+        per_set = max(1, calibration_positions // len(TEST_SETS))
+
+        def representative_dataset():
+            for _, file in TEST_SETS:
+                path = os.path.join("tests", "evaluation", file)
+                if not os.path.exists(path):
+                    Logger.warning(f"Calibration set {path} is missing, skipping it")
+                    continue
+                # An empty set has no batch, next() would end this generator with a RuntimeError
+                for batch in itertools.islice(Evaluator.stream_npz(path, per_set), 1):
+                    for matrix in batch["X"]:
+                        yield [matrix[None].astype(np.float32)]
+
+        converter.representative_dataset = representative_dataset
+
+    exported = converter.convert()
+
+    directory = os.path.dirname(out_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(out_path, "wb") as out:
+        out.write(exported)
+
+    Logger.info(f"Exported {model.name} with {quantization} quantization to {out_path} ({len(exported) / 1024 / 1024:.1f} MB)")
+    return len(exported)
+
+
+class TFLiteModel:
+    """Forward passes through a TFLite export, a drop-in for Model wherever only inference is needed."""
+
+    def __init__(self, path: str, name: str, num_threads: Optional[int] = None):
+        self.name = name
+        self.precision = "tflite"
+        self.jit_compile = False
+
+        self.interpreter = _interpreter_class()(model_path=path, num_threads=num_threads)
+        self.runner = self.interpreter.get_signature_runner()
+        signature = self.interpreter.get_signature_list()["serving_default"]
+
+        self.input_name = signature["inputs"][0]
+        self.has_value_head = "value" in signature["outputs"]
+        self.policy_output = "policy" if "policy" in signature["outputs"] else signature["outputs"][0]
+        # One interpreter holds one set of tensors, calls from several games take turns
+        self.lock = threading.Lock()
+
+    def warmup(self):
+        self.predict_values(np.zeros((1, 8, 8, 18), dtype=np.float32))
+
+    def predict(self, board: chess.Board):
+        return self.predict_matrices(np.expand_dims(board_to_matrix(board), axis=0))
+
+    def predict_matrices(self, board_matrices: np.ndarray) -> np.ndarray:
+        return self.predict_values(board_matrices)[0]
+
+    def predict_values(self, board_matrices: np.ndarray):
+        with self.lock:
+            outputs = self.runner(**{self.input_name: np.asarray(board_matrices, dtype=np.float32)})
+
+        if not self.has_value_head:
+            return outputs[self.policy_output], None
+        return outputs[self.policy_output], outputs["value"][:, 0]
+
+    @staticmethod
+    def load(model_name: str, num_threads: Optional[int] = None) -> "TFLiteModel":
+        path = tflite_path(model_name)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"No TFLite export found at {path}, create it with: python3 src/cli.py export --model {model_name}")
+
+        loaded = TFLiteModel(path, model_name, num_threads)
+        loaded.warmup()
+        return loaded
@@ -1,7 +1,9 @@
-from engine import Engine, Model
+from engine import MCTS, Engine, Model, PolicyCache
 
 class EngineController:
-    def __init__(self, model_name):
-        self.engine = Engine(Model.load(model_name))
+    def __init__(self, model_name, search_options=None):
+        model = Model.load(model_name)
+        searcher = MCTS(model, **search_options) if search_options else None
+        self.engine = Engine(model, cache=PolicyCache(), searcher=searcher)
         self.turn = False
         self.time = None
@@ -1,3 +1,5 @@
+from typing import Dict, Optional
+
 import pygame
 
 from game import config
@@ -6,8 +8,9 @@ from .state import GameState, StartState
 
 
 class Game:
-    def __init__(self) -> None:
+    def __init__(self, search_options: Optional[Dict] = None) -> None:
         pygame.init() # pylint: disable=no-member
+        self.search_options = search_options
         self.window = pygame.display.set_mode((config.WIDTH, config.HEIGHT))
         pygame.display.set_caption("Chess Engine")
         self.clock = pygame.time.Clock()
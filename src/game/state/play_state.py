@@ -23,7 +23,7 @@ class PlayState(GameState):
         self.board = Board()
         self.renderer = Renderer(game.window)
         self.audio_player = AudioPlayer()
-        self.engine = EngineController(model_name)
+        self.engine = EngineController(model_name, game.search_options)
 
         self.selection = Selection()
 
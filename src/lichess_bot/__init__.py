@@ -1,3 +1,4 @@
+from .api_client import ApiClient
 from .lichess_bot import LichessBot
 
-__all__ = ["LichessBot"]
+__all__ = ["ApiClient", "LichessBot"]
@@ -1,89 +1,132 @@
-import requests
-import threading
-import time
-from typing import Dict, Generator, List, Optional
 import json
+from typing import AsyncGenerator, Dict, List, Optional, Tuple
+
+import aiohttp
+
+from utils import Logger
+from .request_scheduler import RequestScheduler
+
+
+def _retry_after(response: aiohttp.ClientResponse) -> Optional[float]:
+    try:
+        return float(response.headers["Retry-After"])
+    except (KeyError, ValueError):
+        return None
+
 
 class ApiClient:
+    """Lichess API on aiohttp, every stream is a coroutine on the bot's event loop instead of a thread.
+
+    Open it with `async with ApiClient(token) as api`, the session and its
+    connection pool live as long as the block.
+    """
+
     BASE_URL = "https://lichess.org/api"
 
-    def __init__(self, token: str):
+    def __init__(
+        self,
+        token: str,
+        base_url: str = BASE_URL,
+        max_connections: int = 0,
+        scheduler: Optional[RequestScheduler] = None,
+        max_retries: int = 3,
+    ):
         self.token = token
-        self.session = requests.Session()
-        self.session.headers.update({
-            "Authorization": f"Bearer {self.token}",
-            "Accept": "application/x-ndjson"
-        })
-        self.block_until: float = 0
-        self.lock = threading.Lock()
-
-    def _handle_rate_limit(self, response: requests.Response) -> None:
-        if response.status_code == 429:
-            with self.lock:
-                self.block_until = time.time() + 15 * 60
-            raise RuntimeError("Rate limited: pausing for 15 minutes")
-
-    def _wait_if_blocked(self) -> None:
-        while time.time() < self.block_until:
-            time.sleep(60)
-
-    def _get(self, endpoint: str, stream: bool = False) -> requests.Response:
-        self._wait_if_blocked()
-        url = f"{self.BASE_URL}/{endpoint}"
-        response = self.session.get(url, stream=stream, timeout=10)
-        self._handle_rate_limit(response)
-        response.raise_for_status()
-        return response
-
-    def _post(self, endpoint: str, data: Optional[Dict] = None) -> requests.Response:
-        self._wait_if_blocked()
-        url = f"{self.BASE_URL}/{endpoint}"
-        headers = {"Content-Type": "application/x-www-form-urlencoded"}
-        response = self.session.post(url, data=data, headers=headers, timeout=10)
-        self._handle_rate_limit(response)
-        return response
-
-    def get_account(self) -> Dict:
-        return self._get("account").json()
-
-    def get_rating(self) -> int:
-        return self.get_account()["perfs"]["bullet"]["rating"]
-
-    def stream_events(self) -> Generator[Dict, None, None]:
-        response = self._get("stream/event", stream=True)
-        for line in response.iter_lines():
-            if line:
-                yield json.loads(line)
-
-    def accept_challenge(self, challenge_id: str) -> None:
-        self._post(f"challenge/{challenge_id}/accept")
-
-    def stream_game(self, game_id: str) -> Generator[Dict, None, None]:
-        response = self._get(f"bot/game/stream/{game_id}", stream=True)
-        for line in response.iter_lines():
-            if line:
-                yield json.loads(line)
-
-    def make_move(self, game_id: str, move: str) -> requests.Response:
-        return self._post(f"bot/game/{game_id}/move/{move}")
-
-    def send_chat(self, game_id: str, text: str, room: str = "player") -> requests.Response:
+        self.base_url = base_url
+        # Every running game keeps a stream open, 0 lifts aiohttp's default limit of 100
+        self.max_connections = max_connections
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.scheduler = scheduler or RequestScheduler()
+        self.max_retries = max_retries
+
+    async def __aenter__(self) -> "ApiClient":
+        self.session = aiohttp.ClientSession(
+            headers={
+                "Authorization": f"Bearer {self.token}",
+                "Accept": "application/x-ndjson",
+            },
+            connector=aiohttp.TCPConnector(limit=self.max_connections),
+        )
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def _session(self) -> aiohttp.ClientSession:
+        if self.session is None:
+            raise RuntimeError("ApiClient has to be opened with 'async with' before making requests")
+        return self.session
+
+    async def _request(
+        self, method: str, endpoint: str, timeout: aiohttp.ClientTimeout, kind: str = "default", data: Optional[Dict] = None
+    ) -> aiohttp.ClientResponse:
+        """Sends a request when its kind's bucket allows it, retrying after a 429 once the backoff has passed."""
+        attempt = 0
+        while True:
+            await self.scheduler.acquire(kind)
+            response = await self._session().request(method, f"{self.base_url}/{endpoint}", data=data, timeout=timeout)
+            if response.status != 429:
+                self.scheduler.succeeded(kind)
+                return response
+
+            backoff = self.scheduler.limited(kind, _retry_after(response))
+            Logger.warning(f"Rate limited on {endpoint}, holding back {kind} requests for {backoff:.1f} s")
+            if attempt == self.max_retries:
+                return response
+            response.release()
+            attempt += 1
+
+    async def _get(self, endpoint: str) -> Dict:
+        async with await self._request("GET", endpoint, aiohttp.ClientTimeout(total=10)) as response:
+            response.raise_for_status()
+            return await response.json(content_type=None)
+
+    async def _stream(self, endpoint: str, kind: str = "stream") -> AsyncGenerator[Dict, None]:
+        # Streams stay open for as long as the game or the session runs, only connecting may time out
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=10)
+        async with await self._request("GET", endpoint, timeout, kind) as response:
+            response.raise_for_status()
+            async for line in response.content:
+                if line.strip():
+                    yield json.loads(line)
+
+    async def _post(self, endpoint: str, kind: str = "default", data: Optional[Dict] = None) -> Tuple[int, str]:
+        async with await self._request("POST", endpoint, aiohttp.ClientTimeout(total=10), kind, data) as response:
+            return response.status, await response.text()
+
+    async def get_account(self) -> Dict:
+        return await self._get("account")
+
+    async def get_rating(self) -> int:
+        return (await self.get_account())["perfs"]["bullet"]["rating"]
+
+    def stream_events(self) -> AsyncGenerator[Dict, None]:
+        return self._stream("stream/event")
+
+    async def accept_challenge(self, challenge_id: str) -> Tuple[int, str]:
+        return await self._post(f"challenge/{challenge_id}/accept", "accept")
+
+    def stream_game(self, game_id: str) -> AsyncGenerator[Dict, None]:
+        return self._stream(f"bot/game/stream/{game_id}")
+
+    async def make_move(self, game_id: str, move: str) -> Tuple[int, str]:
+        return await self._post(f"bot/game/{game_id}/move/{move}", "move")
+
+    async def send_chat(self, game_id: str, text: str, room: str = "player") -> Tuple[int, str]:
         data = {"room": room, "text": text}
-        return self._post(f"bot/game/{game_id}/chat", data=data)
+        return await self._post(f"bot/game/{game_id}/chat", "chat", data)
 
-    def challenge(self, opponent_id: str, time_limit: int) -> requests.Response:
+    async def challenge(self, opponent_id: str, time_limit: int) -> Tuple[int, str]:
         data = {
             "clock.limit": time_limit,
             "clock.increment": 0,
             "rated": "true",
             "color": "random"
         }
-        return self._post(f"challenge/{opponent_id}", data=data)
-
-    def get_online_bots(self, max_results: int = 200) -> List[Dict]:
-        response = self._get(f"bot/online?nb={max_results}", stream=True)
-        bots = []
-        for line in response.iter_lines():
-            if line:
-                bots.append(json.loads(line))
-        return bots
+        return await self._post(f"challenge/{opponent_id}", "challenge", data)
+
+    async def get_online_bots(self, max_results: int = 200) -> List[Dict]:
+        # Only the challenger looks for bots, a 429 here must not hold back games
+        return [bot async for bot in self._stream(f"bot/online?nb={max_results}", "challenge")]
@@ -1,10 +1,12 @@
 import chess
 
 class ChatHandler:
-    def __init__(self):
-        pass
+    def __init__(self, searching: bool = False):
+        self.searching = searching
 
     def on_game_start(self, board: chess.Board, opponent: str) -> str:
+        if self.searching:
+            return f"Good luck, {opponent}! I search a few hundred positions guided by my network, read about me on Github if interested!"
         return f"Good luck, {opponent}! I dont do any search, read about me on Github if interested!"
 
     def on_win(self, board: chess.Board) -> str:
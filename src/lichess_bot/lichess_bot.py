@@ -1,32 +1,79 @@
+import asyncio
 import random
 import threading
 import time
+from collections import Counter
 from concurrent.futures import ThreadPoolExecutor
-from typing import Dict, List, Optional
+from typing import TYPE_CHECKING, Dict, List, Optional, Set, Tuple
 import traceback
 
 import chess
 
-from engine import Engine
 from utils import Logger
 from .api_client import ApiClient
 from .chat_handler import ChatHandler
+from .time_manager import TimeManager
+
+if TYPE_CHECKING:
+    from engine import Engine
 
 
 class LichessBot:
-    def __init__(self, engine: Engine, token: str, max_games: int = 5) -> None:
-        self.api = ApiClient(token)
-        self.engine: Engine = engine
-        self.chat: ChatHandler = ChatHandler()
+    """Plays every game on one asyncio event loop.
+
+    The event stream, every game stream and the challenger are coroutines, so
+    an idle game only costs an open connection. Only the forward passes run on
+    the inference_workers threads, where the inference server can batch them.
+    Pondering gets its own ponder_workers threads so speculative searches never
+    queue in front of a move whose clock is running.
+    """
+
+    def __init__(
+        self,
+        engine: "Engine",
+        token: str,
+        max_games: int = 5,
+        inference_workers: int = 8,
+        base_url: str = ApiClient.BASE_URL,
+        challenge_interval: Optional[float] = 300,
+        time_manager: Optional[TimeManager] = None,
+        ponder_top_k: int = 0,
+        ponder_workers: int = 2,
+    ) -> None:
+        self.api = ApiClient(token, base_url)
+        self.engine: "Engine" = engine
+        self.chat: ChatHandler = ChatHandler(searching=engine.searcher is not None)
         self.max_games: int = max_games
-        self.active_games: set[str] = set()
-        self.active_games_lock = threading.Lock()
-        self.executor = ThreadPoolExecutor(max_workers=max_games)
-        self.bot_id = self.get_id()
+        self.active_games: Dict[str, asyncio.Task] = {}
+        self.executor = ThreadPoolExecutor(max_workers=inference_workers)
+        self.challenge_interval = challenge_interval
+        self.bot_id = ""
         self.last_moves: Dict[str, Optional[str]] = {}
+        self.board_syncs: "Counter[str]" = Counter()
+        self.background_tasks: Set[asyncio.Task] = set()
+        self.time_manager = time_manager or TimeManager()
+        # Budget and actual think time of every move, per game
+        self.think_times: Dict[str, List[Tuple[Optional[float], float]]] = {}
+        # Answers to this many of the opponent's likely replies are computed during their turn, 0 disables pondering
+        self.ponder_top_k = ponder_top_k
+        self.ponder_executor = ThreadPoolExecutor(max_workers=ponder_workers)
+        self.ponder_tasks: Dict[str, asyncio.Task] = {}
+        # Our answer for every position pondered and the event that stops its search, by FEN after the opponent's reply
+        self.pondered: Dict[str, Dict[str, Tuple[asyncio.Future, threading.Event]]] = {}
+        # FENs after the replies pondering picked, known once the policy ranked them
+        self.ponder_predictions: Dict[str, Set[str]] = {}
+        self.ponder_results: Dict[str, "Counter[str]"] = {}
+        self.ponder_totals: "Counter[str]" = Counter()
         
-    def stats(self):
-        info = self.api.get_account()
+    @staticmethod
+    def stats(token: str, base_url: str = ApiClient.BASE_URL):
+        """Prints the account statistics, needs no engine so no model is loaded for it."""
+        asyncio.run(LichessBot._print_stats(ApiClient(token, base_url)))
+
+    @staticmethod
+    async def _print_stats(api: ApiClient):
+        async with api:
+            info = await api.get_account()
 
         matches_played = info["count"]["all"]
         wins = info["count"]["win"]
@@ -56,152 +103,202 @@ class LichessBot:
         print("=" * 30)
         
 
-    def get_id(self) -> str:
+    async def get_id(self) -> str:
         try:
-            resp = self.api.get_account()
+            resp = await self.api.get_account()
             return resp["id"]
         except:
             Logger.error("Failed to get bot ID:")
             raise
         
-    def get_our_rating(self) -> int:
+    async def get_our_rating(self) -> int:
         try:
-            resp = self.api.get_account()
+            resp = await self.api.get_account()
             return resp["perfs"]["bullet"]["rating"]
         except Exception as e:
             print("Failed to get bot rating:", e)
             raise
 
-    def make_move(self, game_id: str, move: str) -> None:
-        response = self.api.make_move(game_id, move)
-        if response.status_code != 200:
-            print("Failed to make move:", response.text)
+    async def make_move(self, game_id: str, move: str) -> None:
+        status, text = await self.api.make_move(game_id, move)
+        if status != 200:
+            print("Failed to make move:", text)
 
     def run(self) -> None:
-        threading.Thread(target=self.periodic_challenger, daemon=True).start()
-        Logger.info("Listening for incoming challenges...")
-        
-        for event in self.api.stream_events():
-            if event["type"] == "challenge":
-                challenge = event["challenge"]
-                if (
-                    challenge["variant"]["key"] == "standard" and
-                    challenge["challenger"]["id"].lower() != self.bot_id.lower()
-                ):
-                    with self.active_games_lock:
-                        if len(self.active_games) < self.max_games:
-                            Logger.info(
-                                f"Accepting challenge: {event['challenge']['id']}"
-                            )
-                            self.api.accept_challenge(event["challenge"]["id"])
-                        else:
-                            Logger.warning(
-                                "Too many active games. Declining challenge."
-                            )
-            elif event["type"] == "challengeDeclined":
-                Logger.info(f"Challenge was declined by {challenge["destUser"]["id"]}.")
-            elif event["type"] == "gameStart":
-                game_id = event["game"]["id"]
-                with self.active_games_lock:
-                    if len(self.active_games) < self.max_games:
-                        self.active_games.add(game_id)
-                        Logger.info(f"Game started: {game_id}")
-                        self.executor.submit(self.play_game_wrapper, game_id)
-                    else:
-                        Logger.warning(
-                            f"Max concurrent games reached. Ignoring game {game_id}"
-                        )
-            elif event["type"] == "gameFinish":
-                game = event["game"]
-                board = chess.Board(game["fen"])
-                our_color = game["color"]
-                game_id = game["id"]
-                status = game.get("status", {}).get("name", "unknown").lower()
-                opponent_id = game.get("opponent", {}).get("id", "Unknown")
-                result = board.result()
-
-                if (result == "1-0" and our_color == "white") or (result == "0-1" and our_color == "black"):
-                    Logger.info(f"\033[92mWe won the game {game_id} against {opponent_id}, status: {status}!\033[0m")
-                    self.send_chat(game_id, self.chat.on_win(board))
-                elif (result == "1-0" and our_color == "black") or (result == "0-1" and our_color == "white"):
-                    Logger.info(f"\033[91mWe lost the game {game_id} against {opponent_id}, status: {status}.\033[0m")
-                    self.send_chat(game_id, self.chat.on_loss(board))
-                elif status == "aborted":
-                    Logger.info(f"Game {game_id} vs {opponent_id} was aborted.")
+        asyncio.run(self.main())
+
+    async def main(self) -> None:
+        """Runs until the event stream closes, then waits for the games still going."""
+        async with self.api:
+            self.bot_id = await self.get_id()
+            challenger = asyncio.create_task(self.periodic_challenger(self.challenge_interval)) if self.challenge_interval else None
+            Logger.info("Listening for incoming challenges...")
+
+            try:
+                async for event in self.api.stream_events():
+                    await self.handle_event(event)
+
+                if self.active_games:
+                    await asyncio.gather(*self.active_games.values())
+            finally:
+                if challenger is not None:
+                    challenger.cancel()
+                for task in [*self.active_games.values(), *self.ponder_tasks.values(), *self.background_tasks]:
+                    task.cancel()
+                for pondered in list(self.pondered):
+                    self.stop_pondering(pondered)
+                self.executor.shutdown(wait=False)
+                self.ponder_executor.shutdown(wait=False, cancel_futures=True)
+
+    async def handle_event(self, event: Dict) -> None:
+        if event["type"] == "challenge":
+            challenge = event["challenge"]
+            if (
+                challenge["variant"]["key"] == "standard" and
+                challenge["challenger"]["id"].lower() != self.bot_id.lower()
+            ):
+                if len(self.active_games) < self.max_games:
+                    Logger.info(
+                        f"Accepting challenge: {event['challenge']['id']}"
+                    )
+                    await self.api.accept_challenge(event["challenge"]["id"])
                 else:
-                    Logger.info(f"Game {game_id} vs {opponent_id} ended with status {status}")
-                    self.send_chat(game_id, self.chat.on_draw(board))
-
-    def play_game_wrapper(self, game_id: str) -> None:
+                    Logger.warning(
+                        "Too many active games. Declining challenge."
+                    )
+        elif event["type"] == "challengeDeclined":
+            Logger.info(f"Challenge was declined by {event['challenge']['destUser']['id']}.")
+        elif event["type"] == "gameStart":
+            game_id = event["game"]["id"]
+            if len(self.active_games) < self.max_games:
+                Logger.info(f"Game started: {game_id}")
+                self.active_games[game_id] = asyncio.create_task(self.play_game_wrapper(game_id))
+            else:
+                Logger.warning(
+                    f"Max concurrent games reached. Ignoring game {game_id}"
+                )
+        elif event["type"] == "gameFinish":
+            game = event["game"]
+            board = chess.Board(game["fen"])
+            our_color = game["color"]
+            game_id = game["id"]
+            status = game.get("status", {}).get("name", "unknown").lower()
+            opponent_id = game.get("opponent", {}).get("id", "Unknown")
+            result = board.result()
+
+            if (result == "1-0" and our_color == "white") or (result == "0-1" and our_color == "black"):
+                Logger.info(f"\033[92mWe won the game {game_id} against {opponent_id}, status: {status}!\033[0m")
+                self.send_chat_later(game_id, self.chat.on_win(board))
+            elif (result == "1-0" and our_color == "black") or (result == "0-1" and our_color == "white"):
+                Logger.info(f"\033[91mWe lost the game {game_id} against {opponent_id}, status: {status}.\033[0m")
+                self.send_chat_later(game_id, self.chat.on_loss(board))
+            elif status == "aborted":
+                Logger.info(f"Game {game_id} vs {opponent_id} was aborted.")
+            else:
+                Logger.info(f"Game {game_id} vs {opponent_id} ended with status {status}")
+                self.send_chat_later(game_id, self.chat.on_draw(board))
+
+    async def play_game_wrapper(self, game_id: str) -> None:
         try:
-            self.play_game(game_id)
+            await self.play_game(game_id)
+        except asyncio.CancelledError:
+            raise
         except Exception as e:
             error_message = f"Game {game_id} crashed. Exception: {str(e)}\n{traceback.format_exc()}"
             Logger.error(error_message)
         finally:
-            with self.active_games_lock:
-                self.active_games.discard(game_id)
-
-    def play_game(self, game_id: str) -> None:
+            self.active_games.pop(game_id, None)
+            self.last_moves.pop(game_id, None)
+            self.stop_pondering(game_id)
+            Logger.info(f"[Game {game_id}] {self.think_time_stats(self.think_times.pop(game_id, []))}")
+            if self.ponder_top_k:
+                results = self.ponder_results.pop(game_id, Counter())
+                self.ponder_totals.update(results)
+                Logger.info(f"[Game {game_id}] {self.ponder_stats(results)}")
+
+            if self.engine.cache is not None:
+                Logger.debug(f"Policy cache: {self.engine.cache.stats()}")
+            Logger.debug(f"Board updates: {self.board_sync_stats()}")
+            Logger.debug(f"API requests: {self.api.scheduler.stats()}")
+
+    async def play_game(self, game_id: str) -> None:
         board = chess.Board()
         is_white = None
 
-        for event in self.api.stream_game(game_id):
+        async for event in self.api.stream_game(game_id):
             event_type = event["type"]
 
             if event_type == "gameFull":
-                is_white = self.handle_game_full(event, game_id, board)
+                is_white = await self.handle_game_full(event, game_id, board)
             elif event_type == "gameState":
-                self.handle_game_state(event, is_white, game_id, board)
+                await self.handle_game_state(event, is_white, game_id, board)
             elif event_type == "chatLine":
                 continue
             elif event_type == "gameFinish":
                 break
 
-    def handle_game_full(self, event: Dict, game_id: str, board: chess.Board) -> bool:
-        moves = event["state"]["moves"].split()
-        for move in moves:
-            board.push_uci(move)
+    async def handle_game_full(self, event: Dict, game_id: str, board: chess.Board) -> bool:
+        self.sync_board(game_id, board, event["state"]["moves"].split())
 
         is_white = event["white"]["id"] == self.bot_id
         Logger.info(f"[Game {game_id}] We are playing as {'white' if is_white else 'black'}!")
 
         opponent = event["black"]["name"] if is_white else event["white"]["name"]
 
-        self.send_chat(
+        self.send_chat_later(
             game_id,
             self.chat.on_game_start(board, opponent),
         )
 
         if (is_white and board.turn == chess.WHITE) or (not is_white and board.turn == chess.BLACK):
-            self.respond(game_id, board, is_white)
+            await self.respond(game_id, board, is_white, event["state"])
 
         return is_white
 
 
-    def handle_game_state(self, event: Dict, is_white: Optional[bool], game_id: str, board: chess.Board) -> None:
+    async def handle_game_state(self, event: Dict, is_white: Optional[bool], game_id: str, board: chess.Board) -> None:
         if is_white is None:
             Logger.warning(f"[Game {game_id}] Game state received before determining color.")
             return
 
         moves = event["moves"].split()
-        board.clear_stack()
-        board.reset()
-    
+        self.sync_board(game_id, board, moves)
+        if event.get("status", "started") != "started":
+            return
 
-        for move in moves:
-            board.push_uci(move)
-            
         last_move = moves[-1] if moves else None
         if self.last_moves.get(game_id) == last_move:
             return
 
         if (is_white and board.turn == chess.WHITE) or (not is_white and board.turn == chess.BLACK):
             self.last_moves[game_id] = last_move
-            self.respond(game_id, board, is_white)
+            await self.respond(game_id, board, is_white, event)
+
+    def sync_board(self, game_id: str, board: chess.Board, moves: List[str]) -> None:
+        """Pushes the moves the board hasn't seen yet, replaying the game only when the move list no longer extends the board's."""
+        played = len(board.move_stack)
+        # The whole prefix is compared, after a reconnect an earlier move can differ while the last one matches
+        extends = len(moves) >= played and all(move.uci() == uci for move, uci in zip(board.move_stack, moves))
+
+        if extends:
+            for move in moves[played:]:
+                board.push_uci(move)
+        else:
+            # A takeback or a state that diverged from ours
+            Logger.debug(f"[Game {game_id}] Move list no longer matches the board, replaying {len(moves)} moves")
+            board.reset()
+            for move in moves:
+                board.push_uci(move)
+
+        self.board_syncs["incremental" if extends else "resync"] += 1
 
-    def challenge_other_bot(self) -> None:
-        opponents = self.api.get_online_bots()
+    def board_sync_stats(self) -> str:
+        incremental, resyncs = self.board_syncs["incremental"], self.board_syncs["resync"]
+        total = incremental + resyncs
+        return f"{total} game states, {resyncs} full resyncs ({resyncs / total if total else 0.0:.1%})"
+
+    async def challenge_other_bot(self) -> None:
+        opponents = await self.api.get_online_bots()
         
         if not opponents:
             Logger.warning("No opponents found.")
@@ -216,7 +313,7 @@ class LichessBot:
             
         if our_rating is None:
             Logger.warning("Could not determine own bullet rating, will send another request")
-            our_rating = self.get_our_rating()
+            our_rating = await self.get_our_rating()
 
 
 
@@ -242,36 +339,163 @@ class LichessBot:
         username = opponent["username"]
         timelimit = random.choice([60])
 
-        response = self.api.challenge(opponent_id, timelimit)
-        if response.status_code == 200:
-            Logger.info(f"Challenge sent to {username} with rating {opponent["perfs"]["bullet"]["rating"]} for a {timelimit}s game.")
+        status, text = await self.api.challenge(opponent_id, timelimit)
+        if status == 200:
+            Logger.info(f"Challenge sent to {username} with rating {opponent['perfs']['bullet']['rating']} for a {timelimit}s game.")
         else:
             Logger.warning(
-                f"Failed to challenge {opponent_id}: {response.status_code} - {response.text}"
+                f"Failed to challenge {opponent_id}: {status} - {text}"
             )
 
-    def periodic_challenger(self) -> None:
+    async def periodic_challenger(self, interval: float) -> None:
         while True:
-            with self.active_games_lock:
-                if len(self.active_games) < self.max_games:
-                    Logger.info("Attempting to challenge an opponent.")
-                    self.challenge_other_bot()
-                else:
-                    Logger.debug("Active games ongoing. Skipping challenge.")
-                    
-            time.sleep(300)
-
-    def respond(self, game_id: str, board: chess.Board, is_white: bool) -> None:
+            if len(self.active_games) < self.max_games:
+                Logger.info("Attempting to challenge an opponent.")
+                try:
+                    await self.challenge_other_bot()
+                except Exception as e:
+                    Logger.error(f"Failed to challenge an opponent: {e}")
+            else:
+                Logger.debug("Active games ongoing. Skipping challenge.")
+
+            await asyncio.sleep(interval)
+
+    async def respond(self, game_id: str, board: chess.Board, is_white: bool, state: Dict) -> None:
         if board.is_game_over():
             return
 
-        move = self.engine.make_move(board)
-        Logger.debug(f"Game {game_id}: Made move {move}")
-        self.make_move(game_id, move)
+        budget = self.time_manager.budget(board, state, is_white)
+        started = time.perf_counter()
+
+        move = await self.pondered_move(game_id, board)
+        if move is None:
+            # The forward pass blocks, a worker thread runs it so the other games keep streaming.
+            # The game's own stream isn't read meanwhile, so the board doesn't change under it.
+            move, _ = await asyncio.get_running_loop().run_in_executor(self.executor, self.think, board, budget)
+        elapsed = time.perf_counter() - started
+        self.think_times.setdefault(game_id, []).append((budget, elapsed))
+
+        budget_text = "no clock" if budget is None else f"budget {budget:.2f}s"
+        Logger.debug(f"Game {game_id}: Made move {move}, {budget_text}, thought {elapsed:.2f}s")
+
+        if self.ponder_top_k:
+            # Started before the move is sent, the opponent may answer before the request returns
+            position = board.copy()
+            position.push(chess.Move.from_uci(str(move)))
+            if not position.is_game_over():
+                self.ponder_tasks[game_id] = asyncio.create_task(self.ponder(game_id, position, is_white, state))
+
+        await self.make_move(game_id, move)
+
+    def think(self, board: chess.Board, budget: Optional[float], stop: Optional[threading.Event] = None):
+        """Our move and how long it took, runs on a worker thread."""
+        started = time.perf_counter()
+        move = self.engine.make_move(board, time_limit=budget, stop=stop)
+        return move, time.perf_counter() - started
+
+    async def ponder(self, game_id: str, board: chess.Board, is_white: bool, state: Dict) -> None:
+        """Thinks about our answers to the opponent's most likely replies, one at a time, while it is their turn."""
+        loop = asyncio.get_running_loop()
+        pondered = self.pondered[game_id] = {}
+        try:
+            logits = await loop.run_in_executor(self.ponder_executor, self.engine.policy, board)
+            replies, _ = self.engine.legal_move_probabilities(board, logits)
+            positions = []
+            for reply in replies[: self.ponder_top_k]:
+                position = board.copy()
+                position.push(reply)
+                positions.append(position)
+            self.ponder_predictions[game_id] = {position.fen() for position in positions}
+
+            for position in positions:
+                if position.is_game_over():
+                    continue
+                budget = self.time_manager.budget(position, state, is_white)
+                stop = threading.Event()
+                future = loop.run_in_executor(self.ponder_executor, self.think, position, budget, stop)
+                pondered[position.fen()] = future, stop
+                # Shielded so stopping the pondering keeps the answer being computed for a ponder hit
+                await asyncio.shield(future)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            Logger.warning(f"[Game {game_id}] Pondering failed: {e}")
+
+    def stop_pondering(self, game_id: str, keep: Optional[str] = None) -> Optional[Dict[str, asyncio.Future]]:
+        """Stops pondering the game and every search except the one for the keep FEN.
+
+        Returns the futures pondered, None when the game wasn't pondering.
+        """
+        task = self.ponder_tasks.pop(game_id, None)
+        if task is not None:
+            task.cancel()
+
+        self.ponder_predictions.pop(game_id, None)
+        pondered = self.pondered.pop(game_id, None)
+        if pondered is None:
+            return None
+        for fen, (future, stop) in pondered.items():
+            if fen != keep:
+                # Cancelling drops searches still queued, the event ends the one already running
+                future.cancel()
+                stop.set()
+        return {fen: future for fen, (future, _) in pondered.items()}
+
+    async def pondered_move(self, game_id: str, board: chess.Board):
+        """Our pondered answer when the opponent played one of the replies we thought about, None otherwise."""
+        predictions = self.ponder_predictions.get(game_id)
+        pondered = self.stop_pondering(game_id, keep=board.fen())
+        if pondered is None:
+            return None
+
+        results = self.ponder_results.setdefault(game_id, Counter())
+        future = pondered.get(board.fen())
+        if future is None:
+            # A fast opponent can reply before the policy ranked the replies or before we got to theirs
+            results["not_ready" if predictions is None or board.fen() in predictions else "mispredicted"] += 1
+            return None
+
+        started = time.perf_counter()
+        try:
+            move, seconds = await future
+        except Exception as e:
+            Logger.warning(f"[Game {game_id}] Pondered move failed: {e}")
+            return None
+
+        # Most of the thinking happened during the opponent's turn
+        results["hits"] += 1
+        results["seconds_saved"] += max(0.0, seconds - (time.perf_counter() - started))
+        return move
+
+    @staticmethod
+    def ponder_stats(results: "Counter[str]") -> str:
+        hits, not_ready, mispredicted = results["hits"], results["not_ready"], results["mispredicted"]
+        total = hits + not_ready + mispredicted
+        return (
+            f"Pondering: {hits} of {total} replies answered from pondering ({hits / total if total else 0.0:.1%}), "
+            f"{not_ready} predicted but not pondered in time, {mispredicted} mispredicted, "
+            f"{results['seconds_saved']:.1f}s saved"
+        )
+
+    @staticmethod
+    def think_time_stats(think_times: List[Tuple[Optional[float], float]]) -> str:
+        budgeted = [(budget, elapsed) for budget, elapsed in think_times if budget is not None]
+        instant = sum(1 for budget, _ in budgeted if budget == 0)
+        return (
+            f"{len(think_times)} moves, thought {sum(elapsed for _, elapsed in budgeted):.1f}s of "
+            f"{sum(budget for budget, _ in budgeted):.1f}s budgeted, {instant} instant, "
+            f"{len(think_times) - len(budgeted)} without a clock"
+        )
+
+    def send_chat_later(self, game_id: str, text: str) -> None:
+        """Chat is paced much slower than moves, so it's sent in the background instead of holding up the game."""
+        task = asyncio.create_task(self.send_chat(game_id, text))
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
 
-    def send_chat(self, game_id: str, text: str, room: str = "player") -> None:
-        response = self.api.send_chat(game_id, text, room)
-        if response.status_code != 200:
+    async def send_chat(self, game_id: str, text: str, room: str = "player") -> None:
+        status, response_text = await self.api.send_chat(game_id, text, room)
+        if status != 200:
             Logger.warning(
-                f"Failed to send chat: {response.status_code} - {response.text}"
+                f"Failed to send chat: {status} - {response_text}"
             )
@@ -0,0 +1,159 @@
+import asyncio
+import time
+from collections import Counter
+from typing import Dict, Optional, Tuple
+
+# Requests per second and burst size for every kind of request, None is unlimited
+RATE_LIMITS: Dict[str, Tuple[Optional[float], int]] = {
+    "move": (200.0, 400),
+    "stream": (None, 0),
+    "accept": (None, 0),
+    "default": (None, 0),
+    "chat": (2.0, 10),
+    "challenge": (0.1, 1),
+}
+
+# Lower goes first, a move waiting for a token holds back every other kind
+PRIORITIES = {"move": 0, "stream": 1, "accept": 1, "default": 1, "chat": 2, "challenge": 3}
+
+
+class TokenBucket:
+    def __init__(self, rate: Optional[float], burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        if self.rate is not None:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        """Seconds until a token is available, 0 when one is available now."""
+        if self.rate is None:
+            return 0.0
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now: float) -> None:
+        if self.rate is not None:
+            self._refill(now)
+            self.tokens -= 1
+
+
+class RequestScheduler:
+    """Paces requests with a token bucket per kind and backs off a kind after a 429.
+
+    Waiting requests sleep on a condition that wakes them when a request goes
+    out or starts waiting, or when their bucket refills or their backoff ends,
+    whichever comes first. A 429 only blocks its own kind: a kind sitting out
+    its backoff doesn't hold back kinds of lower priority either. Backoff
+    doubles with every 429 in a row unless the response says how long to wait
+    in Retry-After.
+    """
+
+    def __init__(
+        self,
+        rate_limits: Optional[Dict[str, Tuple[Optional[float], int]]] = None,
+        base_backoff: float = 1.0,
+        max_backoff: float = 15 * 60,
+    ):
+        self.buckets = {kind: TokenBucket(rate, burst) for kind, (rate, burst) in (rate_limits or RATE_LIMITS).items()}
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.blocked_until: Dict[str, float] = {kind: 0.0 for kind in self.buckets}
+        self.strikes: "Counter[str]" = Counter()
+        self.waiting: "Counter[str]" = Counter()
+        self.condition: Optional[asyncio.Condition] = None
+
+        self.requests: "Counter[str]" = Counter()
+        self.queued: "Counter[str]" = Counter()
+        self.limited_responses: "Counter[str]" = Counter()
+        self.wait_seconds: Dict[str, float] = {kind: 0.0 for kind in self.buckets}
+
+    def _priority(self, kind: str) -> int:
+        return PRIORITIES.get(kind, PRIORITIES["default"])
+
+    def _delay(self, kind: str, now: float) -> Optional[float]:
+        """Seconds this request has to wait, None when it waits for a request of higher priority."""
+        blocked = self.blocked_until[kind] - now
+        if blocked > 0:
+            return blocked
+
+        priority = self._priority(kind)
+        # Only requests waiting for a token go first, a kind backing off after a 429 doesn't block the others
+        if any(
+            self.waiting[other] and self.blocked_until[other] <= now
+            for other in self.buckets
+            if self._priority(other) < priority
+        ):
+            return None
+        return self.buckets[kind].wait_time(now)
+
+    async def acquire(self, kind: str) -> None:
+        if self.condition is None:
+            # Created on first use so it belongs to the running event loop
+            self.condition = asyncio.Condition()
+
+        started = time.monotonic()
+
+        async with self.condition:
+            self.waiting[kind] += 1
+            # Every arrival wakes the others, it may be a retry of a kind that just got blocked
+            self.condition.notify_all()
+            try:
+                while True:
+                    now = time.monotonic()
+                    delay = self._delay(kind, now)
+                    if delay == 0:
+                        self.buckets[kind].take(now)
+                        break
+                    # asyncio.timeout cancels the wait in this task, wait_for would leave the lock
+                    # to a helper task that deadlocks when everything is cancelled at shutdown
+                    try:
+                        async with asyncio.timeout(delay):
+                            await self.condition.wait()
+                    except TimeoutError:
+                        pass
+            finally:
+                self.waiting[kind] -= 1
+                self.condition.notify_all()
+
+        waited = time.monotonic() - started
+        self.requests[kind] += 1
+        if waited > 0.001:
+            self.queued[kind] += 1
+            self.wait_seconds[kind] += waited
+
+    def succeeded(self, kind: str) -> None:
+        self.strikes[kind] = 0
+
+    def limited(self, kind: str, retry_after: Optional[float] = None) -> float:
+        """Blocks the kind after a 429 and returns for how many seconds."""
+        self.strikes[kind] += 1
+        self.limited_responses[kind] += 1
+        if retry_after is None:
+            retry_after = self.base_backoff * 2 ** (self.strikes[kind] - 1)
+        backoff = min(self.max_backoff, retry_after)
+        self.blocked_until[kind] = max(self.blocked_until[kind], time.monotonic() + backoff)
+        return backoff
+
+    def metrics(self) -> Dict[str, Dict[str, float]]:
+        return {
+            kind: {
+                "requests": self.requests[kind],
+                "queued": self.queued[kind],
+                "limited": self.limited_responses[kind],
+                "wait_seconds": round(self.wait_seconds[kind], 3),
+                "waiting": self.waiting[kind],
+            }
+            for kind in self.buckets
+        }
+
+    def stats(self) -> str:
+        return ", ".join(
+            f"{kind} {metrics['requests']} sent/{metrics['queued']} queued/{metrics['limited']} limited"
+            for kind, metrics in self.metrics().items()
+            if metrics["requests"] or metrics["limited"]
+        )
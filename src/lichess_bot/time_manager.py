@@ -0,0 +1,56 @@
+from typing import Dict, Optional
+
+import chess
+
+
+class TimeManager:
+    """Splits the clock Lichess streams in every game state into a thinking budget per move.
+
+    The budget is an even share of the remaining time over the moves still
+    expected, plus most of the increment. Forced moves and moves played with
+    less than panic_time left get a budget of 0, which means an instant
+    policy move.
+    """
+
+    def __init__(
+        self,
+        expected_moves: int = 60,
+        min_moves_to_go: int = 20,
+        increment_share: float = 0.8,
+        max_share: float = 0.1,
+        panic_time: float = 5.0,
+        overhead: float = 0.1,
+    ):
+        self.expected_moves = expected_moves
+        self.min_moves_to_go = min_moves_to_go
+        self.increment_share = increment_share
+        # Never spend more than this share of the remaining time on one move
+        self.max_share = max_share
+        self.panic_time = panic_time
+        # Time lost to the network and the API for every move
+        self.overhead = overhead
+
+    @staticmethod
+    def clock(state: Dict, is_white: bool):
+        """Remaining time and increment in seconds for our side, None for games without a clock."""
+        remaining = state.get("wtime" if is_white else "btime")
+        if remaining is None:
+            return None
+        return remaining / 1000, state.get("winc" if is_white else "binc", 0) / 1000
+
+    def budget(self, board: chess.Board, state: Dict, is_white: bool) -> Optional[float]:
+        """Seconds to think about this move, 0 for an instant move and None when the game has no clock."""
+        if board.legal_moves.count() <= 1:
+            return 0.0
+
+        clock = self.clock(state, is_white)
+        if clock is None:
+            return None
+
+        remaining, increment = clock
+        if remaining < self.panic_time:
+            return 0.0
+
+        moves_to_go = max(self.min_moves_to_go, self.expected_moves - board.fullmove_number)
+        budget = remaining / moves_to_go + increment * self.increment_share - self.overhead
+        return max(0.0, min(budget, remaining * self.max_share))
@@ -1,5 +1,20 @@
 from .board import Board
+from .encoding import board_to_matrix, boards_to_matrix, expand_bitboards, matrix_to_board, pack_board, pack_boards
 from .logger import Logger
-from .utils import UCI_DICT
+from .utils import GAME_RESULTS, MOVE_INDEX_TABLE, UCI_DICT, legal_move_indices, value_target
 
-__all__ = ["Board", "Logger", "UCI_DICT"]
+__all__ = [
+    "Board",
+    "GAME_RESULTS",
+    "Logger",
+    "MOVE_INDEX_TABLE",
+    "UCI_DICT",
+    "board_to_matrix",
+    "boards_to_matrix",
+    "expand_bitboards",
+    "legal_move_indices",
+    "matrix_to_board",
+    "pack_board",
+    "pack_boards",
+    "value_target",
+]
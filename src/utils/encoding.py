@@ -0,0 +1,102 @@
+from typing import Optional, Sequence, Tuple
+
+import chess
+import numpy as np
+
+PLANES = 18
+
+# Plane order matches the original per-square encoder: white pieces first
+# (pawn..king), then black pieces, followed by side to move, castling rights
+# and the normalized move counter.
+_PIECE_PLANES = [
+    (color, piece_type)
+    for color in (chess.WHITE, chess.BLACK)
+    for piece_type in chess.PIECE_TYPES
+]
+
+
+def pack_board(board: chess.Board) -> Tuple[list, list]:
+    """Compact form of a board: 12 piece bitboards and the 6 scalar features."""
+    masks = [board.pieces_mask(piece_type, color) for color, piece_type in _PIECE_PLANES]
+    flags = [
+        board.turn == chess.WHITE,
+        board.has_kingside_castling_rights(chess.WHITE),
+        board.has_queenside_castling_rights(chess.WHITE),
+        board.has_kingside_castling_rights(chess.BLACK),
+        board.has_queenside_castling_rights(chess.BLACK),
+        board.fullmove_number / 200,
+    ]
+    return masks, flags
+
+
+def pack_boards(boards: Sequence[chess.Board]) -> Tuple[np.ndarray, np.ndarray]:
+    n = len(boards)
+    masks = np.empty((n, 12), dtype="<u8")
+    flags = np.empty((n, PLANES - 12), dtype=np.float32)
+
+    for i, board in enumerate(boards):
+        masks[i], flags[i] = pack_board(board)
+
+    return masks, flags
+
+
+def expand_bitboards(masks: np.ndarray, flags: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+    """Expand (N, 12) piece bitboards and (N, 6) scalar features into out[:N]."""
+    n = len(masks)
+    if out is None:
+        out = np.empty((n, 8, 8, PLANES), dtype=np.float32)
+
+    # Little-endian bytes + little bit order puts square 0 (a1) at index 0,
+    # so reshaping to 8x8 gives the same [rank, file] layout as square // 8, square % 8.
+    raw = np.ascontiguousarray(masks, dtype="<u8").view(np.uint8).reshape(n, 12, 8)
+    bits = np.unpackbits(raw, axis=-1, bitorder="little").reshape(n, 12, 8, 8)
+
+    out[:n, :, :, :12] = bits.transpose(0, 2, 3, 1)
+    out[:n, :, :, 12:] = flags[:, None, None, :]
+    return out[:n]
+
+
+def boards_to_matrix(boards: Sequence[chess.Board], out: Optional[np.ndarray] = None) -> np.ndarray:
+    n = len(boards)
+    if out is None:
+        out = np.empty((n, 8, 8, PLANES), dtype=np.float32)
+    elif out.shape[0] < n or out.shape[1:] != (8, 8, PLANES) or out.dtype != np.float32:
+        raise ValueError(f"Output buffer of shape {out.shape} and dtype {out.dtype} cannot hold {n} boards")
+
+    masks, flags = pack_boards(boards)
+    return expand_bitboards(masks, flags, out)
+
+
+def board_to_matrix(board: chess.Board) -> np.ndarray:
+    return boards_to_matrix([board])[0]
+
+
+def matrix_to_board(matrix: np.ndarray, legal_move: Optional[chess.Move] = None) -> chess.Board:
+    """Rebuilds a board from its 8x8x18 encoding.
+
+    The en passant square isn't encoded. It is only restored when legal_move,
+    a move known to be legal in the position, is an en passant capture.
+    """
+    board = chess.Board(None)
+    squares = matrix.reshape(64, PLANES) > 0.5
+
+    piece_map = {}
+    for plane, (color, piece_type) in enumerate(_PIECE_PLANES):
+        for square in np.flatnonzero(squares[:, plane]):
+            piece_map[int(square)] = chess.Piece(piece_type, color)
+    board.set_piece_map(piece_map)
+
+    board.turn = bool(squares[0, 12])
+    castling = "".join(symbol for symbol, plane in zip("KQkq", range(13, 17)) if squares[0, plane])
+    board.set_castling_fen(castling or "-")
+    board.fullmove_number = max(1, round(float(matrix[0, 0, 17]) * 200))
+
+    # A pawn moving diagonally onto an empty square can only be capturing en passant
+    if (
+        legal_move is not None
+        and board.piece_type_at(legal_move.from_square) == chess.PAWN
+        and chess.square_file(legal_move.from_square) != chess.square_file(legal_move.to_square)
+        and board.piece_at(legal_move.to_square) is None
+    ):
+        board.ep_square = legal_move.to_square
+    return board
@@ -34,3 +34,40 @@ def generate_full_uci_move_dict():
 
 
 UCI_DICT = generate_full_uci_move_dict()
+
+# PGN result header to game outcome from white's point of view
+GAME_RESULTS = {"1-0": 1, "0-1": -1, "1/2-1/2": 0}
+
+
+def value_target(result: int, board: chess.Board) -> float:
+    """Game outcome from the side to move's point of view, the target of the value head."""
+    return float(result if board.turn == chess.WHITE else -result)
+
+
+def generate_move_index_table(move_dict):
+    """(from_square, to_square, promotion) -> index into move_dict, -1 where no entry exists.
+
+    Promotion uses the python-chess piece type, with 0 standing for no promotion.
+    """
+    table = np.full((64, 64, 7), -1, dtype=np.int32)
+
+    # Parsed by hand since the dictionary also holds from == to entries chess.Move.from_uci rejects
+    for uci, index in move_dict.items():
+        from_square = chess.parse_square(uci[0:2])
+        to_square = chess.parse_square(uci[2:4])
+        promotion = chess.PIECE_SYMBOLS.index(uci[4]) if len(uci) == 5 else 0
+        table[from_square, to_square, promotion] = index
+
+    return table
+
+
+MOVE_INDEX_TABLE = generate_move_index_table(UCI_DICT)
+_FLAT_MOVE_INDEX_TABLE = MOVE_INDEX_TABLE.reshape(-1)
+
+
+def legal_move_indices(board: chess.Board):
+    """Legal moves of the board together with their UCI_DICT indices as an int array."""
+    moves = list(board.legal_moves)
+    # One integer key per move into the flattened table is cheaper than building index tuples
+    keys = [move.from_square * 448 + move.to_square * 7 + (move.promotion or 0) for move in moves]
+    return moves, _FLAT_MOVE_INDEX_TABLE[keys]
@@ -0,0 +1,296 @@
+import asyncio
+import json
+import random
+import time
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
+
+import chess
+import numpy as np
+from aiohttp import web
+
+from utils import Logger
+
+if TYPE_CHECKING:
+    from engine import Engine
+
+_DONE = None
+
+
+class FakeLichessServer:
+    """Local stand-in for the parts of the Lichess bot API LichessBot uses.
+
+    Starts num_games games against an opponent playing random moves, or the
+    top move of opponent_engine's policy when given, streams them as NDJSON
+    like Lichess does and ends each game after max_plies. The event stream
+    closes once every game finished, so a bot's main() returns. Records how
+    long the bot took to answer every position. With a clock the bot's answer
+    times run down its clock, the opponent moves for free.
+    """
+
+    def __init__(
+        self,
+        num_games: int,
+        max_plies: int = 40,
+        opponent_delay: float = 0.0,
+        chat_limit: int = 0,
+        clock: Optional[float] = None,
+        increment: float = 0.0,
+        bot_id: str = "blundernet",
+        seed: int = 0,
+        opponent_engine: Optional["Engine"] = None,
+    ):
+        self.num_games = num_games
+        self.max_plies = max_plies
+        self.opponent_delay = opponent_delay
+        # Chat messages accepted per second before answering 429, 0 accepts all
+        self.chat_limit = chat_limit
+        self.chat_window = (0, 0)
+        self.limited_chats = 0
+        self.clock = clock
+        self.increment = increment
+        self.clocks: Dict[str, List[float]] = {}
+        self.bot_id = bot_id
+        self.rng = random.Random(seed)
+        self.opponent_engine = opponent_engine
+        self.opponent_id = "random" if opponent_engine is None else "policy"
+
+        self.boards: Dict[str, chess.Board] = {}
+        self.bot_white: Dict[str, bool] = {}
+        self.game_streams: Dict[str, asyncio.Queue] = {}
+        self.events: asyncio.Queue = asyncio.Queue()
+        self.turn_started: Dict[str, float] = {}
+        self.move_latencies: List[float] = []
+        self.finished = 0
+        self.illegal_moves = 0
+
+        self.app = web.Application()
+        self.app.add_routes([
+            web.get("/api/account", self.account),
+            web.get("/api/stream/event", self.stream_events),
+            web.get("/api/bot/game/stream/{game_id}", self.stream_game),
+            web.get("/api/bot/online", self.online_bots),
+            web.post("/api/bot/game/{game_id}/move/{move}", self.move),
+            web.post("/api/bot/game/{game_id}/chat", self.chat),
+            web.post("/api/challenge/{challenge_id}/accept", self.ok),
+            web.post("/api/challenge/{opponent_id}", self.ok),
+        ])
+        self.runner: Optional[web.AppRunner] = None
+        self.base_url = ""
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        self.runner = web.AppRunner(self.app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        host, port = self.runner.addresses[0][:2]
+        self.base_url = f"http://{host}:{port}/api"
+        return self.base_url
+
+    async def stop(self) -> None:
+        if self.runner is not None:
+            await self.runner.cleanup()
+
+    @staticmethod
+    async def _open_stream(request: web.Request) -> web.StreamResponse:
+        response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+        await response.prepare(request)
+        return response
+
+    @staticmethod
+    async def _send(response: web.StreamResponse, event: Dict) -> None:
+        await response.write((json.dumps(event) + "\n").encode())
+
+    async def account(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            "id": self.bot_id,
+            "username": self.bot_id,
+            "count": {"all": 0, "win": 0, "draw": 0, "loss": 0},
+            "perfs": {},
+        })
+
+    async def online_bots(self, request: web.Request) -> web.Response:
+        return web.Response(text="", content_type="application/x-ndjson")
+
+    async def ok(self, request: web.Request) -> web.Response:
+        return web.json_response({"ok": True})
+
+    async def chat(self, request: web.Request) -> web.Response:
+        now = time.monotonic()
+        second, count = self.chat_window
+        if int(now) != second:
+            second, count = int(now), 0
+        self.chat_window = (second, count + 1)
+
+        if self.chat_limit and count >= self.chat_limit:
+            self.limited_chats += 1
+            retry_after = second + 1 - now
+            return web.json_response({"error": "Too many requests"}, status=429, headers={"Retry-After": f"{retry_after:.3f}"})
+        return web.json_response({"ok": True})
+
+    async def stream_events(self, request: web.Request) -> web.StreamResponse:
+        response = await self._open_stream(request)
+
+        for number in range(self.num_games):
+            game_id = f"game{number:05d}"
+            self.boards[game_id] = chess.Board()
+            self.bot_white[game_id] = number % 2 == 0
+            self.clocks[game_id] = [self.clock or 0.0, self.clock or 0.0]
+            self.game_streams[game_id] = asyncio.Queue()
+            await self._send(response, {"type": "gameStart", "game": {"id": game_id}})
+
+        while self.finished < self.num_games:
+            await self._send(response, await self.events.get())
+
+        await response.write_eof()
+        return response
+
+    async def stream_game(self, request: web.Request) -> web.StreamResponse:
+        game_id = request.match_info["game_id"]
+        board = self.boards[game_id]
+        response = await self._open_stream(request)
+
+        if not self.bot_white[game_id]:
+            board.push(await self.opponent_move(board))
+        self.turn_started[game_id] = time.perf_counter()
+
+        bot = {"id": self.bot_id, "name": self.bot_id}
+        opponent = {"id": self.opponent_id, "name": self.opponent_id}
+        await self._send(response, {
+            "type": "gameFull",
+            "id": game_id,
+            "white": bot if self.bot_white[game_id] else opponent,
+            "black": opponent if self.bot_white[game_id] else bot,
+            "state": self._state(game_id),
+        })
+
+        queue = self.game_streams[game_id]
+        while True:
+            event = await queue.get()
+            if event is _DONE:
+                break
+            await self._send(response, event)
+
+        await response.write_eof()
+        return response
+
+    async def opponent_move(self, board: chess.Board) -> chess.Move:
+        if self.opponent_engine is None:
+            return self.rng.choice(list(board.legal_moves))
+
+        engine = self.opponent_engine
+        logits = await asyncio.get_running_loop().run_in_executor(None, engine.policy, board)
+        moves, _ = engine.legal_move_probabilities(board, logits)
+        return moves[0]
+
+    def _state(self, game_id: str, status: str = "started") -> Dict:
+        board = self.boards[game_id]
+        state: Dict[str, Any] = {"type": "gameState", "moves": " ".join(move.uci() for move in board.move_stack), "status": status}
+        if self.clock is not None:
+            white, black = self.clocks[game_id]
+            increment = int(self.increment * 1000)
+            state.update(wtime=int(white * 1000), btime=int(black * 1000), winc=increment, binc=increment)
+        return state
+
+    async def move(self, request: web.Request) -> web.Response:
+        game_id = request.match_info["game_id"]
+        board = self.boards[game_id]
+
+        try:
+            move = chess.Move.from_uci(request.match_info["move"])
+        except ValueError:
+            move = chess.Move.null()
+        if move not in board.legal_moves or board.turn != self.bot_white[game_id]:
+            self.illegal_moves += 1
+            return web.json_response({"error": "Not your turn, or invalid move"}, status=400)
+
+        latency = time.perf_counter() - self.turn_started[game_id]
+        self.move_latencies.append(latency)
+        side = 0 if self.bot_white[game_id] else 1
+        self.clocks[game_id][side] = max(0.0, self.clocks[game_id][side] - latency) + self.increment
+        board.push(move)
+
+        if not self._finish_if_over(game_id):
+            if self.opponent_delay:
+                await asyncio.sleep(self.opponent_delay)
+            board.push(await self.opponent_move(board))
+            if not self._finish_if_over(game_id):
+                self.turn_started[game_id] = time.perf_counter()
+                self.game_streams[game_id].put_nowait(self._state(game_id))
+
+        return web.json_response({"ok": True})
+
+    def _finish_if_over(self, game_id: str) -> bool:
+        board = self.boards[game_id]
+        if not board.is_game_over() and board.ply() < self.max_plies:
+            return False
+
+        outcome = board.outcome()
+        status = outcome.termination.name.lower() if outcome else "draw"
+        self.game_streams[game_id].put_nowait(self._state(game_id, status))
+        self.game_streams[game_id].put_nowait(_DONE)
+        self.events.put_nowait({
+            "type": "gameFinish",
+            "game": {
+                "id": game_id,
+                "fen": board.fen(),
+                "color": "white" if self.bot_white[game_id] else "black",
+                "status": {"name": status},
+                "opponent": {"id": self.opponent_id},
+            },
+        })
+        self.finished += 1
+        return True
+
+    def summary(self, elapsed: float) -> Dict[str, float]:
+        latencies = np.array(self.move_latencies or [0.0]) * 1000
+        p50, p99 = np.percentile(latencies, [50, 99])
+        return {
+            "games": self.finished,
+            "moves": len(self.move_latencies),
+            "illegal_moves": self.illegal_moves,
+            "limited_chats": self.limited_chats,
+            "seconds": elapsed,
+            "moves_per_second": len(self.move_latencies) / elapsed if elapsed else 0.0,
+            "p50_ms": float(p50),
+            "p99_ms": float(p99),
+        }
+
+
+def run_load_test(
+    engine: "Engine",
+    num_games: int = 200,
+    max_plies: int = 40,
+    inference_workers: int = 8,
+    chat_limit: int = 0,
+    clock: Optional[float] = None,
+    ponder_top_k: int = 0,
+    opponent_engine: Optional["Engine"] = None,
+) -> Dict[str, float]:
+    """Plays num_games games at once against a FakeLichessServer and reports the bot's answer times."""
+    from lichess_bot import LichessBot
+
+    async def play() -> Dict[str, float]:
+        server = FakeLichessServer(num_games, max_plies, chat_limit=chat_limit, clock=clock, opponent_engine=opponent_engine)
+        base_url = await server.start()
+        bot = LichessBot(engine, "fake-token", num_games, inference_workers, base_url, challenge_interval=None, ponder_top_k=ponder_top_k)
+
+        started = time.perf_counter()
+        try:
+            await bot.main()
+        finally:
+            await server.stop()
+        Logger.info(f"API requests: {bot.api.scheduler.stats()}")
+        if ponder_top_k:
+            Logger.info(bot.ponder_stats(bot.ponder_totals))
+        summary = server.summary(time.perf_counter() - started)
+        summary.update({f"ponder_{result}": bot.ponder_totals[result] for result in ["hits", "not_ready", "mispredicted"]})
+        return summary
+
+    Logger.info(f"Playing {num_games} games of {max_plies} plies against a local fake Lichess server")
+    summary = asyncio.run(play())
+    Logger.info(
+        f"{summary['games']} games, {summary['moves']} moves in {summary['seconds']:.1f} s "
+        f"({summary['moves_per_second']:.0f} moves/sec), answer time p50 {summary['p50_ms']:.1f} ms "
+        f"p99 {summary['p99_ms']:.1f} ms, {summary['illegal_moves']} illegal moves, {summary['limited_chats']} chats rate limited"
+    )
+    return summary
@@ -0,0 +1,29 @@
+import chess
+
+from lichess_bot import LichessBot
+
+
+class StubEngine:
+    searcher = None
+    cache = None
+
+
+def test_new_moves_are_pushed_without_a_replay():
+    bot = LichessBot(StubEngine(), "token")
+    board = chess.Board()
+    bot.sync_board("game", board, ["e2e4", "e7e5"])
+    bot.sync_board("game", board, ["e2e4", "e7e5", "g1f3"])
+
+    assert [move.uci() for move in board.move_stack] == ["e2e4", "e7e5", "g1f3"]
+    assert bot.board_syncs == {"incremental": 2}
+
+
+def test_a_diverged_earlier_move_replays_the_game():
+    bot = LichessBot(StubEngine(), "token")
+    board = chess.Board()
+    bot.sync_board("game", board, ["e2e4", "e7e5", "g1f3"])
+    # Same last move, but the server's game went d2d4 first
+    bot.sync_board("game", board, ["d2d4", "e7e5", "g1f3", "b8c6"])
+
+    assert [move.uci() for move in board.move_stack] == ["d2d4", "e7e5", "g1f3", "b8c6"]
+    assert bot.board_syncs["resync"] == 1
@@ -0,0 +1,109 @@
+import random
+
+import chess
+import numpy as np
+
+from utils import board_to_matrix, boards_to_matrix, expand_bitboards, matrix_to_board, pack_boards
+
+
+def piece_map_encoding(board: chess.Board) -> np.ndarray:
+    """The original per-square encoder the bitboard version has to match byte for byte."""
+    matrix = np.zeros((8, 8, 18), dtype=np.float32)
+
+    for square, piece in board.piece_map().items():
+        color_offset = 0 if piece.color == chess.WHITE else 6
+        matrix[square // 8, square % 8, piece.piece_type - 1 + color_offset] = 1
+
+    if board.turn == chess.WHITE:
+        matrix[:, :, 12] = 1
+    if board.has_kingside_castling_rights(chess.WHITE):
+        matrix[:, :, 13] = 1
+    if board.has_queenside_castling_rights(chess.WHITE):
+        matrix[:, :, 14] = 1
+    if board.has_kingside_castling_rights(chess.BLACK):
+        matrix[:, :, 15] = 1
+    if board.has_queenside_castling_rights(chess.BLACK):
+        matrix[:, :, 16] = 1
+    matrix[:, :, 17] = board.fullmove_number / 200
+
+    return matrix
+
+
+def random_positions(count: int, seed: int = 0):
+    rng = random.Random(seed)
+    boards = []
+    while len(boards) < count:
+        board = chess.Board()
+        for _ in range(rng.randrange(0, 120)):
+            moves = list(board.legal_moves)
+            if not moves:
+                break
+            board.push(rng.choice(moves))
+        boards.append(board)
+    return boards
+
+
+def special_positions():
+    boards = []
+    # Castling rights lost one by one
+    for fen in [
+        "r3k2r/8/8/8/8/8/8/R3K2R w KQkq - 0 1",
+        "r3k2r/8/8/8/8/8/8/R3K2R w Kq - 0 1",
+        "r3k2r/8/8/8/8/8/8/R3K2R b Qk - 0 1",
+        "r3k2r/8/8/8/8/8/8/R3K2R b - - 0 1",
+    ]:
+        boards.append(chess.Board(fen))
+
+    board = chess.Board("r3k2r/8/8/8/8/8/8/R3K2R w KQkq - 0 1")
+    for move in ["e1g1", "e8c8"]:
+        board.push_uci(move)
+        boards.append(board.copy())
+
+    # Move counters past the normalization range and promotions
+    boards.append(chess.Board("8/P6k/8/8/8/8/6Kp/8 w - - 0 150"))
+    boards.append(chess.Board("4k3/8/8/8/8/8/8/4K3 b - - 99 400"))
+    return boards
+
+
+def test_board_to_matrix_matches_piece_map_encoder():
+    for board in random_positions(300) + special_positions():
+        expected = piece_map_encoding(board)
+        actual = board_to_matrix(board)
+        assert actual.dtype == expected.dtype
+        assert actual.tobytes() == expected.tobytes(), board.fen()
+
+
+def test_batched_encoding_matches_single_boards():
+    boards = random_positions(64, seed=1) + special_positions()
+    expected = np.stack([piece_map_encoding(board) for board in boards])
+
+    assert boards_to_matrix(boards).tobytes() == expected.tobytes()
+
+    out = np.full((len(boards) + 5, 8, 8, 18), -1, dtype=np.float32)
+    assert boards_to_matrix(boards, out).tobytes() == expected.tobytes()
+
+    masks, flags = pack_boards(boards)
+    assert expand_bitboards(masks, flags).tobytes() == expected.tobytes()
+
+
+def test_matrix_to_board_round_trip():
+    for board in random_positions(100, seed=2) + special_positions():
+        rebuilt = matrix_to_board(board_to_matrix(board))
+        assert rebuilt.board_fen() == board.board_fen()
+        assert rebuilt.turn == board.turn
+        assert rebuilt.castling_rights == board.clean_castling_rights()
+        assert rebuilt.fullmove_number == board.fullmove_number
+
+
+def test_matrix_to_board_restores_en_passant_from_a_legal_move():
+    board = chess.Board()
+    for move in ["e2e4", "a7a6", "e4e5", "d7d5"]:
+        board.push_uci(move)
+    capture = chess.Move.from_uci("e5d6")
+    assert board.is_en_passant(capture)
+
+    matrix = board_to_matrix(board)
+    assert capture not in matrix_to_board(matrix).legal_moves
+    assert capture in matrix_to_board(matrix, capture).legal_moves
+    # Other moves leave the en passant square empty
+    assert matrix_to_board(matrix, chess.Move.from_uci("e5e6")).ep_square is None
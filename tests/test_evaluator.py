@@ -0,0 +1,18 @@
+import pytest
+
+from engine.evaluator import Evaluator
+
+
+def test_compare_reports_sets_missing_from_the_baseline_as_unknown():
+    results = {
+        "Random": {"accuracy": 0.5, "legal_accuracy": 0.6, "value_mae": None, "positions_per_second": 100.0},
+        "Tactics": {"accuracy": 0.1, "legal_accuracy": 0.2, "value_mae": 0.3, "positions_per_second": 10.0},
+    }
+    baseline = {"Random": {"accuracy": 0.25, "legal_accuracy": 0.5, "value_mae": None, "positions_per_second": 50.0}}
+
+    comparison = Evaluator.compare(results, baseline)
+    assert comparison["Random"]["accuracy_delta"] == pytest.approx(0.25)
+    assert comparison["Random"]["legal_accuracy_delta"] == pytest.approx(0.1)
+    assert comparison["Random"]["value_mae_delta"] is None
+    assert comparison["Random"]["speedup"] == pytest.approx(2.0)
+    assert set(comparison["Tactics"].values()) == {None}
@@ -0,0 +1,20 @@
+import pytest
+
+from engine.metrics import JsonlSink, MetricsSink, last_logged
+
+
+def test_a_sink_without_write_fails_when_created():
+    class Incomplete(MetricsSink):
+        pass
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_jsonl_sink_continues_from_the_last_step(tmp_path):
+    sink = JsonlSink(str(tmp_path / "metrics.jsonl"))
+    sink.write(1, {"loss": 2.0, "positions": 100})
+    sink.write(2, {"loss": 1.5, "positions": 200})
+    sink.close()
+
+    assert last_logged(str(tmp_path)) == (2, 200)
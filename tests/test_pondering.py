@@ -0,0 +1,65 @@
+import threading
+import time
+from typing import List, Optional
+
+import chess
+
+from fake_lichess_server import run_load_test
+
+
+class StubEngine:
+    """Ranks the legal moves by UCI and only searches when it can be stopped, no model needed."""
+
+    searcher = None
+    cache = None
+
+    def __init__(self, search_time: float = 0.01, skip: int = 0):
+        self.search_time = search_time
+        # Moves the ranking by this many places, an opponent skipping 1 always plays our second prediction
+        self.skip = skip
+        self.searches: List[float] = []
+
+    def policy(self, board: chess.Board):
+        return None
+
+    def legal_move_probabilities(self, board: chess.Board, logits):
+        moves = sorted(board.legal_moves, key=lambda move: move.uci())
+        skip = self.skip % len(moves)
+        moves = moves[skip:] + moves[:skip]
+        return moves, [1 / len(moves)] * len(moves)
+
+    def make_move(self, board: chess.Board, verbose=False, time_limit=None, stop: Optional[threading.Event] = None):
+        if stop is not None:
+            started = time.perf_counter()
+            stop.wait(self.search_time)
+            self.searches.append(time.perf_counter() - started)
+        return self.legal_move_probabilities(board, None)[0][0]
+
+
+def test_policy_opponent_replies_are_pondered():
+    summary = run_load_test(StubEngine(), num_games=2, max_plies=12, ponder_top_k=1, opponent_engine=StubEngine())
+
+    assert summary["games"] == 2 and summary["illegal_moves"] == 0
+    # Every reply but the first is predicted, the bot's first move as black isn't pondered
+    assert summary["ponder_hits"] >= 9
+    assert summary["ponder_mispredicted"] == 0
+
+
+def test_missed_ponders_stop_their_search():
+    # The opponent never plays the reply we ponder
+    engine = StubEngine(search_time=5.0)
+    summary = run_load_test(engine, num_games=1, max_plies=8, ponder_top_k=1, opponent_engine=StubEngine(skip=1))
+
+    assert summary["games"] == 1
+    assert summary["ponder_hits"] == 0 and summary["ponder_mispredicted"] >= 2
+    assert len(engine.searches) >= summary["ponder_mispredicted"]
+    assert max(engine.searches) < 1.0
+
+
+def test_replies_not_pondered_yet_are_not_mispredictions():
+    # The first search still runs when the opponent plays our second prediction
+    engine = StubEngine(search_time=5.0)
+    summary = run_load_test(engine, num_games=1, max_plies=8, ponder_top_k=2, opponent_engine=StubEngine(skip=1))
+
+    assert summary["ponder_hits"] == 0 and summary["ponder_mispredicted"] == 0
+    assert summary["ponder_not_ready"] >= 2
@@ -0,0 +1,107 @@
+import asyncio
+import time
+
+from fake_lichess_server import FakeLichessServer
+from lichess_bot.api_client import ApiClient
+from lichess_bot.request_scheduler import RequestScheduler
+
+# Slow enough that queued requests are still waiting when the next kind arrives
+SLOW_LIMITS = {"move": (5.0, 1), "default": (None, 0), "chat": (5.0, 1), "challenge": (5.0, 1)}
+
+
+def test_moves_go_before_chat_and_challenges():
+    async def run():
+        scheduler = RequestScheduler(SLOW_LIMITS)
+        for kind in ["move", "chat", "challenge"]:
+            await scheduler.acquire(kind)
+
+        order = []
+
+        async def request(kind):
+            await scheduler.acquire(kind)
+            order.append(kind)
+
+        await asyncio.gather(*[request(kind) for kind in ["challenge", "chat", "move", "chat", "move"]])
+        return order
+
+    assert asyncio.run(run()) == ["move", "move", "chat", "chat", "challenge"]
+
+
+def test_blocked_moves_do_not_hold_back_other_kinds():
+    async def run():
+        scheduler = RequestScheduler(SLOW_LIMITS)
+        scheduler.limited("move", retry_after=1.0)
+        move = asyncio.create_task(scheduler.acquire("move"))
+        await asyncio.sleep(0.01)
+
+        started = time.monotonic()
+        await scheduler.acquire("default")
+        await scheduler.acquire("chat")
+        waited = time.monotonic() - started
+
+        await move
+        return waited
+
+    assert asyncio.run(run()) < 0.1
+
+
+def test_a_limited_challenger_does_not_block_games():
+    async def run():
+        server = FakeLichessServer(0)
+        base_url = await server.start()
+        try:
+            async with ApiClient("token", base_url) as api:
+                await api.get_online_bots()
+                kinds = +api.scheduler.requests
+
+                # A 429 from the challenger's bot/online poll
+                api.scheduler.limited("challenge", retry_after=5.0)
+                started = time.monotonic()
+                status, _ = await api.accept_challenge("challenge")
+                events = [event async for event in api.stream_events()]
+                await api.get_account()
+                waited = time.monotonic() - started
+        finally:
+            await server.stop()
+        return kinds, status, events, waited
+
+    kinds, status, events, waited = asyncio.run(run())
+    assert kinds == {"challenge": 1}
+    assert status == 200 and events == []
+    assert waited < 1.0
+
+
+def test_backoff_doubles_and_resets_after_a_success():
+    scheduler = RequestScheduler(base_backoff=1.0, max_backoff=3.0)
+    assert [scheduler.limited("challenge") for _ in range(3)] == [1.0, 2.0, 3.0]
+
+    scheduler.succeeded("challenge")
+    assert scheduler.limited("challenge") == 1.0
+    assert scheduler.limited("challenge", retry_after=0.25) == 0.25
+    # Other kinds keep their own strikes
+    assert scheduler.limited("chat") == 1.0
+
+
+def test_retry_after_from_the_server_is_honoured():
+    async def run():
+        server = FakeLichessServer(0, chat_limit=2)
+        base_url = await server.start()
+        scheduler = RequestScheduler({"move": (None, 0), "default": (None, 0), "chat": (None, 0), "challenge": (None, 0)})
+        try:
+            async with ApiClient("token", base_url, scheduler=scheduler, max_retries=5) as api:
+                # Starts at the beginning of a second so every 429 asks to wait for the next one
+                await asyncio.sleep(1 - time.monotonic() % 1)
+                started = time.monotonic()
+                statuses = [status for status, _ in await asyncio.gather(*[api.send_chat("game", "hi") for _ in range(4)])]
+                elapsed = time.monotonic() - started
+        finally:
+            await server.stop()
+        return statuses, elapsed, server.limited_chats, scheduler
+
+    statuses, elapsed, limited_chats, scheduler = asyncio.run(run())
+    assert statuses == [200] * 4
+    assert limited_chats >= 2
+    assert scheduler.limited_responses["chat"] == limited_chats
+    # Two chats per second are accepted, so the last two had to wait for the next second
+    assert elapsed >= 0.8
+    assert scheduler.strikes["chat"] == 0